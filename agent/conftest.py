@@ -0,0 +1,8 @@
+import os
+import sys
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+# Make functions/shared importable when running the tests from the source tree.
+# The deployed image gets a copy of it next to main.py (see deploy_agent.yml).
+# benchmarks/ has the in-memory Firestore client the tests of sessions.py use.
+sys.path[:0] = [os.path.join(ROOT, "functions"), os.path.join(ROOT, "benchmarks")]
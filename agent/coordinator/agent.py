@@ -5,14 +5,29 @@ The agent is configured to greet the user with a wave.
 
 from google.adk.agents import Agent
 
+from .github_data import get_github_activity
+from .history import compact_history
+from .news_cache import mark_first_question
 from .sub_agents.tech_news_agent import tech_news_agent
-from .sub_agents.user_agent import user_agent
+from .sub_agents.user_agent import check_if_agent_should_run, user_agent
+from .tracing import configure_tracing, record_model_usage
+
+configure_tracing()
 
 root_agent = Agent(
     name="coordinator",
     model="gemini-2.0-flash",
     description=("Coordinate the actions of other agents."),
-    instruction=("Your role is to delegate the actions to other agents"),
-    tools=[],
+    instruction=(
+        """Your role is to delegate the actions to other agents.
+
+        When the user asks about their own GitHub repositories, starred repositories or recent GitHub activity, use the `get_github_activity` tool instead, asking only for the data you need.
+        If its 'status' is 'not_connected', tell the user to connect their GitHub account first.
+        """
+    ),
+    tools=[get_github_activity],
     sub_agents=[tech_news_agent, user_agent],
+    before_agent_callback=[check_if_agent_should_run, mark_first_question],
+    before_model_callback=compact_history,
+    after_model_callback=record_model_usage,
 )
@@ -0,0 +1,375 @@
+"""GitHub data of the connected user, cached for the agents.
+
+The github-integration function stores the user's OAuth token, encrypted, in
+the user's Firestore document. This module reads it back and fetches the
+user's repositories, starred repositories and recent events from the GitHub
+REST API, so that the agents can answer questions about the user's activity.
+
+Every resource is cached at two levels:
+
+* in memory, where it is served as is for GITHUB_DATA_TTL_SECONDS, as long
+  as the user's document still says GitHub is connected;
+* in Firestore, under users/{user_id}/github_cache/{resource}, along with
+  the ETag GitHub returned for it.
+
+Once the TTL is over, the resource is revalidated with a conditional request
+(If-None-Match). GitHub answers 304 Not Modified when nothing changed, which
+doesn't count against the rate limit, and the cached copy is kept. The
+Firestore copy lets new instances revalidate instead of fetching everything
+again, and keeps serving stale data when GitHub is unreachable. It is
+deleted by the github-integration function when the user disconnects GitHub,
+and by the users function along with the user's data.
+"""
+
+import contextvars
+import datetime
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+import requests
+from cachetools import TTLCache
+from google.adk.tools import ToolContext
+
+from .metrics import record_cache
+from .tracing import firestore_span, http_span
+
+GITHUB_API_URL = os.getenv("GITHUB_API_URL", "https://api.github.com").rstrip("/")
+GITHUB_CONNECT_TIMEOUT = float(os.getenv("GITHUB_CONNECT_TIMEOUT", "3.05"))
+GITHUB_READ_TIMEOUT = float(os.getenv("GITHUB_READ_TIMEOUT", "10"))
+# How long a resource is served from memory before being revalidated.
+GITHUB_DATA_TTL_SECONDS = float(os.getenv("GITHUB_DATA_TTL_SECONDS", "300"))
+# Users whose resources and token are kept in memory.
+GITHUB_DATA_CACHE_SIZE = int(os.getenv("GITHUB_DATA_CACHE_SIZE", "256"))
+# Items kept per resource, GitHub's first page.
+GITHUB_DATA_PAGE_SIZE = int(os.getenv("GITHUB_DATA_PAGE_SIZE", "30"))
+
+KMS_KEY_NAME = os.getenv("KMS_KEY_NAME")
+KMS_KEY_RING = os.getenv("KMS_KEY_RING")
+KMS_LOCATION = os.getenv("KMS_LOCATION")
+GOOGLE_CLOUD_PROJECT = os.getenv("GOOGLE_CLOUD_PROJECT")
+
+USERS_COLLECTION = "users"
+CACHE_COLLECTION = "github_cache"
+TOKEN_FIELDS = ["github_access_token", "github_connected", "github_login"]
+
+# Path of each resource on the GitHub API, "{login}" is the user's login.
+RESOURCES = {
+    "repos": "/user/repos?sort=updated",
+    "starred": "/user/starred",
+    "events": "/users/{login}/events",
+}
+
+_db = None
+_kms_client = None
+_cipher = None
+_session = requests.Session()
+_executor = ThreadPoolExecutor(
+    max_workers=len(RESOURCES), thread_name_prefix="github-data"
+)
+# Guards the caches below, which are read and written from the executor's
+# threads: cachetools caches aren't thread-safe, even reads expire entries.
+_lock = threading.Lock()
+# (user_id, resource) -> {"etag", "data", "fetched_at"}
+_resources = TTLCache(
+    maxsize=GITHUB_DATA_CACHE_SIZE * len(RESOURCES), ttl=GITHUB_DATA_TTL_SECONDS
+)
+# user_id -> (login, token), so that fresh reads skip Firestore and KMS.
+_credentials = TTLCache(maxsize=GITHUB_DATA_CACHE_SIZE, ttl=GITHUB_DATA_TTL_SECONDS)
+
+
+class GitHubNotConnectedError(Exception):
+    """Raised when the user has no usable GitHub token."""
+
+
+def _get_db():
+    global _db
+    if _db is None:
+        from google.cloud import firestore
+
+        _db = firestore.Client()
+    return _db
+
+
+def _get_kms_client():
+    global _kms_client
+    if _kms_client is None:
+        from google.cloud import kms
+
+        _kms_client = kms.KeyManagementServiceClient()
+    return _kms_client
+
+
+def _get_cipher():
+    global _cipher
+    if _cipher is None:
+        # The functions' envelope encryption, vendored next to the agent. Imported
+        # on the first decryption, to keep it out of the startup.
+        from shared.crypto import EnvelopeCipher
+
+        _cipher = EnvelopeCipher()
+    return _cipher
+
+
+def decrypt_token(value: str) -> str:
+    """Decrypts a token stored by the github-integration function.
+
+    The data keys of envelope-encrypted tokens are unwrapped by KMS once and
+    then kept in memory, see functions/shared/crypto.py.
+    """
+    if not all([GOOGLE_CLOUD_PROJECT, KMS_LOCATION, KMS_KEY_RING, KMS_KEY_NAME]):
+        raise RuntimeError("KMS environment variables are not fully set.")
+    client = _get_kms_client()
+    key_path = client.crypto_key_path(
+        GOOGLE_CLOUD_PROJECT, KMS_LOCATION, KMS_KEY_RING, KMS_KEY_NAME
+    )
+    return _get_cipher().decrypt(client, key_path, value)
+
+
+def _get_credentials(user_id: str) -> tuple[str, str]:
+    """Returns the user's GitHub (login, token), reading Firestore when needed."""
+    with _lock:
+        credentials = _credentials.get(user_id)
+    record_cache("github_credentials", "miss" if credentials is None else "hit")
+    if credentials is not None:
+        return credentials
+    with firestore_span("get", USERS_COLLECTION):
+        snapshot = (
+            _get_db()
+            .collection(USERS_COLLECTION)
+            .document(user_id)
+            .get(field_paths=TOKEN_FIELDS)
+        )
+    user_data = (snapshot.to_dict() or {}) if snapshot.exists else {}
+    if not user_data.get("github_connected") or not user_data.get(
+        "github_access_token"
+    ):
+        raise GitHubNotConnectedError("GitHub is not connected for this user.")
+    credentials = (
+        user_data.get("github_login", ""),
+        decrypt_token(user_data["github_access_token"]),
+    )
+    with _lock:
+        _credentials[user_id] = credentials
+    return credentials
+
+
+def _forget_user(user_id: str) -> None:
+    """Drops the user's resources and credentials kept in memory."""
+    with _lock:
+        _credentials.pop(user_id, None)
+        for resource in RESOURCES:
+            _resources.pop((user_id, resource), None)
+
+
+def _check_still_connected(user_id: str, resources: list[str]) -> None:
+    """Makes sure the user didn't disconnect GitHub since the memory was filled.
+
+    Resources served from memory would otherwise outlive a disconnect by up to
+    GITHUB_DATA_TTL_SECONDS. The check reads two fields of the user's document,
+    and is skipped when nothing is in memory, _get_credentials reading them
+    anyway.
+    """
+    with _lock:
+        credentials = _credentials.get(user_id)
+        in_memory = any((user_id, resource) in _resources for resource in resources)
+    if credentials is None and not in_memory:
+        return
+    with firestore_span("get", USERS_COLLECTION):
+        snapshot = (
+            _get_db()
+            .collection(USERS_COLLECTION)
+            .document(user_id)
+            .get(field_paths=["github_connected", "github_login"])
+        )
+    user_data = (snapshot.to_dict() or {}) if snapshot.exists else {}
+    if not user_data.get("github_connected"):
+        _forget_user(user_id)
+        raise GitHubNotConnectedError("GitHub is not connected for this user.")
+    if credentials is not None and credentials[0] != user_data.get("github_login", ""):
+        # Reconnected with another GitHub account
+        _forget_user(user_id)
+
+
+def _cache_document(user_id: str, resource: str):
+    return (
+        _get_db()
+        .collection(USERS_COLLECTION)
+        .document(user_id)
+        .collection(CACHE_COLLECTION)
+        .document(resource)
+    )
+
+
+def _summarize_repo(repo: dict) -> dict:
+    return {
+        "name": repo.get("full_name"),
+        "description": repo.get("description"),
+        "language": repo.get("language"),
+        "stars": repo.get("stargazers_count"),
+        "private": repo.get("private"),
+        "updated_at": repo.get("updated_at"),
+        "url": repo.get("html_url"),
+    }
+
+
+def _summarize_event(event: dict) -> dict:
+    payload = event.get("payload") or {}
+    summary = {
+        "type": event.get("type"),
+        "repo": (event.get("repo") or {}).get("name"),
+        "created_at": event.get("created_at"),
+    }
+    for key in ("action", "ref", "ref_type", "size"):
+        if payload.get(key) is not None:
+            summary[key] = payload[key]
+    return summary
+
+
+_SUMMARIZERS = {
+    "repos": _summarize_repo,
+    "starred": _summarize_repo,
+    "events": _summarize_event,
+}
+
+
+def _fetch_resource(user_id: str, resource: str, credentials: tuple[str, str]) -> dict:
+    """Returns a resource, revalidating or fetching it when the TTL is over.
+
+    Args:
+        user_id (str): The user's ID.
+        resource (str): One of RESOURCES.
+        credentials (tuple): The user's GitHub (login, token).
+
+    Returns:
+        dict: "data" holds the summarized items, "stale" tells whether they
+            could not be revalidated.
+    """
+    with _lock:
+        entry = _resources.get((user_id, resource))
+    if entry is not None:
+        record_cache("github_data", "hit")
+        return {"data": entry["data"], "stale": False}
+
+    cache_ref = _cache_document(user_id, resource)
+    with firestore_span("get", CACHE_COLLECTION):
+        snapshot = cache_ref.get()
+    entry = snapshot.to_dict() if snapshot.exists else None
+
+    login, token = credentials
+    headers = {
+        "Accept": "application/vnd.github+json",
+        "Authorization": f"Bearer {token}",
+    }
+    if entry and entry.get("etag"):
+        headers["If-None-Match"] = entry["etag"]
+    url = GITHUB_API_URL + RESOURCES[resource].format(login=login)
+    try:
+        with http_span("GET", url) as span:
+            response = _session.get(
+                url,
+                params={"per_page": GITHUB_DATA_PAGE_SIZE},
+                headers=headers,
+                timeout=(GITHUB_CONNECT_TIMEOUT, GITHUB_READ_TIMEOUT),
+            )
+            span.set_attribute("http.response.status_code", response.status_code)
+    except requests.exceptions.RequestException as e:
+        if entry is None:
+            raise
+        logging.warning("GitHub %s unreachable, serving cached copy: %s", resource, e)
+        record_cache("github_data", "stale")
+        return {"data": entry["data"], "stale": True}
+
+    if response.status_code == 304 and entry is not None:
+        logging.debug("GitHub %s not modified for user %s.", resource, user_id)
+        record_cache("github_data", "revalidated")
+    elif response.status_code == 200:
+        entry = {
+            "etag": response.headers.get("ETag"),
+            "data": [_SUMMARIZERS[resource](item) for item in response.json()],
+            "fetched_at": datetime.datetime.now(datetime.timezone.utc),
+        }
+        record_cache("github_data", "miss")
+        with firestore_span("set", CACHE_COLLECTION):
+            cache_ref.set(entry)
+    elif response.status_code == 401:
+        # The token was revoked on GitHub's side
+        with _lock:
+            _credentials.pop(user_id, None)
+        raise GitHubNotConnectedError("The stored GitHub token is no longer valid.")
+    elif entry is not None:
+        logging.warning(
+            "GitHub %s answered %s, serving cached copy.",
+            resource,
+            response.status_code,
+        )
+        record_cache("github_data", "stale")
+        return {"data": entry["data"], "stale": True}
+    else:
+        response.raise_for_status()
+        raise requests.exceptions.HTTPError(
+            f"Unexpected status {response.status_code} for {resource}."
+        )
+
+    with _lock:
+        _resources[(user_id, resource)] = entry
+    return {"data": entry["data"], "stale": False}
+
+
+def get_github_activity(
+    tool_context: ToolContext, resources: Optional[list[str]] = None
+) -> dict:
+    """Retrieves the user's GitHub repositories, starred repositories and recent events.
+
+    Args:
+        resources (list[str], optional): Which data to retrieve, among "repos",
+            "starred" and "events". Retrieves all of them when omitted.
+
+    Returns:
+        dict: A dictionary containing:
+              - "status": "success", "not_connected" or "error".
+              - "repos", "starred", "events": The requested data, as lists.
+              - "stale": The resources that could not be refreshed and may be outdated.
+              - "message": An optional message, e.g., for errors.
+    """
+    user_id = tool_context.state.get("user:id")
+    if not user_id:
+        return {"status": "error", "message": "User ID not available in tool_context."}
+    requested = [r for r in (resources or RESOURCES) if r in RESOURCES]
+    if not requested:
+        return {
+            "status": "error",
+            "message": f"Unknown resources, expected some of {sorted(RESOURCES)}.",
+        }
+
+    try:
+        _check_still_connected(user_id, requested)
+        # Resolved once for every resource, a cold cache reading the user's
+        # document and decrypting the token a single time.
+        credentials = _get_credentials(user_id)
+        # The resources are independent, fetch them concurrently. Each runs
+        # in a copy of the context to keep its spans under the tool call's.
+        futures = {
+            resource: _executor.submit(
+                contextvars.copy_context().run,
+                _fetch_resource,
+                user_id,
+                resource,
+                credentials,
+            )
+            for resource in requested
+        }
+        result = {"status": "success", "stale": []}
+        for resource, future in futures.items():
+            fetched = future.result()
+            result[resource] = fetched["data"]
+            if fetched["stale"]:
+                result["stale"].append(resource)
+        return result
+    except GitHubNotConnectedError as e:
+        return {"status": "not_connected", "message": str(e)}
+    except Exception as e:
+        logging.error("Error in get_github_activity: %s", e)
+        return {"status": "error", "message": str(e)}
@@ -0,0 +1,191 @@
+"""Bounds the conversation history sent to the models.
+
+ADK sends an agent the whole session with every model call: the user's
+messages, the answers, every tool call and result, and the other agents'
+turns, so that each turn of a long chat costs more than the previous one.
+Two callbacks keep the prompts bounded:
+
+* compact_history, a before_model_callback, keeps the current turn as is
+  and as many of the previous turns as fit in HISTORY_TOKEN_BUDGET. Parts
+  of previous turns longer than HISTORY_PART_TOKENS, typically the feeds
+  returned by fetch_feed, are cut first. If that's not enough, the oldest
+  turns are replaced by a digest of what the user asked and was answered,
+  of at most HISTORY_DIGEST_TOKENS.
+* evict_news_state, the after_agent_callback of tech_news_reviewer, clears
+  the fetched and summarized feeds from the state once the review is
+  written, so that they aren't stored nor carried along the next turns.
+
+The summarizer and the reviewer get no history at all, only the state their
+instructions reference: note_news_question, a before_agent_callback of
+tech_news_agent, writes the user's question there for the reviewer.
+
+Tokens are estimated from the length of the parts, about 4 characters per
+token, which is enough for a budget and needs no call to the model.
+"""
+
+import json
+import os
+from typing import Optional
+
+from google.adk.agents.callback_context import CallbackContext
+from google.adk.models import LlmRequest, LlmResponse
+from google.genai import types
+
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "16000"))
+HISTORY_PART_TOKENS = int(os.getenv("HISTORY_PART_TOKENS", "2000"))
+HISTORY_DIGEST_TOKENS = int(os.getenv("HISTORY_DIGEST_TOKENS", "500"))
+
+# The question the news pipeline answers, for the reviewer.
+NEWS_QUESTION_KEY = "news_question"
+# State written by the news pipeline for its next stages only.
+NEWS_STATE_KEYS = ("news_feed", "news_summarized", NEWS_QUESTION_KEY)
+
+_CHARS_PER_TOKEN = 4
+# Characters of a message kept in the digest.
+_DIGEST_LINE_CHARS = 200
+# How ADK passes the turns of other agents, as user contents.
+_FOREIGN_PREFIX = "For context:"
+_DIGEST_HEADER = "Digest of the earlier conversation, whose messages were left out:"
+
+
+def _part_chars(part: types.Part) -> int:
+    if part.text:
+        return len(part.text)
+    if part.function_call:
+        return len(json.dumps(part.function_call.args or {}, default=str))
+    if part.function_response:
+        return len(json.dumps(part.function_response.response or {}, default=str))
+    return 0
+
+
+def estimate_tokens(contents: list[types.Content]) -> int:
+    """Estimated number of tokens of the contents."""
+    chars = sum(
+        _part_chars(part) for content in contents for part in content.parts or []
+    )
+    return chars // _CHARS_PER_TOKEN
+
+
+def _is_user_message(content: types.Content) -> bool:
+    """Whether the content is a message of the user, starting a turn."""
+    parts = content.parts or []
+    return (
+        content.role == "user"
+        and bool(parts)
+        and parts[0].text is not None
+        and not parts[0].text.startswith(_FOREIGN_PREFIX)
+    )
+
+
+def _cut_part(part: types.Part, max_chars: int) -> types.Part:
+    """A copy of the part shortened to about max_chars."""
+    if _part_chars(part) <= max_chars:
+        return part
+    if part.text:
+        return types.Part(text=part.text[:max_chars] + " [...]")
+    if part.function_response:
+        # Keeps the short fields of the result, e.g. its status and message,
+        # so that the call still has a response.
+        response, omitted = {}, []
+        for key, value in (part.function_response.response or {}).items():
+            if len(json.dumps(value, default=str)) <= _DIGEST_LINE_CHARS:
+                response[key] = value
+            else:
+                omitted.append(key)
+        response["omitted_from_history"] = omitted
+        return types.Part(
+            function_response=types.FunctionResponse(
+                id=part.function_response.id,
+                name=part.function_response.name,
+                response=response,
+            )
+        )
+    return part
+
+
+def _digest(contents: list[types.Content]) -> Optional[types.Content]:
+    """A short account of the messages of the contents, the latest first kept."""
+    lines = []
+    for content in contents:
+        for part in content.parts or []:
+            text = (part.text or "").strip()
+            # Tool calls and results, passed as text for other agents' turns
+            if (
+                not text
+                or text == _FOREIGN_PREFIX
+                or " tool returned result:" in text
+                or " called tool `" in text
+            ):
+                continue
+            speaker = "User" if _is_user_message(content) else "Assistant"
+            if text.startswith("[") and "] said: " in text:
+                speaker, text = text[1:].split("] said: ", 1)
+            text = " ".join(text.split())
+            if len(text) > _DIGEST_LINE_CHARS:
+                text = text[:_DIGEST_LINE_CHARS] + "..."
+            lines.append(f"- {speaker}: {text}")
+
+    kept, chars = [], len(_DIGEST_HEADER)
+    for line in reversed(lines):
+        chars += len(line) + 1
+        if chars > HISTORY_DIGEST_TOKENS * _CHARS_PER_TOKEN:
+            break
+        kept.append(line)
+    if not kept:
+        return None
+    text = "\n".join([_DIGEST_HEADER, *reversed(kept)])
+    return types.Content(role="user", parts=[types.Part(text=text)])
+
+
+def compact_history(
+    callback_context: CallbackContext, llm_request: LlmRequest
+) -> Optional[LlmResponse]:
+    """before_model_callback fitting the previous turns in the token budget."""
+    contents = llm_request.contents
+    turns = [i for i, content in enumerate(contents) if _is_user_message(content)]
+    if not turns or turns[-1] == 0:
+        return None
+    current = turns[-1]
+    budget = HISTORY_TOKEN_BUDGET - estimate_tokens(contents[current:])
+    history = contents[:current]
+    if estimate_tokens(history) <= budget:
+        return None
+
+    max_chars = HISTORY_PART_TOKENS * _CHARS_PER_TOKEN
+    history = [
+        types.Content(
+            role=content.role,
+            parts=[_cut_part(part, max_chars) for part in content.parts or []],
+        )
+        for content in history
+    ]
+    if estimate_tokens(history) > budget:
+        # Drops whole turns, the oldest first, so that every tool call keeps
+        # its response.
+        sizes = [estimate_tokens([content]) for content in history]
+        start = next(
+            (t for t in turns[:-1] if sum(sizes[t:]) <= budget),
+            current,
+        )
+        digest = _digest(history[:start])
+        history = ([digest] if digest else []) + history[start:]
+    llm_request.contents = history + contents[current:]
+    return None
+
+
+def note_news_question(callback_context: CallbackContext) -> Optional[types.Content]:
+    """before_agent_callback writing the user's question for the news reviewer."""
+    content = callback_context.user_content
+    parts = (content.parts or []) if content is not None else []
+    callback_context.state[NEWS_QUESTION_KEY] = " ".join(
+        part.text for part in parts if part.text
+    )
+    return None
+
+
+def evict_news_state(callback_context: CallbackContext) -> Optional[types.Content]:
+    """after_agent_callback clearing the feeds the news pipeline is done with."""
+    for key in NEWS_STATE_KEYS:
+        if callback_context.state.get(key) is not None:
+            callback_context.state[key] = None
+    return None
@@ -0,0 +1,206 @@
+"""Prometheus metrics of the agent server, served on /metrics.
+
+Most metrics are derived from the spans ADK and tracing.py already create:
+a span processor turns each finished invocation, agent run, model call,
+tool call and Firestore call into observations, so the code paths are
+instrumented once for both. HTTP requests are measured by an ASGI
+middleware and cache lookups are counted where they happen.
+"""
+
+import os
+import time
+from typing import Optional
+
+from fastapi import FastAPI, Response
+from opentelemetry import trace
+from opentelemetry.sdk.trace import (ReadableSpan, Span, SpanProcessor,
+                                     TracerProvider)
+from opentelemetry.trace import StatusCode
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY,
+                               CollectorRegistry, Counter, Gauge, Histogram,
+                               generate_latest, multiprocess)
+
+# Agent runs and model calls last seconds, tool calls tens of milliseconds.
+_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 80)
+
+HTTP_REQUESTS = Counter(
+    "agent_http_requests_total",
+    "HTTP requests handled, by route and status code.",
+    ["method", "route", "status"],
+)
+HTTP_REQUEST_DURATION = Histogram(
+    "agent_http_request_duration_seconds",
+    "Time to fully send the response of an HTTP request.",
+    ["method", "route"],
+    buckets=_LATENCY_BUCKETS,
+)
+INVOCATIONS_IN_PROGRESS = Gauge(
+    "agent_invocations_in_progress",
+    "Invocations of the agent, i.e. session turns, currently running.",
+    multiprocess_mode="livesum",
+)
+AGENT_RUN_DURATION = Histogram(
+    "agent_run_duration_seconds",
+    "Duration of an agent's run, sub-agents included.",
+    ["agent"],
+    buckets=_LATENCY_BUCKETS,
+)
+MODEL_CALL_DURATION = Histogram(
+    "agent_model_call_duration_seconds",
+    "Duration of a model call.",
+    ["agent", "model"],
+    buckets=_LATENCY_BUCKETS,
+)
+MODEL_TOKENS = Counter(
+    "agent_model_tokens_total",
+    "Tokens used by model calls, by type (input, output, cached_input).",
+    ["agent", "model", "type"],
+)
+TOOL_CALL_DURATION = Histogram(
+    "agent_tool_call_duration_seconds",
+    "Duration of a tool call, by outcome.",
+    ["tool", "status"],
+    buckets=_LATENCY_BUCKETS,
+)
+FIRESTORE_RPCS = Counter(
+    "agent_firestore_rpcs_total",
+    "Firestore calls made by the tools.",
+    ["operation", "collection", "status"],
+)
+CACHE_REQUESTS = Counter(
+    "agent_cache_requests_total",
+    "Cache lookups, by cache and result (hit, miss, revalidated, stale).",
+    ["cache", "result"],
+)
+
+_TOKEN_ATTRIBUTES = {
+    "gen_ai.usage.input_tokens": "input",
+    "gen_ai.usage.output_tokens": "output",
+    "gen_ai.usage.cached_input_tokens": "cached_input",
+}
+
+
+def _seconds(span: ReadableSpan) -> float:
+    return (span.end_time - span.start_time) / 1e9
+
+
+def _status(span: ReadableSpan) -> str:
+    return "error" if span.status.status_code == StatusCode.ERROR else "ok"
+
+
+class SpanMetricsProcessor(SpanProcessor):
+    """Records the metrics of the spans ADK and the tools create.
+
+    Relies on the span names of ADK's telemetry: "invocation",
+    "agent_run [<agent>]", "call_llm" and "execute_tool <tool>".
+    """
+
+    def on_start(self, span: Span, parent_context=None) -> None:
+        if span.name == "invocation":
+            INVOCATIONS_IN_PROGRESS.inc()
+
+    def on_end(self, span: ReadableSpan) -> None:
+        name = span.name
+        attributes = span.attributes or {}
+        if name == "invocation":
+            INVOCATIONS_IN_PROGRESS.dec()
+        elif name.startswith("agent_run ["):
+            AGENT_RUN_DURATION.labels(name[len("agent_run [") : -1]).observe(
+                _seconds(span)
+            )
+        elif name == "call_llm":
+            agent = attributes.get("gen_ai.agent.name", "unknown")
+            model = attributes.get("gen_ai.request.model", "unknown")
+            MODEL_CALL_DURATION.labels(agent, model).observe(_seconds(span))
+            for attribute, token_type in _TOKEN_ATTRIBUTES.items():
+                if attribute in attributes:
+                    MODEL_TOKENS.labels(agent, model, token_type).inc(
+                        attributes[attribute]
+                    )
+        elif name.startswith("execute_tool "):
+            TOOL_CALL_DURATION.labels(
+                name[len("execute_tool ") :], _status(span)
+            ).observe(_seconds(span))
+        elif attributes.get("db.system") == "firestore":
+            FIRESTORE_RPCS.labels(
+                attributes.get("db.operation.name"),
+                attributes.get("db.collection.name"),
+                _status(span),
+            ).inc()
+
+    def shutdown(self) -> None:
+        pass
+
+    def force_flush(self, timeout_millis: int = 30000) -> bool:
+        return True
+
+
+class MetricsMiddleware:
+    """ASGI middleware counting and timing the HTTP requests.
+
+    Requests are labelled by their route template, e.g.
+    "/apps/{app_name}/users/{user_id}/sessions", to keep the number of
+    series bounded. The duration runs until the last byte of the body, which
+    covers streamed answers.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] == "/metrics":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = scope.get("route")
+            route = getattr(route, "path", None) or "unmatched"
+            method = scope["method"]
+            HTTP_REQUESTS.labels(method, route, str(status)).inc()
+            HTTP_REQUEST_DURATION.labels(method, route).observe(
+                time.perf_counter() - start
+            )
+
+
+def record_cache(cache: str, result: str) -> None:
+    CACHE_REQUESTS.labels(cache, result).inc()
+
+
+def _metrics_endpoint() -> Response:
+    registry = REGISTRY
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        # Several workers serve the app, report the metrics of all of them
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
+
+
+def instrument(app: FastAPI, provider: Optional[TracerProvider] = None) -> None:
+    """Serves /metrics on app and starts recording the metrics.
+
+    Args:
+        app: The ADK FastAPI app.
+        provider: The provider whose spans are measured, the global one by
+            default. ADK's server installs an SDK provider before this runs.
+    """
+    if provider is None:
+        provider = trace.get_tracer_provider()
+        if not isinstance(provider, TracerProvider):
+            provider = TracerProvider()
+            trace.set_tracer_provider(provider)
+    provider.add_span_processor(SpanMetricsProcessor())
+    app.add_middleware(MetricsMiddleware)
+    app.add_api_route(
+        "/metrics", _metrics_endpoint, methods=["GET"], include_in_schema=False
+    )
@@ -0,0 +1,275 @@
+"""Answers of the news pipeline, replayed when the same news is asked again.
+
+Many users ask for the same news within minutes ("latest AWS announcements"),
+each question running tech_news_agent's three stages and their model calls.
+The reviewed answer is kept in memory instead, keyed by:
+
+* the date window of the question: "today", "yesterday", "this week", "this
+  month", or the latest news of the day by default;
+* the feed URIs written in the question, if any;
+* the question's intent, its words lowercased and sorted, without the words
+  that don't change the answer ("what", "latest", "news"...).
+
+A question reduced to an empty intent and no URIs, e.g. "what's new?" or
+"what can you do?", is neither cached nor answered from the cache: its key
+would be shared by too many unrelated questions.
+
+With NEWS_CACHE_SIMILARITY set, e.g. to 0.9, a question whose intent is that
+close (cosine of their character trigrams, a local stand-in for an
+embedding) to a cached one in the same window gets its answer too.
+
+An answer is replayed as is for NEWS_CACHE_TTL_SECONDS. Past that, its
+feeds are revalidated with conditional requests (If-None-Match and
+If-Modified-Since): the answer is kept while every feed answers 304 Not
+Modified, and dropped as soon as one changed or can't be revalidated.
+
+Only the first question of a session is cached and answered from the cache,
+being the only one whose answer doesn't depend on the rest of the
+conversation: a follow-up such as "and AWS yesterday?" has the key of another
+user's "AWS news from yesterday". Answers are only replayed by tech_news_agent,
+once the coordinator routed the question to it, which skips the pipeline's
+model calls.
+"""
+
+import asyncio
+import datetime
+import math
+import os
+import re
+import threading
+from collections import Counter
+from typing import Optional
+
+from cachetools import TTLCache
+from google.adk.agents.callback_context import CallbackContext
+from google.adk.tools import ToolContext
+from google.genai import types
+
+from .metrics import record_cache
+from .tracing import http_span
+
+# How long an answer is replayed before its feeds are revalidated.
+NEWS_CACHE_TTL_SECONDS = float(os.getenv("NEWS_CACHE_TTL_SECONDS", "600"))
+# How long an answer is kept at most, revalidated or not.
+NEWS_CACHE_MAX_AGE_SECONDS = float(os.getenv("NEWS_CACHE_MAX_AGE_SECONDS", "21600"))
+NEWS_CACHE_SIZE = int(os.getenv("NEWS_CACHE_SIZE", "512"))
+# Minimum similarity of two intents sharing an answer, 0 to only match
+# identical ones.
+NEWS_CACHE_SIMILARITY = float(os.getenv("NEWS_CACHE_SIMILARITY", "0"))
+
+ANSWER_KEY = "news_reviewed"
+# The invocation of the session's first question, see _is_first_question.
+FIRST_INVOCATION_KEY = "first_invocation_id"
+
+_URI = re.compile(r"https?://[^\s,;()<>\"']+")
+_WORD = re.compile(r"[a-z0-9][a-z0-9.+#-]*")
+_WINDOWS = {
+    "today": "day",
+    "yesterday": "yesterday",
+    "week": "week",
+    "weekly": "week",
+    "month": "month",
+    "monthly": "month",
+}
+_FILLER_WORDS = frozenset(
+    """a about all am an and any announcement announcements are as at be
+    blog blogs can could do feed feeds fetch find for from get give hear i
+    in info is it know last latest let me most my new news of on or please
+    post posts recent rss s show some tell that the their there this to up
+    update updates us want what whats which with would you""".split()
+)
+
+_lock = threading.Lock()
+# (window, uris, intent) -> {"answer", "feeds", "checked_at"}, "feeds"
+# mapping the URI of each feed read to its ETag and Last-Modified.
+_answers = TTLCache(maxsize=NEWS_CACHE_SIZE, ttl=NEWS_CACHE_MAX_AGE_SECONDS)
+# Invocation ID -> the "feeds" of the answer being written.
+_fetched = TTLCache(maxsize=256, ttl=600)
+
+
+def _now() -> datetime.datetime:
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def _window(words: list[str]) -> str:
+    """The period of the news asked for, e.g. "week:2026-W42"."""
+    today = _now().date()
+    for word in words:
+        period = _WINDOWS.get(word)
+        if period == "yesterday":
+            return f"day:{today - datetime.timedelta(days=1)}"
+        if period == "week":
+            year, week, _ = today.isocalendar()
+            return f"week:{year}-W{week:02d}"
+        if period == "month":
+            return f"month:{today:%Y-%m}"
+        if period == "day":
+            break
+    return f"day:{today}"
+
+
+def cache_key(question: str) -> tuple[str, tuple[str, ...], str]:
+    """The (date window, feed URIs, intent) of a question."""
+    uris = tuple(sorted({uri.rstrip(".").lower() for uri in _URI.findall(question)}))
+    words = _WORD.findall(_URI.sub(" ", question.lower()))
+    words = [word.rstrip(".") for word in words]
+    intent = " ".join(
+        sorted({w for w in words if w not in _FILLER_WORDS and w not in _WINDOWS})
+    )
+    return _window(words), uris, intent
+
+
+def _cacheable(key: tuple) -> bool:
+    """Whether a key is specific enough to share an answer: URIs or an intent."""
+    return bool(key[1] or key[2])
+
+
+def _trigrams(intent: str) -> Counter:
+    padded = f"  {intent} "
+    return Counter(padded[i : i + 3] for i in range(len(padded) - 2))
+
+
+def _similarity(a: Counter, b: Counter) -> float:
+    dot = sum(count * b[trigram] for trigram, count in a.items())
+    norms = math.sqrt(sum(v * v for v in a.values())) * math.sqrt(
+        sum(v * v for v in b.values())
+    )
+    return dot / norms if norms else 0.0
+
+
+def _find(key: tuple) -> tuple[Optional[tuple], Optional[dict]]:
+    """The cached answer of a key, or of the closest one if similarity is on."""
+    with _lock:
+        entry = _answers.get(key)
+        if entry is not None or NEWS_CACHE_SIMILARITY <= 0 or not key[2]:
+            return key, entry
+        trigrams = _trigrams(key[2])
+        best, best_score = None, NEWS_CACHE_SIMILARITY
+        for other in list(_answers.keys()):
+            if other[:2] != key[:2] or not other[2]:
+                continue
+            score = _similarity(trigrams, _trigrams(other[2]))
+            if score >= best_score:
+                best, best_score = other, score
+        return best, _answers.get(best) if best else None
+
+
+def _feeds_not_modified(feeds: dict) -> bool:
+    """Whether every feed answers 304 Not Modified to a conditional request."""
+    # Imported on the first revalidation, to keep it out of the startup
+    from feedparser import parse
+
+    for uri, validators in feeds.items():
+        if not any(validators.values()):
+            return False
+        with http_span("GET", uri) as span:
+            feed = parse(uri, **validators)
+            if "status" in feed:
+                span.set_attribute("http.response.status_code", feed.status)
+        if feed.get("status") != 304:
+            return False
+    return True
+
+
+async def lookup(question: str) -> Optional[str]:
+    """The cached answer to a question, revalidated if needed, or None."""
+    key = cache_key(question)
+    if not _cacheable(key):
+        return None
+    key, entry = _find(key)
+    if entry is None:
+        record_cache("news", "miss")
+        return None
+    if (_now() - entry["checked_at"]).total_seconds() < NEWS_CACHE_TTL_SECONDS:
+        record_cache("news", "hit")
+        return entry["answer"]
+
+    if await asyncio.to_thread(_feeds_not_modified, entry["feeds"]):
+        entry["checked_at"] = _now()
+        record_cache("news", "revalidated")
+        return entry["answer"]
+    with _lock:
+        if _answers.get(key) is entry:
+            del _answers[key]
+    record_cache("news", "stale")
+    return None
+
+
+def record_feed(tool_context: ToolContext, uri: str, feed) -> None:
+    """Notes a feed read by fetch_feed for the answer being written.
+
+    A feed that failed to be read, `feed` being None, keeps the answer out of
+    the cache.
+    """
+    validators = None
+    if feed is not None:
+        validators = {"etag": feed.get("etag"), "modified": feed.get("modified")}
+    with _lock:
+        feeds = _fetched.setdefault(tool_context.invocation_id, {})
+        feeds[uri] = validators
+
+
+def _question(callback_context: CallbackContext) -> Optional[str]:
+    content = callback_context.user_content
+    if content is None or not content.parts:
+        return None
+    return " ".join(part.text for part in content.parts if part.text) or None
+
+
+def _is_first_question(callback_context: CallbackContext) -> bool:
+    """Whether the current invocation answers the session's first question.
+
+    The first invocation of a session notes its ID in the state, from the
+    coordinator's callback, the runner always starting a session with the root
+    agent. Later ones, whichever agent the runner resumes, find another ID
+    there.
+    """
+    first_invocation_id = callback_context.state.get(FIRST_INVOCATION_KEY)
+    if first_invocation_id is None:
+        callback_context.state[FIRST_INVOCATION_KEY] = callback_context.invocation_id
+        return True
+    return first_invocation_id == callback_context.invocation_id
+
+
+def mark_first_question(callback_context: CallbackContext) -> Optional[types.Content]:
+    """Coordinator's before_agent_callback noting the session's first question."""
+    _is_first_question(callback_context)
+    return None
+
+
+async def replay_news(callback_context: CallbackContext) -> Optional[types.Content]:
+    """tech_news_agent's before_agent_callback answering cached first questions."""
+    question = _question(callback_context)
+    if question is None or not _is_first_question(callback_context):
+        return None
+    answer = await lookup(question)
+    if answer is None:
+        return None
+    callback_context.state[ANSWER_KEY] = answer
+    return types.Content(role="model", parts=[types.Part(text=answer)])
+
+
+def store_news(callback_context: CallbackContext) -> Optional[types.Content]:
+    """tech_news_agent's after_agent_callback caching the reviewed answer."""
+    with _lock:
+        feeds = _fetched.pop(callback_context.invocation_id, None)
+    question = _question(callback_context)
+    answer = callback_context.state.get(ANSWER_KEY)
+    if (
+        not feeds
+        or None in feeds.values()
+        or not answer
+        or question is None
+        or not _is_first_question(callback_context)
+    ):
+        return None
+    key = cache_key(question)
+    if not _cacheable(key):
+        return None
+    with _lock:
+        _answers[key] = {
+            "answer": answer,
+            "feeds": feeds,
+            "checked_at": _now(),
+        }
+    return None
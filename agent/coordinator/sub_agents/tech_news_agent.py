@@ -1,8 +1,19 @@
-from feedparser import parse
 from google.adk.agents import Agent, SequentialAgent
+from google.adk.tools import ToolContext
 
+from ..history import compact_history, evict_news_state, note_news_question
+from ..news_cache import record_feed, replay_news, store_news
+from ..tracing import http_span, record_model_usage
 
-def fetch_feed(uri: str) -> dict:
+
+def _parse(uri: str):
+    # Imported on the first fetch, to keep it out of the startup
+    from feedparser import parse
+
+    return parse(uri)
+
+
+def fetch_feed(uri: str, tool_context: ToolContext) -> dict:
     """Retrieves a RSS feed content by its URI.
 
     Args:
@@ -15,7 +26,12 @@ def fetch_feed(uri: str) -> dict:
               Includes as well a status code and message indicating on whether it was successful on retrieving the feed.
               The feed's content is in the 'entries' key, which is a list of feed entries
     """
-    feed = parse(uri)
+    with http_span("GET", uri) as span:
+        feed = _parse(uri)
+        if "status" in feed:
+            span.set_attribute("http.response.status_code", feed.status)
+    # Its ETag and Last-Modified revalidate the cached answer, see news_cache
+    record_feed(tool_context, uri, feed if feed.bozo != 1 else None)
     if feed.bozo != 1:
         return {
             "status": "success",
@@ -59,6 +75,8 @@ tech_news_retriever = Agent(
     ),
     output_key="news_feed",
     tools=[fetch_feed],
+    before_model_callback=compact_history,
+    after_model_callback=record_model_usage,
 )
 
 tech_news_summarizer = Agent(
@@ -89,6 +107,9 @@ tech_news_summarizer = Agent(
     """
     ),
     output_key="news_summarized",
+    # The feed comes from the state, the conversation isn't needed
+    include_contents="none",
+    after_model_callback=record_model_usage,
 )
 
 tech_news_reviewer = Agent(
@@ -102,13 +123,18 @@ tech_news_reviewer = Agent(
         The review should be concise and focused on the main points of the feed.
         At the end provide, the key takeaways from the feed.
         
-        If some entries are not relevant, you should remove them and indicate it in your feedback.
+        If some entries are not relevant to the user's request, you should remove them and indicate it in your feedback.
         
         After the review, you should ask the user if he would like to either :
         * know more about a specific entry
         * find similar news in other feeds
         * or if he would like to add the feeds to a watchlist.
 
+        The user's request:
+        ```
+        {news_question}
+        ```
+
         Data to review:
         ```
         {news_summarized}
@@ -118,6 +144,10 @@ tech_news_reviewer = Agent(
     """
     ),
     output_key="news_reviewed",
+    # The summaries and the user's request come from the state
+    include_contents="none",
+    after_model_callback=record_model_usage,
+    after_agent_callback=evict_news_state,
 )
 
 
@@ -125,4 +155,6 @@ tech_news_agent = SequentialAgent(
     name="tech_news_agent",
     description=("Fetch and summarize RSS feeds."),
     sub_agents=[tech_news_retriever, tech_news_summarizer, tech_news_reviewer],
+    before_agent_callback=[replay_news, note_news_question],
+    after_agent_callback=store_news,
 )
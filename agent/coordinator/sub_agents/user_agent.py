@@ -4,9 +4,23 @@ from google.adk.agents import Agent
 from google.adk.agents.callback_context import CallbackContext
 from google.adk.tools import ToolContext
 from google.adk.tools.agent_tool import AgentTool
-from google.cloud import firestore
 from google.genai import types
 
+from ..history import compact_history
+from ..tracing import firestore_span, record_model_usage
+
+_db = None
+
+
+def _get_db():
+    global _db
+    if _db is None:
+        # Imported on the first call of a tool, to keep it out of the startup
+        from google.cloud import firestore
+
+        _db = firestore.Client()
+    return _db
+
 
 def check_if_agent_should_run(
     callback_context: CallbackContext,
@@ -35,9 +49,10 @@ def get_user_profile_metadata(tool_context: ToolContext) -> dict:
                 "message": "User ID not available in tool_context.",
             }
 
-        db = firestore.Client()
-        doc_ref = db.collection("users").document(user_id)
-        doc = doc_ref.get()
+        doc_ref = _get_db().collection("users").document(user_id)
+        # Only the metadata is needed, leave the rest of the profile out of the read.
+        with firestore_span("get", "users"):
+            doc = doc_ref.get(field_paths=["metadata"])
 
         if doc.exists:
             user_data = doc.to_dict()
@@ -94,13 +109,13 @@ def modify_user_profile_metadata(new_metadata: dict, tool_context: ToolContext)
                 "message": "User ID not available in tool_context.",
             }
 
-        db = firestore.Client()
-        doc_ref = db.collection("users").document(user_id)
+        doc_ref = _get_db().collection("users").document(user_id)
 
         # This will create the document if it doesn't exist,
         # and create/overwrite the metadata field within it.
         # Other top-level fields in the document will not be affected if they exist.
-        doc_ref.set({"metadata": new_metadata}, merge=True)
+        with firestore_span("set", "users"):
+            doc_ref.set({"metadata": new_metadata}, merge=True)
 
         return {
             "status": "success",
@@ -141,6 +156,7 @@ user_retriever = Agent(
     ),
     tools=[get_user_profile_metadata],
     output_key="result",
+    after_model_callback=record_model_usage,
 )
 
 user_modifier = Agent(
@@ -170,6 +186,7 @@ user_modifier = Agent(
     ),
     tools=[modify_user_profile_metadata],
     output_key="result",
+    after_model_callback=record_model_usage,
 )
 
 user_agent = Agent(
@@ -224,4 +241,6 @@ user_agent = Agent(
         AgentTool(agent=user_modifier),
     ],
     before_agent_callback=check_if_agent_should_run,
+    before_model_callback=compact_history,
+    after_model_callback=record_model_usage,
 )
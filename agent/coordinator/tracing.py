@@ -0,0 +1,133 @@
+"""OpenTelemetry tracing of the agent's tools and model calls.
+
+ADK already traces each invocation, agent run, model call and tool call.
+This module adds client spans around the calls the tools make to other
+services (Firestore, KMS, GitHub, RSS feeds) and records the token usage of
+each model call on ADK's `call_llm` span.
+
+Spans are exported over OTLP/HTTP when OTEL_EXPORTER_OTLP_ENDPOINT (or
+OTEL_EXPORTER_OTLP_TRACES_ENDPOINT) is set, alongside whatever exporters the
+ADK server installed itself.
+"""
+
+import contextlib
+import logging
+import os
+from typing import Optional
+
+from google.adk.agents.callback_context import CallbackContext
+from google.adk.models import LlmResponse
+from opentelemetry import context, propagate, trace
+from opentelemetry.trace import SpanKind
+
+SERVICE_NAME = "agent"
+
+TRACER = trace.get_tracer("reomir.agent")
+
+_configured = False
+
+
+def configure_tracing() -> None:
+    """Exports spans over OTLP if an endpoint is configured.
+
+    `adk api_server` installs its own TracerProvider before loading the
+    agent, the exporter is added to it. Otherwise a provider is installed.
+    """
+    global _configured
+    if _configured or not (
+        os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT")
+        or os.getenv("OTEL_EXPORTER_OTLP_TRACES_ENDPOINT")
+    ):
+        return
+    try:
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import \
+            OTLPSpanExporter
+    except ImportError:
+        logging.warning("OTLP endpoint set but the OTLP exporter is not installed.")
+        return
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor
+
+    provider = trace.get_tracer_provider()
+    if not isinstance(provider, TracerProvider):
+        provider = TracerProvider(
+            resource=Resource.create({"service.name": SERVICE_NAME})
+        )
+        trace.set_tracer_provider(provider)
+    provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+    _configured = True
+
+
+class TraceContextMiddleware:
+    """ASGI middleware continuing the trace of the caller, if any.
+
+    The W3C `traceparent` sent by session-mapper becomes the parent of the
+    spans ADK creates while handling the request.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        carrier = {
+            name.decode("latin-1"): value.decode("latin-1")
+            for name, value in scope["headers"]
+        }
+        token = context.attach(propagate.extract(carrier))
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            context.detach(token)
+
+
+@contextlib.contextmanager
+def traced(name: str, attributes: Optional[dict] = None):
+    """Wraps a call to another service in a client span."""
+    with TRACER.start_as_current_span(
+        name, kind=SpanKind.CLIENT, attributes=attributes
+    ) as span:
+        yield span
+
+
+def firestore_span(operation: str, collection: str):
+    return traced(
+        f"{operation} {collection}",
+        {
+            "db.system": "firestore",
+            "db.operation.name": operation,
+            "db.collection.name": collection,
+        },
+    )
+
+
+def http_span(method: str, url: str):
+    return traced(
+        method,
+        {"http.request.method": method, "url.full": url.split("?", 1)[0]},
+    )
+
+
+def record_model_usage(
+    callback_context: CallbackContext, llm_response: LlmResponse
+) -> Optional[LlmResponse]:
+    """after_model_callback adding the token usage to ADK's `call_llm` span."""
+    span = trace.get_current_span()
+    if not span.is_recording():
+        return None
+    span.set_attribute("gen_ai.agent.name", callback_context.agent_name)
+    usage = llm_response.usage_metadata
+    if usage is None:
+        return None
+    if usage.prompt_token_count is not None:
+        span.set_attribute("gen_ai.usage.input_tokens", usage.prompt_token_count)
+    if usage.candidates_token_count is not None:
+        span.set_attribute("gen_ai.usage.output_tokens", usage.candidates_token_count)
+    if usage.cached_content_token_count:
+        span.set_attribute(
+            "gen_ai.usage.cached_input_tokens", usage.cached_content_token_count
+        )
+    return None
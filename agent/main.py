@@ -1,5 +1,182 @@
+"""Serves the agent with ADK's API server under uvicorn, plus /metrics.
+
+Equivalent to `adk api_server`, which gives no way to add routes to its app
+nor to tune its server. The serving settings come from the environment:
+
+* WEB_CONCURRENCY: worker processes, 1 by default. Sessions live in the
+  worker that created them unless SESSION_DB_URL is set, so more than one
+  worker, or instance, needs it.
+* SESSION_DB_URL: where the sessions are stored, "firestore://<collection>"
+  or one of ADK's `--session_db_url`, see sessions.py.
+* UVICORN_LOOP: "auto" (uvloop if installed), "uvloop" or "asyncio".
+* UVICORN_HTTP: "auto" (httptools if installed), "httptools" or "h11".
+* KEEP_ALIVE_TIMEOUT: seconds an idle client connection is kept open.
+* GRACEFUL_SHUTDOWN_TIMEOUT: seconds in-flight requests get to finish after
+  SIGTERM before they are cancelled.
+* LIMIT_CONCURRENCY: connections and tasks beyond which requests are
+  answered 503, unlimited by default.
+
+    uv run python main.py
+    uv run python main.py --profile-startup   # Where the startup time goes
+"""
+
+import argparse
+import json
+import logging
+import os
+import subprocess
+import sys
+import tempfile
+
+import uvicorn
+from fastapi import FastAPI
+from google.adk.cli import fast_api
+
+import sessions
+
+AGENTS_DIR = os.path.dirname(os.path.abspath(__file__))
+HOST = os.getenv("HOST", "0.0.0.0")
+PORT = int(os.getenv("PORT", "8000"))
+ALLOW_ORIGINS = os.getenv("ALLOW_ORIGINS", "*").split(",")
+SESSION_DB_URL = os.getenv("SESSION_DB_URL", "")
+
+WORKERS = int(os.getenv("WEB_CONCURRENCY", "1"))
+LOOP = os.getenv("UVICORN_LOOP", "auto")
+HTTP = os.getenv("UVICORN_HTTP", "auto")
+# Above the 600 s idle timeout of Google's front ends, so that they are the
+# ones closing idle connections, instead of reusing one being closed here.
+KEEP_ALIVE_TIMEOUT = int(os.getenv("KEEP_ALIVE_TIMEOUT", "620"))
+# Cloud Run kills the container 10 s after SIGTERM.
+GRACEFUL_SHUTDOWN_TIMEOUT = int(os.getenv("GRACEFUL_SHUTDOWN_TIMEOUT", "8"))
+LIMIT_CONCURRENCY = int(os.getenv("LIMIT_CONCURRENCY", "0")) or None
+
+
+def create_app() -> FastAPI:
+    session_service = sessions.create_session_service(SESSION_DB_URL)
+    # get_fast_api_app takes a URL, not a session service: ours replaces the
+    # in-memory service it builds when given none.
+    in_memory_service = fast_api.InMemorySessionService
+    if session_service is not None:
+        fast_api.InMemorySessionService = lambda: session_service
+    try:
+        app = fast_api.get_fast_api_app(
+            agents_dir=AGENTS_DIR,
+            session_db_url="" if session_service is not None else SESSION_DB_URL,
+            allow_origins=ALLOW_ORIGINS,
+            web=False,
+        )
+    finally:
+        fast_api.InMemorySessionService = in_memory_service
+    # Imported once ADK installed its TracerProvider, which the agent's
+    # tracing and metrics hook into.
+    from coordinator import metrics, tracing
+
+    metrics.instrument(app)
+    app.add_middleware(tracing.TraceContextMiddleware)
+    return app
+
+
+def uvicorn_options() -> dict:
+    """The keyword arguments of uvicorn.run, bar the app and the workers."""
+    return {
+        "host": HOST,
+        "port": PORT,
+        "loop": LOOP,
+        "http": HTTP,
+        "timeout_keep_alive": KEEP_ALIVE_TIMEOUT,
+        "timeout_graceful_shutdown": GRACEFUL_SHUTDOWN_TIMEOUT,
+        "limit_concurrency": LIMIT_CONCURRENCY,
+        "app_dir": AGENTS_DIR,
+    }
+
+
+_PROFILE_SCRIPT = """
+import json, time
+started = time.perf_counter()
+import main
+imported = time.perf_counter()
+main.create_app()
+built = time.perf_counter()
+print(json.dumps({
+    "import_ms": (imported - started) * 1000,
+    "create_app_ms": (built - imported) * 1000,
+}))
+"""
+
+
+def _package(module: str) -> str:
+    """Groups google.* modules by product, e.g. google.cloud.firestore."""
+    parts = module.split(".")
+    if parts[0] == "google" and len(parts) > 1:
+        return ".".join(parts[: 3 if parts[1] == "cloud" else 2])
+    return parts[0]
+
+
+def profile_startup(top: int) -> None:
+    """Builds the app in a new interpreter and prints where the time went.
+
+    Reports the time to import main.py's dependencies and to create the app,
+    which loads the agent, then the packages that took the longest to
+    import (their own modules' time, not the time of their dependencies)
+    and the agent's modules.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", _PROFILE_SCRIPT],
+        cwd=AGENTS_DIR,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    phases = json.loads(result.stdout.strip().splitlines()[-1])
+    packages, agent_modules = {}, []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        own, cumulative, name = line[len("import time:") :].split("|")
+        name = name.strip()
+        package = _package(name)
+        packages[package] = packages.get(package, 0) + int(own) / 1000
+        if package == "coordinator":
+            agent_modules.append((name, int(cumulative) / 1000))
+
+    print(
+        f"import main: {phases['import_ms']:.0f} ms,"
+        f" create_app: {phases['create_app_ms']:.0f} ms,"
+        f" imports: {sum(packages.values()):.0f} ms in total"
+    )
+    print("\nSlowest packages to import (ms):")
+    for package, own_ms in sorted(packages.items(), key=lambda p: -p[1])[:top]:
+        print(f"  {own_ms:9.1f}  {package}")
+    print("\nAgent modules, with their dependencies (ms):")
+    for name, cumulative_ms in agent_modules:
+        print(f"  {cumulative_ms:9.1f}  {name}")
+
+
 def main():
-    print("Hello from agent!")
+    parser = argparse.ArgumentParser(description="Serves the agent.")
+    parser.add_argument(
+        "--profile-startup",
+        action="store_true",
+        help="Print the import-time breakdown of the startup, then exit.",
+    )
+    parser.add_argument("--top", type=int, default=15, help="Packages to report.")
+    args = parser.parse_args()
+    if args.profile_startup:
+        profile_startup(args.top)
+        return
+
+    workers = WORKERS
+    if workers > 1 and not SESSION_DB_URL:
+        logging.warning(
+            "WEB_CONCURRENCY=%s needs SESSION_DB_URL to share the sessions"
+            " between workers, running a single worker.",
+            workers,
+        )
+        workers = 1
+    if workers > 1 and not os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        # Lets /metrics aggregate the metrics of every worker
+        os.environ["PROMETHEUS_MULTIPROC_DIR"] = tempfile.mkdtemp(prefix="metrics-")
+    uvicorn.run("main:create_app", factory=True, workers=workers, **uvicorn_options())
 
 
 if __name__ == "__main__":
@@ -0,0 +1,429 @@
+"""Sessions of the agent, shared by every instance through Firestore.
+
+ADK's API server keeps its sessions in the memory of the process by default,
+so that a session only exists on the Cloud Run instance that created it.
+SESSION_DB_URL picks where they are stored instead:
+
+* "firestore://<collection>": FirestoreSessionService below, in the given
+  root collection, "agent_sessions" if none;
+* any other URL: ADK's own services, DatabaseSessionService for an
+  SQLAlchemy URL (e.g. "postgresql+pg8000://...") or "agentengine://<id>";
+* nothing: in memory, for a single local process.
+
+FirestoreSessionService stores, under the root collection:
+
+* {app_name}: the app's state ("app:" keys);
+* {app_name}/users/{user_id}: the user's state ("user:" keys);
+* {app_name}/users/{user_id}/sessions/{session_id}: the session's own state,
+  its events serialized as JSON, its last update time and expire_at.
+
+Sessions are kept in memory too. A cached session is revalidated by reading
+only the update times of its three documents, in one call, and is read again
+when another instance changed any of them. Events are appended to the stored
+list, which is cut back to its most recent half once it grows beyond
+SESSION_MAX_EVENTS events or SESSION_MAX_BYTES bytes, so that sessions stay
+below Firestore's 1 MiB per document. Every event pushes expire_at back by
+SESSION_TTL_SECONDS: Firestore's TTL policy on that field (see terraform)
+deletes the sessions left idle, which are ignored until it does.
+
+Like ADK's services, a session is not meant to run two turns at once.
+"""
+
+import asyncio
+import copy
+import datetime
+import os
+import threading
+import time
+import uuid
+from typing import Any, Optional
+
+from cachetools import TTLCache
+from google.adk.events import Event
+from google.adk.sessions import BaseSessionService, Session, State
+from google.adk.sessions.base_session_service import (GetSessionConfig,
+                                                      ListSessionsResponse)
+
+FIRESTORE_SCHEME = "firestore://"
+DEFAULT_COLLECTION = "agent_sessions"
+
+# Idle time after which a session expires.
+SESSION_TTL_SECONDS = float(os.getenv("SESSION_TTL_SECONDS", str(7 * 86400)))
+# Sessions kept in memory, and for how long after their last use.
+SESSION_CACHE_SIZE = int(os.getenv("SESSION_CACHE_SIZE", "1024"))
+SESSION_CACHE_TTL_SECONDS = float(os.getenv("SESSION_CACHE_TTL_SECONDS", "1800"))
+# Stored events beyond which the oldest half is dropped.
+SESSION_MAX_EVENTS = int(os.getenv("SESSION_MAX_EVENTS", "400"))
+SESSION_MAX_BYTES = int(os.getenv("SESSION_MAX_BYTES", str(512 * 1024)))
+
+USERS_COLLECTION = "users"
+SESSIONS_COLLECTION = "sessions"
+NO_FIELDS = ()
+LIST_FIELDS = ["last_update_time", "expire_at"]
+
+
+def create_session_service(url: str) -> Optional[BaseSessionService]:
+    """The session service of SESSION_DB_URL, None when ADK builds its own."""
+    if not url.startswith(FIRESTORE_SCHEME):
+        return None
+    return FirestoreSessionService(url[len(FIRESTORE_SCHEME) :] or DEFAULT_COLLECTION)
+
+
+def _now() -> datetime.datetime:
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def _expire_at() -> datetime.datetime:
+    return _now() + datetime.timedelta(seconds=SESSION_TTL_SECONDS)
+
+
+def _expired(expire_at: Optional[datetime.datetime]) -> bool:
+    """Whether a session expired, Firestore deleting it within days."""
+    return expire_at is not None and expire_at < _now()
+
+
+def _split_state(state: dict[str, Any]) -> tuple[dict, dict, dict]:
+    """Splits a state into its app, user and session keys, without prefixes.
+
+    "temp:" keys are dropped, they only live for the current invocation.
+    """
+    app_state, user_state, session_state = {}, {}, {}
+    for key, value in state.items():
+        if key.startswith(State.APP_PREFIX):
+            app_state[key[len(State.APP_PREFIX) :]] = value
+        elif key.startswith(State.USER_PREFIX):
+            user_state[key[len(State.USER_PREFIX) :]] = value
+        elif not key.startswith(State.TEMP_PREFIX):
+            session_state[key] = value
+    return app_state, user_state, session_state
+
+
+def _serialize(event: Event) -> str:
+    return event.model_dump_json(exclude_none=True)
+
+
+def _compaction_start(events: list[Event], sizes: list[int]) -> int:
+    """Index of the first event kept when the stored events are cut back.
+
+    Keeps the most recent events within half of the limits, starting at a
+    user's message so that no answer is kept without its question.
+    """
+    start, total = len(events) - 1, sizes[-1]
+    while (
+        start > 0
+        and len(events) - start < SESSION_MAX_EVENTS // 2
+        and total + sizes[start - 1] <= SESSION_MAX_BYTES // 2
+    ):
+        start -= 1
+        total += sizes[start]
+    for index in range(start, len(events)):
+        if events[index].author == "user":
+            return index
+    return start
+
+
+def _filter_events(session: Session, config: Optional[GetSessionConfig]) -> Session:
+    """Applies GetSessionConfig as ADK's InMemorySessionService does."""
+    if config is None:
+        return session
+    if config.num_recent_events:
+        session.events = session.events[-config.num_recent_events :]
+    if config.after_timestamp:
+        session.events = [
+            event
+            for event in session.events
+            if event.timestamp >= config.after_timestamp
+        ]
+    return session
+
+
+def _record_cache(result: str) -> None:
+    # Imported here: importing the agent's package before ADK's server is
+    # built would install a TracerProvider before ADK's.
+    from coordinator.metrics import record_cache
+
+    record_cache("sessions", result)
+
+
+def _span(operation: str):
+    from coordinator.tracing import firestore_span
+
+    return firestore_span(operation, SESSIONS_COLLECTION)
+
+
+class FirestoreSessionService(BaseSessionService):
+    """Sessions stored in Firestore, with a read-through cache in memory.
+
+    Args:
+        collection (str): The root collection of the sessions.
+        client: The Firestore client, created on first use if None.
+    """
+
+    def __init__(self, collection: str = DEFAULT_COLLECTION, client=None):
+        self.collection = collection
+        self._client = client
+        self._lock = threading.Lock()
+        # (app_name, user_id, session_id) -> {"session", "sizes", "versions",
+        # "expire_at"}, "sizes" being the length of each stored event and
+        # "versions" the update times of the app, user and session documents.
+        self._sessions = TTLCache(
+            maxsize=SESSION_CACHE_SIZE, ttl=SESSION_CACHE_TTL_SECONDS
+        )
+
+    def _db(self):
+        if self._client is None:
+            from google.cloud import firestore
+
+            self._client = firestore.Client()
+        return self._client
+
+    def _refs(self, app_name: str, user_id: str, session_id: str) -> tuple:
+        app_ref = self._db().collection(self.collection).document(app_name)
+        user_ref = app_ref.collection(USERS_COLLECTION).document(user_id)
+        return (
+            app_ref,
+            user_ref,
+            user_ref.collection(SESSIONS_COLLECTION).document(session_id),
+        )
+
+    def _get_all(self, refs: tuple, field_paths=None) -> list:
+        """Reads the documents in one call, in the order of refs."""
+        with _span("get_all"):
+            snapshots = {
+                snapshot.reference.path: snapshot
+                for snapshot in self._db().get_all(list(refs), field_paths=field_paths)
+            }
+        return [snapshots[ref.path] for ref in refs]
+
+    def _cached(self, key: tuple) -> Optional[dict]:
+        with self._lock:
+            return self._sessions.get(key)
+
+    def _cache(self, key: tuple, entry: Optional[dict]) -> None:
+        with self._lock:
+            if entry is None:
+                self._sessions.pop(key, None)
+            else:
+                self._sessions[key] = entry
+
+    def _load(self, key: tuple, refs: tuple) -> Optional[dict]:
+        """Reads a session and its app and user states, then caches it."""
+        app, user, stored = self._get_all(refs)
+        data = stored.to_dict() if stored.exists else None
+        if data is None or _expired(data.get("expire_at")):
+            self._cache(key, None)
+            return None
+        app_name, user_id, session_id = key
+        session = Session(
+            id=session_id,
+            app_name=app_name,
+            user_id=user_id,
+            state=dict(data.get("state", {})),
+            events=[Event.model_validate_json(e) for e in data.get("events", [])],
+            last_update_time=data.get("last_update_time", 0.0),
+        )
+        for prefix, snapshot in ((State.APP_PREFIX, app), (State.USER_PREFIX, user)):
+            state = (
+                (snapshot.to_dict() or {}).get("state", {}) if snapshot.exists else {}
+            )
+            session.state.update({prefix + k: v for k, v in state.items()})
+        entry = {
+            "session": session,
+            "sizes": [len(e) for e in data.get("events", [])],
+            "versions": [app.update_time, user.update_time, stored.update_time],
+            "expire_at": data.get("expire_at"),
+        }
+        self._cache(key, entry)
+        return entry
+
+    def _write_shared_state(self, ref, state: dict, cached: dict, prefix: str):
+        """Merges the changed app or user keys, returns the new update time."""
+        changed = {k: v for k, v in state.items() if cached.get(prefix + k, ...) != v}
+        if not changed:
+            return None
+        with _span("set"):
+            return ref.set({"state": changed}, merge=True).update_time
+
+    def _create_session(
+        self,
+        app_name: str,
+        user_id: str,
+        state: Optional[dict[str, Any]],
+        session_id: Optional[str],
+    ) -> Session:
+        session_id = (session_id or "").strip() or str(uuid.uuid4())
+        key = (app_name, user_id, session_id)
+        refs = self._refs(*key)
+        app_state, user_state, session_state = _split_state(state or {})
+        for ref, shared_state in ((refs[0], app_state), (refs[1], user_state)):
+            if shared_state:
+                with _span("set"):
+                    ref.set({"state": shared_state}, merge=True)
+        now = time.time()
+        with _span("set"):
+            refs[2].set(
+                {
+                    "state": session_state,
+                    "events": [],
+                    "last_update_time": now,
+                    "expire_at": _expire_at(),
+                }
+            )
+        # Read back with the states of the app and the user
+        entry = self._load(key, refs)
+        return copy.deepcopy(entry["session"])
+
+    def _get_session(
+        self,
+        app_name: str,
+        user_id: str,
+        session_id: str,
+        config: Optional[GetSessionConfig],
+    ) -> Optional[Session]:
+        key = (app_name, user_id, session_id)
+        refs = self._refs(*key)
+        entry = self._cached(key)
+        if entry is not None:
+            versions = [
+                snapshot.update_time for snapshot in self._get_all(refs, NO_FIELDS)
+            ]
+            if versions != entry["versions"]:
+                entry = None
+        _record_cache("miss" if entry is None else "revalidated")
+        if entry is None:
+            entry = self._load(key, refs)
+        if entry is None or _expired(entry["expire_at"]):
+            return None
+        return _filter_events(copy.deepcopy(entry["session"]), config)
+
+    def _list_sessions(self, app_name: str, user_id: str) -> ListSessionsResponse:
+        sessions_ref = self._refs(app_name, user_id, "-")[1].collection(
+            SESSIONS_COLLECTION
+        )
+        sessions = []
+        with _span("list"):
+            for snapshot in sessions_ref.select(LIST_FIELDS).stream():
+                data = snapshot.to_dict()
+                if _expired(data.get("expire_at")):
+                    continue
+                sessions.append(
+                    Session(
+                        id=snapshot.id,
+                        app_name=app_name,
+                        user_id=user_id,
+                        last_update_time=data.get("last_update_time", 0.0),
+                    )
+                )
+        return ListSessionsResponse(sessions=sessions)
+
+    def _delete_session(self, app_name: str, user_id: str, session_id: str) -> None:
+        key = (app_name, user_id, session_id)
+        with _span("delete"):
+            self._refs(*key)[2].delete()
+        self._cache(key, None)
+
+    def _store_event(self, session: Session, event: Event) -> None:
+        """Writes an appended event and its state changes, then caches them."""
+        from google.cloud.firestore import ArrayUnion
+
+        key = (session.app_name, session.user_id, session.id)
+        app_ref, user_ref, session_ref = self._refs(*key)
+        delta = {
+            k: v
+            for k, v in ((event.actions and event.actions.state_delta) or {}).items()
+            if not k.startswith(State.TEMP_PREFIX)
+        }
+        serialized = _serialize(event)
+        entry = self._cached(key)
+        if entry is None:
+            # Evicted since it was read. The session at hand may only hold
+            # its recent events (GetSessionConfig), read the stored ones for
+            # the list to be rewritten whole on compaction.
+            entry = self._load(key, refs=(app_ref, user_ref, session_ref))
+        if entry is None:
+            raise ValueError(f"Session {session.id} not found or expired.")
+        cached = entry["session"]
+        known_state = cached.state
+        events = [*cached.events, event.model_copy(deep=True)]
+        sizes = [*entry["sizes"], len(serialized)]
+        versions = list(entry["versions"])
+
+        app_delta, user_delta, session_delta = _split_state(delta)
+        for index, ref, state, prefix in (
+            (0, app_ref, app_delta, State.APP_PREFIX),
+            (1, user_ref, user_delta, State.USER_PREFIX),
+        ):
+            update_time = self._write_shared_state(ref, state, known_state, prefix)
+            versions[index] = update_time or versions[index]
+
+        expire_at = _expire_at()
+        fields = {"last_update_time": event.timestamp, "expire_at": expire_at}
+        if session_delta:
+            fields["state"] = _split_state(session.state)[2]
+        if len(events) > SESSION_MAX_EVENTS or sum(sizes) > SESSION_MAX_BYTES:
+            start = _compaction_start(events, sizes)
+            events, sizes = events[start:], sizes[start:]
+            fields["events"] = [_serialize(e) for e in events]
+        else:
+            fields["events"] = ArrayUnion([serialized])
+        with _span("update"):
+            versions[2] = session_ref.update(fields).update_time
+
+        cached.events = events
+        cached.state = {
+            k: v
+            for k, v in {**cached.state, **copy.deepcopy(delta)}.items()
+            if not k.startswith(State.TEMP_PREFIX)
+        }
+        cached.last_update_time = event.timestamp
+        self._cache(
+            key,
+            {
+                "session": cached,
+                "sizes": sizes,
+                "versions": versions,
+                "expire_at": expire_at,
+            },
+        )
+
+    async def create_session(
+        self,
+        *,
+        app_name: str,
+        user_id: str,
+        state: Optional[dict[str, Any]] = None,
+        session_id: Optional[str] = None,
+    ) -> Session:
+        return await asyncio.to_thread(
+            self._create_session, app_name, user_id, state, session_id
+        )
+
+    async def get_session(
+        self,
+        *,
+        app_name: str,
+        user_id: str,
+        session_id: str,
+        config: Optional[GetSessionConfig] = None,
+    ) -> Optional[Session]:
+        return await asyncio.to_thread(
+            self._get_session, app_name, user_id, session_id, config
+        )
+
+    async def list_sessions(
+        self, *, app_name: str, user_id: str
+    ) -> ListSessionsResponse:
+        return await asyncio.to_thread(self._list_sessions, app_name, user_id)
+
+    async def delete_session(
+        self, *, app_name: str, user_id: str, session_id: str
+    ) -> None:
+        await asyncio.to_thread(self._delete_session, app_name, user_id, session_id)
+
+    async def append_event(self, session: Session, event: Event) -> Event:
+        if event.partial:
+            return event
+        await super().append_event(session=session, event=event)
+        session.last_update_time = event.timestamp
+        await asyncio.to_thread(self._store_event, session, event)
+        return event
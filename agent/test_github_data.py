@@ -0,0 +1,243 @@
+import datetime
+import types
+from unittest import mock
+
+import pytest
+import requests
+from shared.crypto import EnvelopeCipher
+
+from coordinator import github_data
+
+KEY_PATH = "projects/p/locations/l/keyRings/r/cryptoKeys/k"
+FETCHED_AT = datetime.datetime(2026, 10, 1, tzinfo=datetime.timezone.utc)
+
+
+class FakeKmsClient:
+    """Wraps keys by prefixing them, counting the decryptions."""
+
+    def __init__(self):
+        self.decrypt_calls = 0
+
+    def crypto_key_path(self, *args):
+        return KEY_PATH
+
+    def encrypt(self, name, plaintext):
+        return types.SimpleNamespace(ciphertext=b"wrapped:" + plaintext)
+
+    def decrypt(self, name, ciphertext):
+        self.decrypt_calls += 1
+        return types.SimpleNamespace(plaintext=ciphertext.removeprefix(b"wrapped:"))
+
+
+def _response(status_code, json_data=None, etag=None):
+    response = mock.Mock(status_code=status_code)
+    response.headers = {"ETag": etag} if etag else {}
+    response.json.return_value = json_data
+    return response
+
+
+@pytest.fixture
+def kms(monkeypatch):
+    client = FakeKmsClient()
+    monkeypatch.setattr(github_data, "_kms_client", client)
+    monkeypatch.setattr(github_data, "_cipher", None)
+    for name in (
+        "GOOGLE_CLOUD_PROJECT",
+        "KMS_LOCATION",
+        "KMS_KEY_RING",
+        "KMS_KEY_NAME",
+    ):
+        monkeypatch.setattr(github_data, name, "x")
+    return client
+
+
+@pytest.fixture
+def db(monkeypatch, kms):
+    """A Firestore client whose user 'u1' is connected as 'octocat'."""
+    db = mock.MagicMock()
+    monkeypatch.setattr(github_data, "_db", db)
+    user_snapshot = db.collection.return_value.document.return_value.get.return_value
+    user_snapshot.exists = True
+    user_snapshot.to_dict.return_value = {
+        "github_connected": True,
+        "github_login": "octocat",
+        "github_access_token": EnvelopeCipher().encrypt(kms, KEY_PATH, "gh-token"),
+    }
+    # No copy of the resources in Firestore yet
+    _cache_snapshot(db).exists = False
+    github_data._resources.clear()
+    github_data._credentials.clear()
+    yield db
+    github_data._resources.clear()
+    github_data._credentials.clear()
+
+
+@pytest.fixture
+def github(monkeypatch):
+    session = mock.Mock()
+    session.get.return_value = _response(200, [], etag='"v1"')
+    monkeypatch.setattr(github_data, "_session", session)
+    return session
+
+
+def _user_snapshot(db):
+    return db.collection.return_value.document.return_value.get.return_value
+
+
+def _cache_document(db):
+    user_document = db.collection.return_value.document.return_value
+    return user_document.collection.return_value.document.return_value
+
+
+def _cache_snapshot(db):
+    return _cache_document(db).get.return_value
+
+
+def _firestore_copy(db, data, etag='"v1"'):
+    _cache_snapshot(db).exists = True
+    _cache_snapshot(db).to_dict.return_value = {
+        "etag": etag,
+        "data": data,
+        "fetched_at": FETCHED_AT,
+    }
+
+
+def _activity(resources=None):
+    tool_context = types.SimpleNamespace(state={"user:id": "u1"})
+    return github_data.get_github_activity(tool_context, resources)
+
+
+def _user_reads(db):
+    return db.collection.return_value.document.return_value.get.call_count
+
+
+def test_decrypts_the_tokens_encrypted_by_the_functions(kms):
+    cipher = EnvelopeCipher()
+    token = cipher.encrypt(kms, KEY_PATH, "gh-token")
+
+    assert github_data.decrypt_token(token) == "gh-token"
+
+
+def test_credentials_are_resolved_once_for_every_resource(db, kms, github):
+    result = _activity()
+
+    assert result["status"] == "success"
+    assert github.get.call_count == len(github_data.RESOURCES)
+    # A single read of the user's document and a single KMS decryption
+    assert _user_reads(db) == 1
+    assert kms.decrypt_calls == 1
+    for call in github.get.call_args_list:
+        assert call.kwargs["headers"]["Authorization"] == "Bearer gh-token"
+
+
+def test_fresh_resources_are_served_from_memory(db, github):
+    github.get.return_value = _response(200, [{"full_name": "octocat/hello"}])
+    _activity(["repos"])
+    github.get.reset_mock()
+
+    result = _activity(["repos"])
+
+    assert result["repos"][0]["name"] == "octocat/hello"
+    github.get.assert_not_called()
+
+
+def test_not_modified_resources_keep_their_cached_copy(db, github):
+    _firestore_copy(db, [{"name": "octocat/hello"}], etag='"v1"')
+    github.get.return_value = _response(304)
+
+    result = _activity(["repos"])
+
+    assert result == {
+        "status": "success",
+        "stale": [],
+        "repos": [{"name": "octocat/hello"}],
+    }
+    assert github.get.call_args.kwargs["headers"]["If-None-Match"] == '"v1"'
+    _cache_document(db).set.assert_not_called()
+
+
+def test_modified_resources_are_summarized_and_stored(db, github):
+    _firestore_copy(db, [{"name": "octocat/old"}], etag='"v1"')
+    github.get.return_value = _response(
+        200, [{"full_name": "octocat/new", "private": True}], etag='"v2"'
+    )
+
+    result = _activity(["repos"])
+
+    assert result["repos"][0]["name"] == "octocat/new"
+    stored = _cache_document(db).set.call_args.args[0]
+    assert stored["etag"] == '"v2"'
+    assert stored["data"] == result["repos"]
+
+
+def test_unreachable_github_serves_the_stale_copy(db, github):
+    _firestore_copy(db, [{"name": "octocat/hello"}])
+    github.get.side_effect = requests.exceptions.ConnectTimeout("timed out")
+
+    result = _activity(["repos"])
+
+    assert result["status"] == "success"
+    assert result["repos"] == [{"name": "octocat/hello"}]
+    assert result["stale"] == ["repos"]
+
+
+def test_github_errors_serve_the_stale_copy(db, github):
+    _firestore_copy(db, [{"name": "octocat/hello"}])
+    github.get.return_value = _response(502)
+
+    result = _activity(["repos"])
+
+    assert result["repos"] == [{"name": "octocat/hello"}]
+    assert result["stale"] == ["repos"]
+
+
+def test_unreachable_github_without_copy_is_an_error(db, github):
+    github.get.side_effect = requests.exceptions.ConnectionError("refused")
+
+    assert _activity(["repos"])["status"] == "error"
+
+
+def test_revoked_token_drops_the_credentials(db, github):
+    github.get.return_value = _response(401)
+
+    result = _activity(["repos"])
+
+    assert result["status"] == "not_connected"
+    assert "u1" not in github_data._credentials
+
+
+def test_disconnect_evicts_the_resources_in_memory(db, github):
+    _activity()
+    assert "u1" in github_data._credentials
+    _user_snapshot(db).to_dict.return_value = {"github_connected": False}
+    github.get.reset_mock()
+
+    result = _activity()
+
+    assert result["status"] == "not_connected"
+    github.get.assert_not_called()
+    assert not github_data._credentials
+    assert not github_data._resources
+
+
+def test_new_github_login_evicts_the_resources_in_memory(db, kms, github):
+    github.get.return_value = _response(200, [{"full_name": "octocat/hello"}])
+    _activity(["repos"])
+    _user_snapshot(db).to_dict.return_value = {
+        "github_connected": True,
+        "github_login": "hubot",
+        "github_access_token": EnvelopeCipher().encrypt(kms, KEY_PATH, "new-token"),
+    }
+    github.get.return_value = _response(200, [{"full_name": "hubot/hello"}])
+
+    result = _activity(["repos"])
+
+    assert result["repos"][0]["name"] == "hubot/hello"
+    assert github.get.call_args.kwargs["headers"]["Authorization"] == "Bearer new-token"
+    assert github_data._credentials["u1"] == ("hubot", "new-token")
+
+
+def test_connection_check_is_skipped_with_nothing_in_memory(db):
+    github_data._check_still_connected("u1", list(github_data.RESOURCES))
+
+    assert _user_reads(db) == 0
@@ -0,0 +1,172 @@
+import types
+
+import pytest
+from google.adk.models import LlmRequest
+from google.genai import types as genai_types
+
+from coordinator import history
+
+
+def _text(role, text):
+    return genai_types.Content(role=role, parts=[genai_types.Part(text=text)])
+
+
+def _conversation(turns, answer_chars):
+    contents = []
+    for i in range(turns):
+        contents.append(_text("user", f"question {i}"))
+        contents.append(_text("model", f"answer {i} " + "x" * answer_chars))
+    return contents
+
+
+def _callback_context(state=None, question=None):
+    return types.SimpleNamespace(
+        state={} if state is None else state,
+        user_content=None if question is None else _text("user", question),
+    )
+
+
+@pytest.fixture
+def budget(monkeypatch):
+    monkeypatch.setattr(history, "HISTORY_TOKEN_BUDGET", 3000)
+    monkeypatch.setattr(history, "HISTORY_PART_TOKENS", 2000)
+    monkeypatch.setattr(history, "HISTORY_DIGEST_TOKENS", 100)
+
+
+# --- compact_history ---
+def test_compact_history_leaves_a_short_history_alone(budget):
+    contents = _conversation(2, 100) + [_text("user", "current question")]
+    llm_request = LlmRequest(contents=list(contents))
+
+    assert history.compact_history(_callback_context(), llm_request) is None
+    assert llm_request.contents == contents
+
+
+def test_compact_history_keeps_the_latest_turns_and_digests_the_others(budget):
+    # Six previous turns of about 1000 tokens each, three fit in the budget
+    contents = _conversation(6, 4000) + [_text("user", "current question")]
+    llm_request = LlmRequest(contents=list(contents))
+
+    history.compact_history(_callback_context(), llm_request)
+
+    compacted = llm_request.contents
+    assert compacted[-1].parts[0].text == "current question"
+    assert compacted[1:] == contents[-5:]
+    digest = compacted[0].parts[0].text
+    assert digest.startswith(history._DIGEST_HEADER)
+    # The digest's own budget keeps the latest of the dropped turns
+    assert "- User: question 3" in digest
+    assert "question 0" not in digest
+    assert history.estimate_tokens(compacted[1:]) <= history.HISTORY_TOKEN_BUDGET
+
+
+def test_compact_history_cuts_long_tool_results_first(budget):
+    feed = {"status": "success", "entries": ["entry " * 10] * 1000}
+    contents = [
+        _text("user", "latest AWS news"),
+        genai_types.Content(
+            role="model",
+            parts=[
+                genai_types.Part(
+                    function_call=genai_types.FunctionCall(
+                        id="call-1", name="fetch_feed", args={"uri": "https://a/feed"}
+                    )
+                )
+            ],
+        ),
+        genai_types.Content(
+            role="user",
+            parts=[
+                genai_types.Part(
+                    function_response=genai_types.FunctionResponse(
+                        id="call-1", name="fetch_feed", response=feed
+                    )
+                )
+            ],
+        ),
+        _text("model", "Here is the AWS news."),
+        _text("user", "and Azure?"),
+    ]
+    llm_request = LlmRequest(contents=list(contents))
+
+    history.compact_history(_callback_context(), llm_request)
+
+    compacted = llm_request.contents
+    # Cut in place, no turn had to be dropped for a digest
+    assert len(compacted) == len(contents)
+    response = compacted[2].parts[0].function_response
+    assert response.id == "call-1"
+    assert response.response == {
+        "status": "success",
+        "omitted_from_history": ["entries"],
+    }
+    assert compacted[-1] == contents[-1]
+
+
+# --- _digest ---
+def test_digest_keeps_the_latest_messages(budget):
+    digest = history._digest(_conversation(50, 10)).parts[0].text
+    lines = digest.splitlines()
+
+    assert lines[0] == history._DIGEST_HEADER
+    assert lines[-1].startswith("- Assistant: answer 49 ")
+    assert "- User: question 0" not in lines
+    assert len(digest) <= history.HISTORY_DIGEST_TOKENS * history._CHARS_PER_TOKEN
+
+
+def test_digest_names_other_agents_and_skips_tool_calls():
+    contents = [
+        _text("user", "latest news"),
+        genai_types.Content(
+            role="user",
+            parts=[
+                genai_types.Part(text="For context:"),
+                genai_types.Part(
+                    text="[tech_news_retriever] called tool `fetch_feed` with parameters: {}"
+                ),
+                genai_types.Part(text="[tech_news_reviewer] said: The review."),
+            ],
+        ),
+    ]
+
+    assert history._digest(contents).parts[0].text.splitlines()[1:] == [
+        "- User: latest news",
+        "- tech_news_reviewer: The review.",
+    ]
+
+
+def test_digest_of_nothing_to_tell():
+    assert history._digest([]) is None
+
+
+# --- news state ---
+def test_evict_news_state_drops_the_news_state_keys():
+    state = {
+        "news_feed": "feed",
+        "news_summarized": "summaries",
+        "news_question": "latest AWS news",
+        "news_reviewed": "review",
+        "user:id": "u1",
+    }
+
+    assert history.evict_news_state(_callback_context(state)) is None
+    assert state == {
+        "news_feed": None,
+        "news_summarized": None,
+        "news_question": None,
+        "news_reviewed": "review",
+        "user:id": "u1",
+    }
+
+
+def test_evict_news_state_writes_nothing_when_already_clear():
+    state = {}
+    history.evict_news_state(_callback_context(state))
+    assert state == {}
+
+
+def test_note_news_question_writes_the_question_for_the_reviewer():
+    callback_context = _callback_context(question="latest AWS news")
+
+    assert history.note_news_question(callback_context) is None
+    assert callback_context.state == {"news_question": "latest AWS news"}
@@ -0,0 +1,42 @@
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from opentelemetry.sdk.trace import TracerProvider
+
+from coordinator import metrics
+
+
+def _client():
+    app = FastAPI()
+
+    @app.get("/ping")
+    def ping():
+        return {"status": "ok"}
+
+    metrics.instrument(app, TracerProvider())
+    return TestClient(app)
+
+
+def test_metrics_in_a_single_process(monkeypatch):
+    monkeypatch.delenv("PROMETHEUS_MULTIPROC_DIR", raising=False)
+    client = _client()
+    assert client.get("/ping").status_code == 200
+
+    response = client.get("/metrics")
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert (
+        'agent_http_requests_total{method="GET",route="/ping",status="200"}'
+        in response.text
+    )
+
+
+def test_metrics_aggregates_the_workers(monkeypatch, tmp_path):
+    monkeypatch.setenv("PROMETHEUS_MULTIPROC_DIR", str(tmp_path))
+    client = _client()
+
+    response = client.get("/metrics")
+
+    # Each worker writes its own files, none yet in this directory
+    assert response.status_code == 200
+    assert "agent_http_requests_total" not in response.text
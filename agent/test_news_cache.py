@@ -0,0 +1,231 @@
+import asyncio
+import datetime
+import types
+from unittest import mock
+
+import pytest
+
+from coordinator import news_cache
+
+NOW = datetime.datetime(2026, 10, 14, 9, 30, tzinfo=datetime.timezone.utc)
+FEEDS = {"https://aws.amazon.com/blogs/aws/feed/": {"etag": '"abc"', "modified": None}}
+
+
+@pytest.fixture(autouse=True)
+def fixed_clock(monkeypatch):
+    now = {"value": NOW}
+    monkeypatch.setattr(news_cache, "_now", lambda: now["value"])
+    news_cache._answers.clear()
+    news_cache._fetched.clear()
+    yield now
+    news_cache._answers.clear()
+    news_cache._fetched.clear()
+
+
+def _cache(question, answer="Cached answer", checked_at=NOW):
+    news_cache._answers[news_cache.cache_key(question)] = {
+        "answer": answer,
+        "feeds": dict(FEEDS),
+        "checked_at": checked_at,
+    }
+
+
+def _callback_context(question, invocation_id, state=None):
+    return types.SimpleNamespace(
+        user_content=news_cache.types.Content(
+            role="user", parts=[news_cache.types.Part(text=question)]
+        ),
+        invocation_id=invocation_id,
+        state={} if state is None else state,
+    )
+
+
+# --- _window ---
+@pytest.mark.parametrize(
+    "words, expected",
+    [
+        ([], "day:2026-10-14"),
+        (["aws"], "day:2026-10-14"),
+        (["today"], "day:2026-10-14"),
+        (["yesterday"], "day:2026-10-13"),
+        (["this", "week"], "week:2026-W42"),
+        (["weekly"], "week:2026-W42"),
+        (["month"], "month:2026-10"),
+        (["monthly"], "month:2026-10"),
+        # The first period named wins
+        (["today", "and", "this", "week"], "day:2026-10-14"),
+        (["week", "yesterday"], "week:2026-W42"),
+    ],
+)
+def test_window(words, expected):
+    assert news_cache._window(words) == expected
+
+
+def test_window_of_the_first_week_of_the_year(fixed_clock):
+    fixed_clock["value"] = datetime.datetime(2027, 1, 1, tzinfo=datetime.timezone.utc)
+    # January 1st 2027 is in the last ISO week of 2026
+    assert news_cache._window(["week"]) == "week:2026-W53"
+
+
+# --- cache_key ---
+def test_cache_key_drops_filler_words_and_sorts_the_intent():
+    assert news_cache.cache_key("What are the latest AWS Lambda announcements?") == (
+        "day:2026-10-14",
+        (),
+        "aws lambda",
+    )
+    assert news_cache.cache_key("latest news on lambda AWS") == news_cache.cache_key(
+        "Tell me the latest AWS lambda news"
+    )
+
+
+def test_cache_key_of_a_generic_question_has_no_intent():
+    assert news_cache.cache_key("news from yesterday") == ("day:2026-10-13", (), "")
+    assert news_cache.cache_key("and yesterday?") == ("day:2026-10-13", (), "")
+
+
+def test_cache_key_keeps_the_feed_uris_apart_from_the_intent():
+    window, uris, intent = news_cache.cache_key(
+        "Summarize https://Example.com/Feed.xml and https://aws.amazon.com/blogs/aws/feed/."
+    )
+    assert window == "day:2026-10-14"
+    assert uris == (
+        "https://aws.amazon.com/blogs/aws/feed/",
+        "https://example.com/feed.xml",
+    )
+    assert intent == "summarize"
+
+
+def test_cache_key_depends_on_the_window():
+    assert news_cache.cache_key("AWS news this week") != news_cache.cache_key(
+        "AWS news this month"
+    )
+
+
+# --- lookup ---
+def test_lookup_miss():
+    assert asyncio.run(news_cache.lookup("latest AWS news")) is None
+
+
+def test_lookup_within_the_ttl_skips_revalidation(monkeypatch, fixed_clock):
+    _cache("latest AWS news")
+    feeds_not_modified = mock.Mock()
+    monkeypatch.setattr(news_cache, "_feeds_not_modified", feeds_not_modified)
+    fixed_clock["value"] = NOW + datetime.timedelta(
+        seconds=news_cache.NEWS_CACHE_TTL_SECONDS - 1
+    )
+
+    assert asyncio.run(news_cache.lookup("AWS news")) == "Cached answer"
+    feeds_not_modified.assert_not_called()
+
+
+def test_lookup_past_the_ttl_keeps_a_not_modified_answer(monkeypatch, fixed_clock):
+    _cache("latest AWS news")
+    feeds_not_modified = mock.Mock(return_value=True)
+    monkeypatch.setattr(news_cache, "_feeds_not_modified", feeds_not_modified)
+    later = NOW + datetime.timedelta(seconds=news_cache.NEWS_CACHE_TTL_SECONDS + 1)
+    fixed_clock["value"] = later
+
+    assert asyncio.run(news_cache.lookup("latest AWS news")) == "Cached answer"
+    feeds_not_modified.assert_called_once_with(FEEDS)
+    # Revalidated, the answer is served as is for another TTL
+    entry = news_cache._answers[news_cache.cache_key("latest AWS news")]
+    assert entry["checked_at"] == later
+    assert asyncio.run(news_cache.lookup("latest AWS news")) == "Cached answer"
+    feeds_not_modified.assert_called_once()
+
+
+def test_lookup_past_the_ttl_drops_a_modified_answer(monkeypatch, fixed_clock):
+    _cache("latest AWS news")
+    monkeypatch.setattr(
+        news_cache, "_feeds_not_modified", mock.Mock(return_value=False)
+    )
+    fixed_clock["value"] = NOW + datetime.timedelta(
+        seconds=news_cache.NEWS_CACHE_TTL_SECONDS + 1
+    )
+
+    assert asyncio.run(news_cache.lookup("latest AWS news")) is None
+    assert news_cache.cache_key("latest AWS news") not in news_cache._answers
+
+
+def test_feeds_without_validators_are_not_revalidated():
+    with mock.patch("feedparser.parse") as parse:
+        assert not news_cache._feeds_not_modified({"https://example.com/feed": {}})
+    parse.assert_not_called()
+
+
+def test_questions_without_intent_nor_uris_are_not_looked_up(monkeypatch):
+    find = mock.Mock()
+    monkeypatch.setattr(news_cache, "_find", find)
+
+    assert asyncio.run(news_cache.lookup("What's new?")) is None
+    find.assert_not_called()
+
+
+# --- replay_news ---
+def test_replay_news_answers_a_cached_first_question():
+    _cache("AWS news from yesterday")
+    callback_context = _callback_context("AWS news from yesterday", "invocation-1")
+
+    content = asyncio.run(news_cache.replay_news(callback_context))
+
+    assert content.parts[0].text == "Cached answer"
+    assert callback_context.state[news_cache.ANSWER_KEY] == "Cached answer"
+
+
+def test_replay_news_ignores_follow_up_questions():
+    _cache("AWS news from yesterday")
+    state = {}
+    asyncio.run(
+        news_cache.replay_news(_callback_context("latest news", "first", state))
+    )
+
+    # Same key as the cached question, but it depends on the conversation
+    follow_up = _callback_context("and AWS yesterday?", "second", state)
+    assert asyncio.run(news_cache.replay_news(follow_up)) is None
+    assert news_cache.ANSWER_KEY not in state
+
+
+def test_store_news_only_caches_first_questions():
+    state = {news_cache.FIRST_INVOCATION_KEY: "first"}
+    for invocation_id in ("first", "second"):
+        news_cache._fetched[invocation_id] = dict(FEEDS)
+        state[news_cache.ANSWER_KEY] = f"Answer of {invocation_id}"
+        news_cache.store_news(
+            _callback_context(f"{invocation_id} AWS news", invocation_id, state)
+        )
+
+    assert news_cache.cache_key("first AWS news") in news_cache._answers
+    assert news_cache.cache_key("second AWS news") not in news_cache._answers
+
+
+@pytest.mark.parametrize(
+    "question",
+    [
+        "What can you do?",
+        "Tell me what you can do",
+        "What's new?",
+        "What's up?",
+        "Show me the latest news",
+    ],
+)
+def test_filler_only_questions_are_neither_stored_nor_replayed(question):
+    news_cache._fetched["first"] = dict(FEEDS)
+    state = {news_cache.ANSWER_KEY: "Today's news digest"}
+    news_cache.store_news(_callback_context("latest news", "first", state))
+    assert not news_cache._answers
+
+    # A cached answer under the empty intent isn't served either
+    _cache("latest news", answer="Today's news digest")
+    other_session = _callback_context(question, "other")
+    assert asyncio.run(news_cache.replay_news(other_session)) is None
+
+
+def test_coordinator_only_marks_the_first_question():
+    from coordinator.agent import root_agent
+
+    assert news_cache.mark_first_question in root_agent.before_agent_callback
+    callback_context = _callback_context("What can you do?", "first")
+
+    assert news_cache.mark_first_question(callback_context) is None
+    assert callback_context.state == {news_cache.FIRST_INVOCATION_KEY: "first"}
@@ -0,0 +1,244 @@
+import asyncio
+import datetime
+from unittest import mock
+
+import pytest
+from fastapi import FastAPI
+from google.adk.cli import fast_api
+from google.adk.events import Event, EventActions
+from google.adk.sessions.base_session_service import GetSessionConfig
+from google.genai import types
+from local_backends import FakeFirestoreClient
+
+import main
+import sessions
+
+APP, USER = "coordinator", "u1"
+
+
+@pytest.fixture
+def db(monkeypatch):
+    # The fake's documents are shared by its clients, like a real database
+    monkeypatch.setattr(FakeFirestoreClient, "_documents", {})
+    return FakeFirestoreClient(latency_ms=0)
+
+
+@pytest.fixture
+def service(db):
+    return sessions.FirestoreSessionService("test_sessions", client=db)
+
+
+def _event(author, text, state_delta=None):
+    return Event(
+        author=author,
+        invocation_id="invocation",
+        content=types.Content(role=author, parts=[types.Part(text=text)]),
+        actions=EventActions(state_delta=state_delta or {}),
+    )
+
+
+def _texts(session):
+    return [event.content.parts[0].text for event in session.events]
+
+
+def _create(service, state=None):
+    return asyncio.run(service.create_session(app_name=APP, user_id=USER, state=state))
+
+
+def _get(service, session_id, config=None):
+    return asyncio.run(
+        service.get_session(
+            app_name=APP, user_id=USER, session_id=session_id, config=config
+        )
+    )
+
+
+def _append(service, session, *events):
+    for event in events:
+        asyncio.run(service.append_event(session, event))
+
+
+def _conversation(turns):
+    return [
+        _event("user" if i % 2 == 0 else "coordinator", f"event {i}")
+        for i in range(turns)
+    ]
+
+
+# --- helpers ---
+def test_expired():
+    now = sessions._now()
+    assert not sessions._expired(None)
+    assert not sessions._expired(now + datetime.timedelta(minutes=1))
+    assert sessions._expired(now - datetime.timedelta(minutes=1))
+
+
+def test_split_state_strips_the_prefixes_and_drops_temp_keys():
+    assert sessions._split_state(
+        {
+            "app:model": "gemini",
+            "user:id": "u1",
+            "temp:draft": "...",
+            "news_feed": "feed",
+        }
+    ) == ({"model": "gemini"}, {"id": "u1"}, {"news_feed": "feed"})
+
+
+def test_compaction_start_keeps_the_most_recent_half_of_the_events(monkeypatch):
+    monkeypatch.setattr(sessions, "SESSION_MAX_EVENTS", 10)
+    events = _conversation(12)
+
+    # Events 7 to 11 are the most recent half, 7 is an answer
+    assert sessions._compaction_start(events, [1] * 12) == 8
+
+
+def test_compaction_start_keeps_the_most_recent_half_of_the_bytes(monkeypatch):
+    monkeypatch.setattr(sessions, "SESSION_MAX_BYTES", 100)
+    events = _conversation(6)
+
+    # Events 1 to 5 take 50 bytes, 1 is an answer
+    assert sessions._compaction_start(events, [10] * 6) == 2
+
+
+def test_compaction_start_without_user_message_keeps_the_half(monkeypatch):
+    monkeypatch.setattr(sessions, "SESSION_MAX_EVENTS", 4)
+    events = [_event("coordinator", f"event {i}") for i in range(5)]
+
+    assert sessions._compaction_start(events, [1] * 5) == 3
+
+
+# --- FirestoreSessionService ---
+def test_create_session_splits_the_state_across_documents(db, service):
+    session = _create(service, {"app:model": "gemini", "user:id": "u1", "topic": "aws"})
+
+    assert session.state == {"app:model": "gemini", "user:id": "u1", "topic": "aws"}
+    app_ref, user_ref, session_ref = service._refs(APP, USER, session.id)
+    assert app_ref.get().to_dict()["state"] == {"model": "gemini"}
+    assert user_ref.get().to_dict()["state"] == {"id": "u1"}
+    assert session_ref.get().to_dict()["state"] == {"topic": "aws"}
+
+
+def test_get_session_revalidates_an_unchanged_session(service):
+    session = _create(service)
+    _append(service, session, *_conversation(2))
+
+    with mock.patch.object(service, "_load", wraps=service._load) as load:
+        cached = _get(service, session.id)
+
+    load.assert_not_called()
+    assert _texts(cached) == ["event 0", "event 1"]
+
+
+def test_get_session_reads_again_what_another_instance_changed(db, service):
+    session = _create(service)
+    _get(service, session.id)
+    other_instance = sessions.FirestoreSessionService("test_sessions", client=db)
+    other_session = _get(other_instance, session.id)
+    _append(
+        other_instance,
+        other_session,
+        _event("user", "event 0", {"user:name": "Octocat"}),
+    )
+
+    refreshed = _get(service, session.id)
+
+    assert _texts(refreshed) == ["event 0"]
+    assert refreshed.state == {"user:name": "Octocat"}
+
+
+def test_get_session_sees_the_user_state_of_other_sessions(service):
+    session = _create(service)
+    _get(service, session.id)
+    other_session = _create(service)
+    _append(service, other_session, _event("user", "hi", {"user:name": "Octocat"}))
+
+    assert _get(service, session.id).state == {"user:name": "Octocat"}
+
+
+def test_get_session_of_an_expired_session(monkeypatch, service):
+    session = _create(service)
+    monkeypatch.setattr(sessions, "SESSION_TTL_SECONDS", -1)
+    _append(service, session, _event("user", "event 0"))
+
+    assert _get(service, session.id) is None
+
+
+def test_store_event_after_eviction_keeps_the_stored_events(service):
+    session = _create(service)
+    _append(service, session, *_conversation(4))
+    recent = _get(service, session.id, GetSessionConfig(num_recent_events=1))
+    service._sessions.clear()
+
+    _append(service, recent, _event("user", "event 4"))
+
+    expected = [f"event {i}" for i in range(5)]
+    assert _texts(_get(service, session.id)) == expected
+    service._sessions.clear()
+    assert _texts(_get(service, session.id)) == expected
+
+
+def test_store_event_after_eviction_compacts_the_stored_events(
+    monkeypatch, db, service
+):
+    monkeypatch.setattr(sessions, "SESSION_MAX_EVENTS", 6)
+    session = _create(service)
+    _append(service, session, *_conversation(6))
+    recent = _get(service, session.id, GetSessionConfig(num_recent_events=2))
+    service._sessions.clear()
+
+    _append(service, recent, _event("user", "event 6"))
+
+    # Seven stored events, cut back to the most recent half
+    expected = ["event 4", "event 5", "event 6"]
+    assert _texts(_get(service, session.id)) == expected
+    other_instance = sessions.FirestoreSessionService("test_sessions", client=db)
+    assert _texts(_get(other_instance, session.id)) == expected
+
+
+def test_store_event_of_a_deleted_session(service):
+    session = _create(service)
+    asyncio.run(
+        service.delete_session(app_name=APP, user_id=USER, session_id=session.id)
+    )
+
+    with pytest.raises(ValueError):
+        _append(service, session, _event("user", "event 0"))
+
+
+# --- create_app ---
+@pytest.fixture
+def get_fast_api_app(monkeypatch):
+    """Records the arguments and the in-memory service ADK's app gets."""
+    built = {}
+
+    def build(**kwargs):
+        built["kwargs"] = kwargs
+        built["service"] = fast_api.InMemorySessionService()
+        return FastAPI()
+
+    monkeypatch.setattr(fast_api, "get_fast_api_app", build)
+    monkeypatch.setattr("coordinator.metrics.instrument", mock.Mock())
+    return built
+
+
+def test_create_app_serves_the_firestore_sessions(monkeypatch, get_fast_api_app):
+    in_memory_service = fast_api.InMemorySessionService
+    monkeypatch.setattr(main, "SESSION_DB_URL", "firestore://test_sessions")
+
+    main.create_app()
+
+    assert isinstance(get_fast_api_app["service"], sessions.FirestoreSessionService)
+    assert get_fast_api_app["service"].collection == "test_sessions"
+    assert get_fast_api_app["kwargs"]["session_db_url"] == ""
+    assert fast_api.InMemorySessionService is in_memory_service
+
+
+def test_create_app_leaves_the_other_urls_to_adk(monkeypatch, get_fast_api_app):
+    in_memory_service = fast_api.InMemorySessionService
+    monkeypatch.setattr(main, "SESSION_DB_URL", "sqlite:///sessions.db")
+
+    main.create_app()
+
+    assert isinstance(get_fast_api_app["service"], in_memory_service)
+    assert get_fast_api_app["kwargs"]["session_db_url"] == "sqlite:///sessions.db"
+    assert fast_api.InMemorySessionService is in_memory_service
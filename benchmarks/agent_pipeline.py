@@ -0,0 +1,412 @@
+"""
+End-to-end benchmark of the agent pipeline, replaying recorded model answers.
+
+Runs a scripted conversation through the coordinator's `root_agent` with
+ADK's Runner. In replay mode, every model call is answered from a recording
+and every RSS feed is parsed from a recorded body, after a configurable
+simulated latency. The run is then offline, free and deterministic. It
+measures per turn:
+
+* the wall time, split into model time, function tool time and the rest,
+  i.e. the orchestration overhead of the agents;
+* the number of model and tool calls, and the latency of each tool;
+* the size of the session state and of the session events.
+
+Firestore, KMS and GitHub are the stand-ins of local_backends.py in both
+modes. Run it from the agent's environment:
+
+    cd agent
+    uv run python ../benchmarks/agent_pipeline.py --record   # Live, once
+    uv run python ../benchmarks/agent_pipeline.py --model-latency-ms 800
+
+Recording calls Gemini and the feeds for real, with the usual credentials
+(GOOGLE_GENAI_USE_VERTEXAI, GOOGLE_CLOUD_PROJECT...). Model calls are
+matched by a hash of the model, system instruction, tools and contents,
+without the generated function call IDs. A change to a prompt, a tool or
+the conversation needs a new recording: replay stops at the first model
+call it has no answer for.
+"""
+
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import statistics
+import sys
+import time
+import uuid
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCHMARKS_DIR)
+AGENT_DIR = os.path.join(REPO_ROOT, "agent")
+# functions/shared, vendored next to the deployed agent
+FUNCTIONS_DIR = os.path.join(REPO_ROOT, "functions")
+DEFAULT_RECORDING = os.path.join(BENCHMARKS_DIR, "recordings", "agent_pipeline.json")
+
+APP_NAME = "coordinator"
+USER_ID = "user-0"  # Seeded by local_backends with a GitHub token
+
+# The conversation replayed, one session per run.
+CONVERSATION = [
+    "What are the latest announcements on the Google blog? https://blog.google/rss/",
+    "Remember that I am interested in Python and cloud infrastructure.",
+    "What do you know about my interests?",
+    "What have I been working on GitHub lately?",
+]
+
+
+class Recording:
+    """Model answers and feed bodies, keyed by request.
+
+    The same request can be made several times in a conversation, each key
+    thus holds the list of its answers, replayed in order.
+    """
+
+    def __init__(self, model_calls: dict | None = None, feeds: dict | None = None):
+        self.model_calls = model_calls or {}
+        self.feeds = feeds or {}
+        self._replayed = {}
+
+    @classmethod
+    def load(cls, path: str) -> "Recording":
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(data.get("model_calls"), data.get("feeds"))
+
+    def save(self, path: str) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(
+                {"model_calls": self.model_calls, "feeds": self.feeds},
+                f,
+                indent=1,
+                sort_keys=True,
+            )
+            f.write("\n")
+
+    def rewind(self) -> None:
+        self._replayed.clear()
+
+    def add_model_call(self, key: str, responses: list[dict]) -> None:
+        self.model_calls.setdefault(key, []).append(responses)
+
+    def model_call(self, key: str) -> list[dict]:
+        calls = self.model_calls.get(key)
+        if not calls:
+            raise LookupError(
+                f"No recorded model call matches request {key[:12]}, record again."
+            )
+        index = self._replayed.get(key, 0)
+        self._replayed[key] = index + 1
+        return calls[min(index, len(calls) - 1)]
+
+
+def _jsonable(value):
+    if hasattr(value, "model_dump"):
+        return value.model_dump(mode="json", exclude_none=True)
+    return value
+
+
+def _strip_ids(value):
+    """Drops the IDs generated for function calls, which differ on each run."""
+    if isinstance(value, dict):
+        return {k: _strip_ids(v) for k, v in value.items() if k != "id"}
+    if isinstance(value, list):
+        return [_strip_ids(v) for v in value]
+    return value
+
+
+def request_key(llm_request) -> str:
+    """Identifies a model request by what determines the model's answer."""
+    config = llm_request.config
+    payload = {
+        "model": llm_request.model,
+        "system_instruction": _jsonable(config.system_instruction if config else None),
+        "tools": sorted(llm_request.tools_dict),
+        "contents": _strip_ids([_jsonable(c) for c in llm_request.contents]),
+    }
+    encoded = json.dumps(payload, sort_keys=True, default=str).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()
+
+
+class Metrics:
+    """What a turn spent, filled in by the replaying model and the tool hooks."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.model_calls = 0
+        self.model_seconds = 0.0
+        self.tool_seconds = {}  # Tool name -> list of durations
+        self.agent_tool_names = set()  # Their time includes nested model calls
+        self._tool_started = {}
+
+
+def make_replay_llm(recording: Recording, metrics: Metrics, latency_ms: float, record):
+    """Returns the BaseLlm class answering from, or recording into, recording."""
+    from google.adk.models.base_llm import BaseLlm
+    from google.adk.models.google_llm import Gemini
+    from google.adk.models.llm_response import LlmResponse
+
+    class ReplayLlm(BaseLlm):
+
+        async def generate_content_async(self, llm_request, stream: bool = False):
+            # ADK handles each response, tool calls included, while this
+            # generator is suspended: the clock only runs between yields.
+            metrics.model_calls += 1
+            key = request_key(llm_request)
+            started = time.perf_counter()
+            if record:
+                responses = []
+                async for response in Gemini(model=self.model).generate_content_async(
+                    llm_request, stream
+                ):
+                    responses.append(_jsonable(response))
+                    metrics.model_seconds += time.perf_counter() - started
+                    yield response
+                    started = time.perf_counter()
+                recording.add_model_call(key, responses)
+            else:
+                responses = recording.model_call(key)
+                await asyncio.sleep(latency_ms / 1000)
+                for response in responses:
+                    response = LlmResponse.model_validate(response)
+                    metrics.model_seconds += time.perf_counter() - started
+                    yield response
+                    started = time.perf_counter()
+            metrics.model_seconds += time.perf_counter() - started
+
+    return ReplayLlm
+
+
+def _iter_llm_agents(agent):
+    """Yields the LLM agents of a tree, including those wrapped in AgentTools."""
+    from google.adk.agents import LlmAgent
+    from google.adk.tools.agent_tool import AgentTool
+
+    if isinstance(agent, LlmAgent):
+        yield agent
+        for tool in agent.tools:
+            if isinstance(tool, AgentTool):
+                yield from _iter_llm_agents(tool.agent)
+    for sub_agent in agent.sub_agents:
+        yield from _iter_llm_agents(sub_agent)
+
+
+def instrument(root_agent, llm_class, metrics: Metrics) -> None:
+    """Swaps every agent's model for llm_class and times every tool call."""
+    from google.adk.tools.agent_tool import AgentTool
+
+    def before_tool(tool, args, tool_context):
+        key = (tool.name, tool_context.function_call_id)
+        metrics._tool_started[key] = time.perf_counter()
+        if isinstance(tool, AgentTool):
+            metrics.agent_tool_names.add(tool.name)
+        return None
+
+    def after_tool(tool, args, tool_context, tool_response):
+        started = metrics._tool_started.pop(
+            (tool.name, tool_context.function_call_id), None
+        )
+        if started is not None:
+            metrics.tool_seconds.setdefault(tool.name, []).append(
+                time.perf_counter() - started
+            )
+        return None
+
+    for agent in _iter_llm_agents(root_agent):
+        model = agent.model if isinstance(agent.model, str) else agent.model.model
+        agent.model = llm_class(model=model or "gemini-2.0-flash")
+        for name, hook in (
+            ("before_tool_callback", before_tool),
+            ("after_tool_callback", after_tool),
+        ):
+            existing = getattr(agent, name)
+            existing = existing if isinstance(existing, list) else [existing]
+            setattr(agent, name, [hook, *filter(None, existing)])
+
+
+def patch_feeds(tech_news_module, recording: Recording, latency_ms: float, record):
+    """Makes fetch_feed parse recorded bodies, or record the bodies it fetches."""
+    import feedparser
+    import requests
+
+    def parse(uri):
+        if record:
+            body = requests.get(uri, timeout=30).content
+            recording.feeds[uri] = base64.b64encode(body).decode("ascii")
+        else:
+            if uri not in recording.feeds:
+                raise LookupError(f"No recorded body for feed {uri}, record again.")
+            time.sleep(latency_ms / 1000)
+            body = base64.b64decode(recording.feeds[uri])
+        return feedparser.parse(body)
+
+    tech_news_module._parse = parse
+
+
+def setup_backends(github_url: str) -> None:
+    """Points the agent's tools at the Firestore, KMS and GitHub stand-ins."""
+    import local_backends
+    from coordinator import github_data
+    from coordinator.sub_agents import user_agent
+
+    db = local_backends.FakeFirestoreClient(latency_ms=0)
+    local_backends.seed_users(db, 1)
+    user_agent._db = db
+    github_data._db = db
+    github_data._kms_client = local_backends.FakeKmsClient(latency_ms=0)
+    github_data.GOOGLE_CLOUD_PROJECT = local_backends.GOOGLE_CLOUD_PROJECT
+    github_data.KMS_LOCATION = local_backends.KMS_LOCATION
+    github_data.KMS_KEY_RING = local_backends.KMS_KEY_RING
+    github_data.KMS_KEY_NAME = local_backends.KMS_KEY_NAME
+    github_data.GITHUB_API_URL = github_url
+
+
+def _state_size(session) -> int:
+    return len(json.dumps(session.state, default=str).encode("utf-8"))
+
+
+def _events_size(session) -> int:
+    return sum(
+        len(event.model_dump_json(exclude_none=True).encode("utf-8"))
+        for event in session.events
+    )
+
+
+async def run_conversation(runner, session_service, metrics: Metrics) -> list[dict]:
+    """Plays CONVERSATION in a new session, returns the metrics of each turn."""
+    from google.genai import types
+
+    session = await session_service.create_session(
+        app_name=APP_NAME, user_id=USER_ID, session_id=uuid.uuid4().hex
+    )
+    turns = []
+    for text in CONVERSATION:
+        metrics.reset()
+        events = 0
+        started = time.perf_counter()
+        async for _ in runner.run_async(
+            user_id=USER_ID,
+            session_id=session.id,
+            new_message=types.Content(role="user", parts=[types.Part(text=text)]),
+        ):
+            events += 1
+        wall = time.perf_counter() - started
+        # AgentTools run nested agents, their time is already in model_seconds
+        function_tool_seconds = sum(
+            sum(durations)
+            for name, durations in metrics.tool_seconds.items()
+            if name not in metrics.agent_tool_names
+        )
+        session = await session_service.get_session(
+            app_name=APP_NAME, user_id=USER_ID, session_id=session.id
+        )
+        turns.append(
+            {
+                "wall_ms": wall * 1000,
+                "model_ms": metrics.model_seconds * 1000,
+                "tool_ms": function_tool_seconds * 1000,
+                "overhead_ms": (wall - metrics.model_seconds - function_tool_seconds)
+                * 1000,
+                "model_calls": metrics.model_calls,
+                "tools": {
+                    name: [d * 1000 for d in durations]
+                    for name, durations in metrics.tool_seconds.items()
+                },
+                "events": events,
+                "state_bytes": _state_size(session),
+                "session_events_bytes": _events_size(session),
+            }
+        )
+    return turns
+
+
+def print_report(runs: list[list[dict]]) -> None:
+    print(
+        f"{'turn':<5} {'wall ms':>9} {'model ms':>9} {'tools ms':>9}"
+        f" {'overhead':>9} {'calls':>6} {'events':>7} {'state B':>8} {'events B':>9}"
+    )
+    for index in range(len(CONVERSATION)):
+        turns = [run[index] for run in runs]
+
+        def median(field):
+            return statistics.median(turn[field] for turn in turns)
+
+        print(
+            f"{index + 1:<5} {median('wall_ms'):9.1f} {median('model_ms'):9.1f}"
+            f" {median('tool_ms'):9.1f} {median('overhead_ms'):9.1f}"
+            f" {median('model_calls'):6.0f} {median('events'):7.0f}"
+            f" {median('state_bytes'):8.0f} {median('session_events_bytes'):9.0f}"
+        )
+    tools = {}
+    for run in runs:
+        for turn in run:
+            for name, durations in turn["tools"].items():
+                tools.setdefault(name, []).extend(durations)
+    if tools:
+        print(f"\n{'tool':<28} {'calls':>6} {'p50 ms':>8} {'max ms':>8}")
+        for name, durations in sorted(tools.items()):
+            print(
+                f"{name:<28} {len(durations):6d} {statistics.median(durations):8.2f}"
+                f" {max(durations):8.2f}"
+            )
+
+
+async def main_async(args) -> int:
+    from mock_github import MockGitHubServer
+
+    if not args.record and not os.path.exists(args.recording):
+        print(f"No recording at {args.recording}, run with --record first.")
+        return 2
+    sys.path[:0] = [AGENT_DIR, FUNCTIONS_DIR]
+    from coordinator.agent import root_agent
+    from coordinator.sub_agents import tech_news_agent
+    from google.adk.runners import Runner
+    from google.adk.sessions import InMemorySessionService
+
+    recording = Recording() if args.record else Recording.load(args.recording)
+    metrics = Metrics()
+    llm_class = make_replay_llm(recording, metrics, args.model_latency_ms, args.record)
+    instrument(root_agent, llm_class, metrics)
+    patch_feeds(tech_news_agent, recording, args.feed_latency_ms, args.record)
+
+    with MockGitHubServer(latency_ms=args.github_latency_ms) as github:
+        setup_backends(github.url)
+        session_service = InMemorySessionService()
+        runner = Runner(
+            app_name=APP_NAME, agent=root_agent, session_service=session_service
+        )
+        runs = []
+        for _ in range(1 if args.record else args.runs):
+            recording.rewind()
+            runs.append(await run_conversation(runner, session_service, metrics))
+
+    if args.record:
+        recording.save(args.recording)
+        print(f"Recorded {len(recording.model_calls)} model requests.")
+    print_report(runs)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"settings": vars(args), "runs": runs}, f, indent=1)
+    return 0
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--record", action="store_true", help="Record live calls.")
+    parser.add_argument("--recording", default=DEFAULT_RECORDING)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--model-latency-ms", type=float, default=0)
+    parser.add_argument("--feed-latency-ms", type=float, default=0)
+    parser.add_argument("--github-latency-ms", type=float, default=0)
+    parser.add_argument("--output", help="Write every turn's metrics as JSON.")
+    args = parser.parse_args(argv)
+    return asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
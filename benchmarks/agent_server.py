@@ -0,0 +1,241 @@
+"""
+Throughput of the agent's server, in requests per second per vCPU.
+
+Serves the agent as agent/main.py does, with its WEB_CONCURRENCY,
+UVICORN_LOOP and UVICORN_HTTP settings taken from the options below, and
+pins the server to `--cpus` CPUs. Every model is replaced by a stub that
+answers after `--model-latency-ms`, without calling tools: the benchmark
+measures the serving stack and ADK's own work per turn, not Gemini's.
+
+`--concurrency` clients each keep one connection open, create a session on
+it, then send `/run` turns, starting a new session every
+`--turns-per-session` turns. A connection stays on the worker that
+accepted it, which lets several workers keep their sessions in memory here.
+
+    cd agent
+    uv run python ../benchmarks/agent_server.py --workers 2 --cpus 2
+    uv run python ../benchmarks/agent_server.py --loop asyncio --http h11
+
+The clients run on the CPUs left to them, or share the server's when there
+are none left: keep that in mind when comparing settings on a small machine.
+"""
+
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from load import summarize
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCHMARKS_DIR)
+AGENT_DIR = os.path.join(REPO_ROOT, "agent")
+
+APP_NAME = "coordinator"
+
+
+def create_benchmark_app():
+    """main.create_app, with every agent's model replaced by the stub."""
+    sys.path.insert(0, AGENT_DIR)
+    import main
+    from google.adk.models.base_llm import BaseLlm
+    from google.adk.models.llm_response import LlmResponse
+    from google.genai import types
+
+    from agent_pipeline import _iter_llm_agents
+
+    latency = float(os.environ["BENCHMARK_MODEL_LATENCY_MS"]) / 1000
+
+    class StubLlm(BaseLlm):
+
+        async def generate_content_async(self, llm_request, stream: bool = False):
+            await asyncio.sleep(latency)
+            yield LlmResponse(
+                content=types.Content(
+                    role="model", parts=[types.Part(text="Stub answer.")]
+                )
+            )
+
+    app = main.create_app()
+    from coordinator.agent import root_agent
+
+    for agent in _iter_llm_agents(root_agent):
+        model = agent.model if isinstance(agent.model, str) else agent.model.model
+        agent.model = StubLlm(model=model or "gemini-2.0-flash")
+    return app
+
+
+def _serve_main(port: int) -> None:
+    """Runs in the server's process, configured by main.py's variables."""
+    import uvicorn
+
+    sys.path.insert(0, AGENT_DIR)
+    import main
+
+    options = {**main.uvicorn_options(), "port": port, "host": "127.0.0.1"}
+    uvicorn.run(
+        "agent_server:create_benchmark_app",
+        factory=True,
+        workers=main.WORKERS,
+        log_level="warning",
+        **options,
+    )
+
+
+def _serve(args, port: int) -> subprocess.Popen:
+    """Starts the server pinned to its CPUs and waits until it answers."""
+    import requests
+
+    env = {
+        **os.environ,
+        "WEB_CONCURRENCY": str(args.workers),
+        "UVICORN_LOOP": args.loop,
+        "UVICORN_HTTP": args.http,
+        "BENCHMARK_MODEL_LATENCY_MS": str(args.model_latency_ms),
+        "PYTHONPATH": BENCHMARKS_DIR,
+    }
+    process = subprocess.Popen(
+        [sys.executable, __file__, "--serve", str(port)],
+        cwd=AGENT_DIR,
+        env=env,
+        preexec_fn=lambda: os.sched_setaffinity(0, args.server_cpus),
+        stdout=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            requests.get(f"http://127.0.0.1:{port}/list-apps", timeout=1)
+            return process
+        except requests.exceptions.ConnectionError:
+            if process.poll() is not None:
+                break
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError("The agent server didn't start.")
+
+
+def _run(url: str, total: int, warmup: int, concurrency: int, turns: int) -> dict:
+    """Sends turns over keep-alive connections, `concurrency` at a time."""
+    import requests
+
+    local = threading.local()
+    lock = threading.Lock()
+    samples, errors = {}, {}
+
+    def record(route, latency, status, measure):
+        if measure:
+            with lock:
+                samples.setdefault(route, []).append(latency)
+                if status >= 400:
+                    errors[route] = errors.get(route, 0) + 1
+
+    def post(route, path, body, measure):
+        before = time.perf_counter()
+        try:
+            status = local.session.post(url + path, json=body, timeout=60).status_code
+        except requests.exceptions.RequestException:
+            status = 599
+        record(route, time.perf_counter() - before, status, measure)
+
+    def send(measure: bool):
+        if getattr(local, "session", None) is None:
+            local.session = requests.Session()
+            local.user_id = f"bench-{uuid.uuid4().hex[:8]}"
+            local.turns = turns
+        if local.turns == turns:
+            local.session_id = uuid.uuid4().hex
+            local.turns = 0
+            post(
+                "create_session",
+                f"/apps/{APP_NAME}/users/{local.user_id}/sessions/{local.session_id}",
+                {},
+                measure,
+            )
+        local.turns += 1
+        post(
+            "run",
+            "/run",
+            {
+                "appName": APP_NAME,
+                "userId": local.user_id,
+                "sessionId": local.session_id,
+                "newMessage": {"role": "user", "parts": [{"text": "Hello"}]},
+            },
+            measure,
+        )
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(lambda _: send(False), range(warmup)))
+        started = time.perf_counter()
+        list(executor.map(lambda _: send(True), range(total)))
+        elapsed = time.perf_counter() - started
+    return summarize(samples, elapsed, errors)
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Agent server throughput.")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument(
+        "--cpus", type=int, help="CPUs of the server, --workers by default."
+    )
+    parser.add_argument("--loop", default="auto", choices=["auto", "uvloop", "asyncio"])
+    parser.add_argument("--http", default="auto", choices=["auto", "httptools", "h11"])
+    parser.add_argument("--model-latency-ms", type=float, default=0)
+    parser.add_argument("--requests", type=int, default=2000, help="Measured turns.")
+    parser.add_argument("--warmup", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--turns-per-session", type=int, default=5)
+    parser.add_argument("--port", type=int, default=8790)
+    parser.add_argument("--serve", type=int, metavar="PORT", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if args.serve:
+        _serve_main(args.serve)
+        return 0
+
+    available = sorted(os.sched_getaffinity(0))
+    cpus = min(args.cpus or args.workers, len(available))
+    args.server_cpus = set(available[:cpus])
+    client_cpus = set(available[cpus:]) or args.server_cpus
+    os.sched_setaffinity(0, client_cpus)
+
+    server = _serve(args, args.port)
+    try:
+        results = _run(
+            f"http://127.0.0.1:{args.port}",
+            args.requests,
+            args.warmup,
+            args.concurrency,
+            args.turns_per_session,
+        )
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+    print(
+        f"\n{args.workers} worker(s) on {cpus} CPU(s), loop={args.loop},"
+        f" http={args.http}, model latency {args.model_latency_ms:g} ms,"
+        f" {args.concurrency} clients"
+        + (" sharing the server's CPUs" if client_cpus == args.server_cpus else "")
+    )
+    print(
+        f"{results['throughput_rps']:.1f} requests/s,"
+        f" {results['throughput_rps'] / cpus:.1f} requests/s per vCPU,"
+        f" {results['errors']} errors"
+    )
+    print(f"  {'route':<16} {'count':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    rows = [*results["routes"].items(), ("overall", results["overall"])]
+    for route, stats in rows:
+        print(
+            f"  {route:<16} {stats['count']:6d} {stats['p50_ms']:8.2f}"
+            f" {stats['p95_ms']:8.2f} {stats['p99_ms']:8.2f}"
+        )
+    return 1 if results["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
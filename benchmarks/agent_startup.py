@@ -0,0 +1,112 @@
+"""
+Startup benchmark of the agent's server.
+
+Every sample starts agent/main.py in a new process, like a new Cloud Run
+instance, and reports how long it takes until the server answers its first
+request, then the latency of the first session creation. Run it from the
+agent's environment:
+
+    cd agent
+    uv run python ../benchmarks/agent_startup.py --runs 5
+    uv run python ../benchmarks/agent_startup.py --uv            # `uv run python main.py`
+    uv run python ../benchmarks/agent_startup.py --cold-bytecode # No .pyc to reuse
+
+`--cold-bytecode` gives every sample an empty bytecode cache, as a container
+whose image was built without precompiled bytecode. For the breakdown of
+the import time, see `python main.py --profile-startup`.
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCHMARKS_DIR)
+AGENT_DIR = os.path.join(REPO_ROOT, "agent")
+
+
+def measure_start(command: list[str], port: int, cold_bytecode: bool) -> dict:
+    """Starts the server once and times it until it answers."""
+    import requests
+
+    env = {**os.environ, "PORT": str(port), "HOST": "127.0.0.1"}
+    with tempfile.TemporaryDirectory() as cache_dir:
+        if cold_bytecode:
+            env["PYTHONPYCACHEPREFIX"] = cache_dir
+        started = time.perf_counter()
+        process = subprocess.Popen(
+            command,
+            cwd=AGENT_DIR,
+            env=env,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        try:
+            while True:
+                try:
+                    requests.get(f"http://127.0.0.1:{port}/list-apps", timeout=1)
+                    break
+                except requests.exceptions.ConnectionError:
+                    if process.poll() is not None:
+                        raise RuntimeError(f"{' '.join(command)} exited.")
+                    if time.perf_counter() - started > 120:
+                        raise RuntimeError("The agent server didn't start.")
+                    time.sleep(0.02)
+            ready = time.perf_counter()
+            status = requests.post(
+                f"http://127.0.0.1:{port}/apps/coordinator/users/startup/sessions",
+                json={},
+                timeout=30,
+            ).status_code
+            done = time.perf_counter()
+        finally:
+            process.terminate()
+            process.wait(timeout=30)
+    return {
+        "ready_ms": (ready - started) * 1000,
+        "first_session_ms": (done - ready) * 1000,
+        "status": status,
+    }
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Agent server startup benchmark.")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--uv", action="store_true", help="Start with `uv run`.")
+    parser.add_argument(
+        "--cold-bytecode", action="store_true", help="Start without a .pyc cache."
+    )
+    parser.add_argument("--port", type=int, default=8791)
+    args = parser.parse_args(argv)
+
+    command = [sys.executable, "main.py"]
+    if args.uv:
+        command = ["uv", "run", "python", "main.py"]
+    samples = [
+        measure_start(command, args.port, args.cold_bytecode) for _ in range(args.runs)
+    ]
+
+    ready = [s["ready_ms"] for s in samples]
+    first = [s["first_session_ms"] for s in samples]
+    print(
+        f"{' '.join(command)}"
+        + (", cold bytecode" if args.cold_bytecode else "")
+        + f", {args.runs} runs"
+    )
+    print(f"  {'':<18} {'median':>9} {'min':>9} {'max':>9}")
+    for name, values in (("ready ms", ready), ("1st session ms", first)):
+        print(
+            f"  {name:<18} {statistics.median(values):9.1f} {min(values):9.1f}"
+            f" {max(values):9.1f}"
+        )
+    statuses = sorted({s["status"] for s in samples})
+    print(f"  statuses: {','.join(map(str, statuses))}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,155 @@
+"""
+Cold-start benchmark of a Cloud Function.
+
+Every sample runs in a fresh interpreter, like a new function instance: it
+imports the function's main module, then serves a single request through its
+functions_framework `handler`. The script reports the import time and the
+latency of that first request for each route, plus the heaviest imports as
+measured by `python -X importtime`.
+
+    python benchmarks/cold_start.py --function users --runs 5
+
+Routes touching Firestore need somewhere to send their RPCs: point
+FIRESTORE_EMULATOR_HOST at an emulator to run the benchmark offline. Without
+one, the first request still measures the client bootstrap, then fails.
+"""
+
+import argparse
+import base64
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FUNCTIONS_DIR = os.path.join(REPO_ROOT, "functions")
+
+BENCHMARK_USER_INFO = base64.b64encode(
+    json.dumps(
+        {"sub": "cold-start-user", "email": "cold@example.com", "name": "Cold"}
+    ).encode("utf-8")
+).decode("ascii")
+
+# (name, method, path, JSON body) of the requests sent to each function.
+ROUTES = {
+    "users": [
+        ("OPTIONS /", "OPTIONS", "/", None),
+        ("GET /", "GET", "/", None),
+        ("POST /", "POST", "/", {"displayName": "Cold Start"}),
+        ("PUT /", "PUT", "/", {"displayName": "Cold Start"}),
+        ("DELETE /", "DELETE", "/", None),
+    ],
+}
+
+# Runs in the child interpreter: times the import, then the first request.
+_CHILD_SCRIPT = """
+import json, sys, time
+started = time.perf_counter()
+import main
+imported = time.perf_counter()
+method, path, body, user_info = json.loads(sys.argv[1])
+kwargs = {"method": method, "headers": {
+    "Origin": "http://localhost:3000",
+    "Access-Control-Request-Method": "GET",
+    "X-Apigateway-Api-Userinfo": user_info,
+}}
+if body is not None:
+    kwargs["json"] = body
+with main.app.test_request_context(path, **kwargs):
+    from flask import request
+    before = time.perf_counter()
+    response = main.app.make_response(main.handler(request))
+    done = time.perf_counter()
+print(json.dumps({
+    "import_ms": (imported - started) * 1000,
+    "first_request_ms": (done - before) * 1000,
+    "status": response.status_code,
+    "modules": len(sys.modules),
+}))
+"""
+
+
+def _child_env() -> dict:
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(
+        filter(None, [FUNCTIONS_DIR, env.get("PYTHONPATH")])
+    )
+    return env
+
+
+def measure_route(function_dir: str, method: str, path: str, body) -> dict:
+    """Measures one cold start followed by one request, in a new interpreter."""
+    result = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            _CHILD_SCRIPT,
+            json.dumps([method, path, body, BENCHMARK_USER_INFO]),
+        ],
+        cwd=function_dir,
+        env=_child_env(),
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def import_profile(function_dir: str, top: int) -> list[tuple[str, float]]:
+    """Returns the `top` direct imports of main by cumulative time, in ms."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=function_dir,
+        env=_child_env(),
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    direct_imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        # One level of indentation below main, i.e. imported by main itself
+        if name.startswith("   ") and not name.startswith("    "):
+            direct_imports.append((name.strip(), int(cumulative) / 1000))
+    return sorted(direct_imports, key=lambda item: item[1], reverse=True)[:top]
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Cloud Function cold-start benchmark.")
+    parser.add_argument("--function", default="users", choices=sorted(ROUTES))
+    parser.add_argument("--runs", type=int, default=5, help="Cold starts per route.")
+    parser.add_argument("--top", type=int, default=10, help="Imports to report.")
+    args = parser.parse_args(argv)
+
+    function_dir = os.path.join(FUNCTIONS_DIR, args.function)
+
+    print(f"Heaviest imports of {args.function}/main.py (cumulative ms):")
+    for name, cumulative_ms in import_profile(function_dir, args.top):
+        print(f"  {cumulative_ms:9.1f}  {name}")
+
+    print()
+    print(
+        f"{'route':<12} {'import ms':>10} {'1st req ms':>11} {'total ms':>9}"
+        f" {'modules':>8} status"
+    )
+    for name, method, path, body in ROUTES[args.function]:
+        samples = [
+            measure_route(function_dir, method, path, body) for _ in range(args.runs)
+        ]
+        import_ms = statistics.median(s["import_ms"] for s in samples)
+        request_ms = statistics.median(s["first_request_ms"] for s in samples)
+        statuses = sorted({s["status"] for s in samples})
+        print(
+            f"{name:<12} {import_ms:10.1f} {request_ms:11.1f}"
+            f" {import_ms + request_ms:9.1f}"
+            f" {max(s['modules'] for s in samples):8d}"
+            f" {','.join(map(str, statuses))}"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
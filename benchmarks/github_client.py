@@ -0,0 +1,98 @@
+"""
+Benchmark of github-integration's GitHub client against a local mock GitHub.
+
+Compares the callback's two GitHub calls (token exchange, then /user) made
+with bare `requests` calls, which open a new connection each time, to the
+same calls through the pooled GitHubClient. Reports throughput and latency
+percentiles per callback.
+
+    python benchmarks/github_client.py --requests 500 --concurrency 8
+
+The mock serves plain HTTP on localhost, so the saving measured is the TCP
+handshake only: against api.github.com the TLS handshake saved by keep-alive
+comes on top.
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from mock_github import MockGitHubServer
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [
+    os.path.join(REPO_ROOT, "functions", "github-integration"),
+    os.path.join(REPO_ROOT, "functions"),
+]
+
+from github_client import GitHubClient  # noqa: E402
+
+
+def _callback_calls(http, base_url: str) -> None:
+    """The GitHub calls of one OAuth callback."""
+    token = http.post(
+        f"{base_url}/login/oauth/access_token",
+        data={"code": "benchmark"},
+        headers={"Accept": "application/json"},
+        timeout=(3.05, 10),
+    ).json()["access_token"]
+    http.get(
+        f"{base_url}/user",
+        headers={"Authorization": f"token {token}"},
+        timeout=(3.05, 10),
+    ).raise_for_status()
+
+
+def run(http, base_url: str, total: int, concurrency: int) -> dict:
+    """Runs `total` callbacks over `concurrency` threads, returns the stats."""
+
+    def timed(_):
+        started = time.perf_counter()
+        _callback_calls(http, base_url)
+        return time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        latencies = sorted(executor.map(timed, range(total)))
+    elapsed = time.perf_counter() - started
+    quantiles = statistics.quantiles(latencies, n=100)
+    return {
+        "throughput": total / elapsed,
+        "p50": quantiles[49] * 1000,
+        "p95": quantiles[94] * 1000,
+        "p99": quantiles[98] * 1000,
+    }
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--requests", type=int, default=500, help="Callbacks to run.")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--latency-ms", type=float, default=5)
+    args = parser.parse_args(argv)
+
+    with MockGitHubServer(latency_ms=args.latency_ms) as server:
+        clients = {
+            "requests (no pooling)": requests,
+            "GitHubClient (pooled)": GitHubClient(pool_size=args.concurrency),
+        }
+        print(
+            f"{'client':<24} {'callbacks/s':>12} {'p50 ms':>8} {'p95 ms':>8}"
+            f" {'p99 ms':>8}"
+        )
+        for name, http in clients.items():
+            run(http, server.url, min(args.requests, 20), args.concurrency)  # Warm up
+            stats = run(http, server.url, args.requests, args.concurrency)
+            print(
+                f"{name:<24} {stats['throughput']:12.1f} {stats['p50']:8.2f}"
+                f" {stats['p95']:8.2f} {stats['p99']:8.2f}"
+            )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,498 @@
+"""
+Load test of the three Cloud Functions, against the local stand-ins.
+
+Drives each function through a weighted mix of its routes, with the
+backends replaced by the stand-ins of local_backends.py (Firestore, KMS,
+GitHub, agent), and reports throughput and p50/p95/p99 latencies per route.
+
+Two modes:
+
+* wsgi: requests go straight through the function's `handler` in one
+  process, one at a time. This measures the function's own cost per request,
+  and the memory allocated per request (tracemalloc, in a separate pass).
+* http: the function is served by functions-framework, and `--concurrency`
+  keep-alive clients send requests to it. This measures the serving stack.
+
+    python benchmarks/load.py --mode wsgi --requests 2000
+    python benchmarks/load.py --mode http --function users --concurrency 16
+
+Each function runs in its own interpreter with the stand-ins' environment.
+
+Baselines live in benchmarks/baselines/<function>-<mode>.json.
+`--save-baseline` records the results. `--compare` fails with exit code 1
+when the throughput, a p95 or the allocations per request regressed by more
+than `--tolerance` (and by more than MIN_REGRESSION for the latter two).
+Baselines are only comparable on the machine and with the settings they
+were recorded with: re-record them on the machine that runs the comparison.
+"""
+
+import argparse
+import base64
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCHMARKS_DIR)
+FUNCTIONS_DIR = os.path.join(REPO_ROOT, "functions")
+BASELINES_DIR = os.path.join(BENCHMARKS_DIR, "baselines")
+
+# Users seeded in the fake Firestore, read and updated by the mix.
+SEEDED_USERS = 200
+# Changes smaller than these are noise, whatever the relative tolerance.
+MIN_REGRESSION = {"p95_ms": 0.5, "alloc_kib": 1.0}
+
+
+def _user_info(user_id: str) -> str:
+    claims = {"sub": user_id, "email": f"{user_id}@example.com", "name": user_id}
+    return base64.b64encode(json.dumps(claims).encode("utf-8")).decode("ascii")
+
+
+class RequestMix:
+    """Draws the requests sent to a function, with the mix's weights.
+
+    Profiles created by the mix's POSTs are the ones its DELETEs remove, so
+    that reads and updates keep hitting the seeded users.
+    """
+
+    def __init__(self, function: str, seed: int = 0):
+        self.routes = MIXES[function]
+        self.weights = [weight for _, weight, _ in self.routes]
+        self._random = random.Random(seed)
+        self._created = []
+        self._counter = 0
+        self._lock = threading.Lock()
+
+    def next(self) -> tuple[str, dict]:
+        """Returns (route name, request) with request holding method, path,
+        headers and an optional JSON body."""
+        with self._lock:
+            name, _, build = self._random.choices(self.routes, self.weights)[0]
+            return name, build(self)
+
+    def seeded_user(self) -> str:
+        return f"user-{self._random.randrange(SEEDED_USERS)}"
+
+    def new_user(self) -> str:
+        self._counter += 1
+        user_id = f"load-{os.getpid()}-{self._counter}"
+        self._created.append(user_id)
+        return user_id
+
+    def created_user(self) -> str:
+        return self._created.pop() if self._created else self.new_user()
+
+
+def _request(method, path, user_id, body=None, headers=None) -> dict:
+    return {
+        "method": method,
+        "path": path,
+        "headers": {
+            "X-Apigateway-Api-Userinfo": _user_info(user_id),
+            **(headers or {}),
+        },
+        "json": body,
+    }
+
+
+MIXES = {
+    "users": [
+        ("GET /", 50, lambda mix: _request("GET", "/", mix.seeded_user())),
+        (
+            "POST /",
+            10,
+            lambda mix: _request(
+                "POST", "/", mix.new_user(), {"cookieConsent": "true"}
+            ),
+        ),
+        (
+            "PUT /",
+            25,
+            lambda mix: _request(
+                "PUT",
+                "/",
+                mix.seeded_user(),
+                {"metadata": {"theme": mix._random.choice(["dark", "light"])}},
+                {"Prefer": "return=minimal"},
+            ),
+        ),
+        ("DELETE /", 5, lambda mix: _request("DELETE", "/", mix.created_user())),
+        (
+            "OPTIONS /",
+            10,
+            lambda mix: {
+                "method": "OPTIONS",
+                "path": "/",
+                "headers": {
+                    "Origin": "http://localhost:3000",
+                    "Access-Control-Request-Method": "PUT",
+                },
+                "json": None,
+            },
+        ),
+    ],
+    "session-mapper": [
+        (
+            "POST /",
+            100,
+            lambda mix: _request(
+                "POST", "/", mix.seeded_user(), {}, {"X-App": "coordinator"}
+            ),
+        ),
+    ],
+    "github-integration": [
+        (
+            "GET status",
+            70,
+            lambda mix: _request("GET", "/api/v1/github/status", mix.seeded_user()),
+        ),
+        (
+            "GET connect",
+            15,
+            lambda mix: _request("GET", "/api/v1/github/connect", mix.seeded_user()),
+        ),
+        (
+            "GET callback",
+            15,
+            lambda mix: _request(
+                "GET",
+                f"/api/v1/github/callback?code=load&state={mix.seeded_user()}",
+                "anonymous",
+            ),
+        ),
+    ],
+}
+
+
+# --- Statistics ---
+
+
+def summarize(samples: dict[str, list[float]], elapsed: float, errors: dict) -> dict:
+    """Turns latencies per route, in seconds, into the reported statistics."""
+
+    def stats(latencies):
+        latencies = sorted(latencies)
+        if len(latencies) > 1:
+            quantiles = statistics.quantiles(latencies, n=100, method="inclusive")
+        else:
+            quantiles = latencies * 99
+        return {
+            "count": len(latencies),
+            "p50_ms": quantiles[49] * 1000,
+            "p95_ms": quantiles[94] * 1000,
+            "p99_ms": quantiles[98] * 1000,
+        }
+
+    every = [latency for latencies in samples.values() for latency in latencies]
+    return {
+        "throughput_rps": len(every) / elapsed if elapsed else 0.0,
+        "errors": sum(errors.values()),
+        "overall": stats(every),
+        "routes": {
+            route: {**stats(latencies), "errors": errors.get(route, 0)}
+            for route, latencies in sorted(samples.items())
+        },
+    }
+
+
+# --- In-process (WSGI) mode, run in the function's own interpreter ---
+
+
+def _wsgi_worker(function: str, total: int, warmup: int, alloc_samples: int) -> dict:
+    """Sends requests through the function's handler, in this process."""
+    sys.path[:0] = [os.path.join(FUNCTIONS_DIR, function), FUNCTIONS_DIR]
+    import logging
+
+    import main
+    from flask import Request
+    from werkzeug.test import EnvironBuilder
+
+    logging.disable(logging.WARNING)  # Measure the functions, not the terminal
+
+    def call(request) -> int:
+        environ = EnvironBuilder(
+            path=request["path"],
+            method=request["method"],
+            headers=request["headers"],
+            json=request["json"],
+        ).get_environ()
+        response = main.app.make_response(main.handler(Request(environ)))
+        response.get_data()  # Drains streamed bodies
+        return response.status_code
+
+    mix = RequestMix(function)
+    for _ in range(warmup):
+        call(mix.next()[1])
+
+    samples, errors = {}, {}
+    started = time.perf_counter()
+    for _ in range(total):
+        route, request = mix.next()
+        before = time.perf_counter()
+        status = call(request)
+        samples.setdefault(route, []).append(time.perf_counter() - before)
+        if status >= 400:
+            errors[route] = errors.get(route, 0) + 1
+    results = summarize(samples, time.perf_counter() - started, errors)
+
+    # Peak memory allocated while serving a request, over a baseline taken
+    # right before it. tracemalloc slows everything down, hence its own pass.
+    allocations = {}
+    tracemalloc.start()
+    for _ in range(alloc_samples):
+        route, request = mix.next()
+        tracemalloc.reset_peak()
+        current, _ = tracemalloc.get_traced_memory()
+        call(request)
+        allocations.setdefault(route, []).append(
+            tracemalloc.get_traced_memory()[1] - current
+        )
+    tracemalloc.stop()
+    for route, values in allocations.items():
+        results["routes"].setdefault(route, {})["alloc_kib"] = (
+            statistics.mean(values) / 1024
+        )
+    every = [value for values in allocations.values() for value in values]
+    results["overall"]["alloc_kib"] = statistics.mean(every) / 1024 if every else 0.0
+    return results
+
+
+# --- HTTP mode ---
+
+
+def _serve(function: str, port: int, env: dict) -> subprocess.Popen:
+    """Starts functions-framework for a function and waits until it answers."""
+    import requests
+
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "functions_framework",
+            "--target",
+            "handler",
+            "--port",
+            str(port),
+        ],
+        cwd=os.path.join(FUNCTIONS_DIR, function),
+        env={**env, "LOG_LEVEL": "WARNING"},
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            requests.options(f"http://127.0.0.1:{port}/", timeout=1)
+            return process
+        except requests.exceptions.ConnectionError:
+            if process.poll() is not None:
+                break
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError(f"functions-framework didn't start for {function}.")
+
+
+def _http_run(function: str, url: str, total: int, warmup: int, concurrency: int):
+    """Sends requests over keep-alive connections, `concurrency` at a time."""
+    import requests
+
+    mix = RequestMix(function)
+    local = threading.local()
+    lock = threading.Lock()
+    samples, errors = {}, {}
+
+    def send(measure: bool):
+        session = getattr(local, "session", None)
+        if session is None:
+            session = local.session = requests.Session()
+        route, request = mix.next()
+        before = time.perf_counter()
+        try:
+            status = session.request(
+                request["method"],
+                url + request["path"],
+                headers=request["headers"],
+                json=request["json"],
+                allow_redirects=False,
+                timeout=30,
+            ).status_code
+        except requests.exceptions.RequestException:
+            status = 599
+        latency = time.perf_counter() - before
+        if measure:
+            with lock:
+                samples.setdefault(route, []).append(latency)
+                if status >= 400:
+                    errors[route] = errors.get(route, 0) + 1
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(lambda _: send(False), range(warmup)))
+        started = time.perf_counter()
+        list(executor.map(lambda _: send(True), range(total)))
+        elapsed = time.perf_counter() - started
+    return summarize(samples, elapsed, errors)
+
+
+# --- Baselines ---
+
+
+def baseline_path(function: str, mode: str) -> str:
+    return os.path.join(BASELINES_DIR, f"{function}-{mode}.json")
+
+
+def compare(baseline: dict, results: dict, tolerance: float) -> list[str]:
+    """Returns the regressions of results over baseline, beyond tolerance."""
+    regressions = []
+    if results["throughput_rps"] < baseline["throughput_rps"] * (1 - tolerance):
+        regressions.append(
+            f"throughput {results['throughput_rps']:.1f} rps, baseline"
+            f" {baseline['throughput_rps']:.1f} rps"
+        )
+    for route, stats in results["routes"].items():
+        reference = baseline["routes"].get(route)
+        if reference is None:
+            continue
+        for metric in ("p95_ms", "alloc_kib"):
+            if metric not in stats or metric not in reference:
+                continue
+            if stats[metric] > reference[metric] * (1 + tolerance) and (
+                stats[metric] - reference[metric] > MIN_REGRESSION[metric]
+            ):
+                regressions.append(
+                    f"{route} {metric} {stats[metric]:.2f}, baseline"
+                    f" {reference[metric]:.2f}"
+                )
+    return regressions
+
+
+def print_results(function: str, mode: str, results: dict) -> None:
+    print(
+        f"\n{function} ({mode}): {results['throughput_rps']:.1f} requests/s,"
+        f" {results['errors']} errors"
+    )
+    print(
+        f"  {'route':<14} {'count':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}"
+        f" {'alloc KiB':>10}"
+    )
+    rows = [*results["routes"].items(), ("overall", results["overall"])]
+    for route, stats in rows:
+        alloc = f"{stats['alloc_kib']:10.1f}" if "alloc_kib" in stats else " " * 10
+        print(
+            f"  {route:<14} {stats.get('count', 0):6d} {stats.get('p50_ms', 0):8.2f}"
+            f" {stats.get('p95_ms', 0):8.2f} {stats.get('p99_ms', 0):8.2f} {alloc}"
+        )
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--function", action="append", choices=sorted(MIXES))
+    parser.add_argument("--mode", choices=["wsgi", "http"], default="wsgi")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--warmup", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--alloc-samples", type=int, default=200)
+    parser.add_argument(
+        "--latency-ms",
+        type=float,
+        default=0,
+        help="Latency of every stand-in backend call.",
+    )
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--compare", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker:
+        results = _wsgi_worker(
+            args.worker, args.requests, args.warmup, args.alloc_samples
+        )
+        print(json.dumps(results))
+        return 0
+
+    from local_backends import function_env
+    from mock_agent import MockAgentServer
+    from mock_github import MockGitHubServer
+
+    failed = False
+    with MockGitHubServer(latency_ms=args.latency_ms) as github, MockAgentServer(
+        latency_ms=args.latency_ms
+    ) as agent:
+        env = {
+            **os.environ,
+            **function_env(
+                github.url,
+                agent.url,
+                args.latency_ms,
+                args.latency_ms,
+                users=SEEDED_USERS,
+            ),
+        }
+        for port, function in enumerate(args.function or sorted(MIXES), 18080):
+            if args.mode == "wsgi":
+                output = subprocess.run(
+                    [
+                        sys.executable,
+                        __file__,
+                        "--worker",
+                        function,
+                        "--requests",
+                        str(args.requests),
+                        "--warmup",
+                        str(args.warmup),
+                        "--alloc-samples",
+                        str(args.alloc_samples),
+                    ],
+                    env=env,
+                    capture_output=True,
+                    text=True,
+                    check=True,
+                ).stdout
+                results = json.loads(output.strip().splitlines()[-1])
+            else:
+                server = _serve(function, port, env)
+                try:
+                    results = _http_run(
+                        function,
+                        f"http://127.0.0.1:{port}",
+                        args.requests,
+                        args.warmup,
+                        args.concurrency,
+                    )
+                finally:
+                    server.terminate()
+                    server.wait()
+            results["settings"] = {
+                "requests": args.requests,
+                "concurrency": args.concurrency if args.mode == "http" else 1,
+                "latency_ms": args.latency_ms,
+            }
+            print_results(function, args.mode, results)
+
+            path = baseline_path(function, args.mode)
+            if args.compare:
+                if not os.path.exists(path):
+                    print(f"  No baseline at {path}.")
+                else:
+                    with open(path, encoding="utf-8") as f:
+                        regressions = compare(json.load(f), results, args.tolerance)
+                    for regression in regressions:
+                        print(f"  REGRESSION: {regression}")
+                    failed = failed or bool(regressions)
+            if args.save_baseline:
+                os.makedirs(BASELINES_DIR, exist_ok=True)
+                with open(path, "w", encoding="utf-8") as f:
+                    json.dump(results, f, indent=2, sort_keys=True)
+                    f.write("\n")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,422 @@
+"""
+Local stand-ins for the backends of the functions, for offline benchmarks.
+
+* FakeFirestoreClient: an in-memory, Firestore-compatible client covering
+  what the functions and the agent's sessions use (documents,
+  subcollections, field masks, merges, sentinels, get_all, select), with a
+  configurable latency per call.
+* FakeKmsClient: a KMS client doing real AES-GCM with keys derived from the
+  key path, so that ciphertexts stay valid across processes.
+* The mock GitHub (mock_github.py) and the stub agent (mock_agent.py) HTTP
+  servers.
+
+The functions pick the in-process stand-ins through environment variables
+(see functions/shared/clients.py), and `function_env` returns the full set
+of variables. Run this module to start the HTTP stand-ins and print the
+environment for the functions:
+
+    python benchmarks/local_backends.py --latency-ms 5
+
+Configuration of the fakes, read when they are created:
+
+    FAKE_FIRESTORE_LATENCY_MS  Delay per Firestore call (default 0).
+    FAKE_FIRESTORE_USERS       Users seeded with a profile and a GitHub token,
+                               "user-0" to "user-<n-1>" (default 0).
+    FAKE_KMS_LATENCY_MS        Delay per KMS call (default 0).
+"""
+
+import argparse
+import copy
+import datetime
+import hashlib
+import os
+import sys
+import threading
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCHMARKS_DIR)
+FUNCTIONS_DIR = os.path.join(REPO_ROOT, "functions")
+
+KMS_LOCATION = "local"
+KMS_KEY_RING = "local-keyring"
+KMS_KEY_NAME = "local-key"
+GOOGLE_CLOUD_PROJECT = "local-project"
+
+
+def _latency(variable: str) -> float:
+    return float(os.getenv(variable, "0")) / 1000
+
+
+class _Response:
+    """The fields of the KMS and Firestore responses read by the functions."""
+
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+
+# --- KMS ---
+
+
+class FakeKmsClient:
+    """A KMS client encrypting with AES-GCM under keys derived from their path.
+
+    Args:
+        latency_ms (float | None): Delay per call, FAKE_KMS_LATENCY_MS if None.
+    """
+
+    def __init__(self, latency_ms: float | None = None):
+        self.latency = (
+            _latency("FAKE_KMS_LATENCY_MS") if latency_ms is None else latency_ms / 1000
+        )
+
+    @staticmethod
+    def crypto_key_path(project, location, key_ring, crypto_key) -> str:
+        return (
+            f"projects/{project}/locations/{location}/keyRings/{key_ring}"
+            f"/cryptoKeys/{crypto_key}"
+        )
+
+    @staticmethod
+    def _aead(name: str):
+        from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+        return AESGCM(hashlib.sha256(name.encode("utf-8")).digest())
+
+    def encrypt(self, name: str, plaintext: bytes, **_kwargs):
+        time.sleep(self.latency)
+        nonce = os.urandom(12)
+        ciphertext = nonce + self._aead(name).encrypt(nonce, plaintext, None)
+        return _Response(name=name, ciphertext=ciphertext)
+
+    def decrypt(self, name: str, ciphertext: bytes, **_kwargs):
+        time.sleep(self.latency)
+        plaintext = self._aead(name).decrypt(ciphertext[:12], ciphertext[12:], None)
+        return _Response(name=name, plaintext=plaintext)
+
+
+# --- Firestore ---
+
+
+def _now() -> datetime.datetime:
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def _pick(data: dict, field_paths) -> dict:
+    """Applies a field mask, dotted paths selecting nested fields."""
+    if field_paths is None:
+        return copy.deepcopy(data)
+    picked = {}
+    for path in field_paths:
+        source, target = data, picked
+        parts = path.split(".")
+        for part in parts[:-1]:
+            if not isinstance(source.get(part), dict):
+                break
+            source = source[part]
+            target = target.setdefault(part, {})
+        else:
+            if parts[-1] in source:
+                target[parts[-1]] = copy.deepcopy(source[parts[-1]])
+    return picked
+
+
+def _merge(target: dict, fields: dict) -> None:
+    for key, value in fields.items():
+        if isinstance(value, dict) and isinstance(target.get(key), dict):
+            _merge(target[key], value)
+        else:
+            target[key] = copy.deepcopy(value)
+
+
+class FakeDocumentSnapshot:
+
+    def __init__(self, reference, data, create_time=None, update_time=None):
+        self.reference = reference
+        self.id = reference.id
+        self.exists = data is not None
+        self.create_time = create_time
+        self.update_time = update_time
+        self._data = data
+
+    def to_dict(self):
+        return self._data
+
+    def get(self, field_path: str):
+        value = self._data
+        for part in field_path.split("."):
+            value = value[part]
+        return value
+
+
+class FakeDocumentReference:
+
+    def __init__(self, client, path: str):
+        self._client = client
+        self.path = path
+        self.id = path.rsplit("/", 1)[-1]
+
+    def collection(self, collection_id: str):
+        return FakeCollectionReference(self._client, f"{self.path}/{collection_id}")
+
+    def get(self, field_paths=None, **_kwargs):
+        self._client._wait()
+        return self._client._snapshot(self, field_paths)
+
+    def set(self, document_data: dict, merge: bool = False, **_kwargs):
+        self._client._wait()
+        return self._client._write(self.path, document_data, merge=merge)
+
+    def update(self, field_updates: dict, **_kwargs):
+        self._client._wait()
+        return self._client._write(self.path, field_updates, update=True)
+
+    def delete(self, **_kwargs):
+        self._client._wait()
+        with self._client._lock:
+            self._client._documents.pop(self.path, None)
+        return _Response(update_time=_now())
+
+
+class FakeCollectionReference:
+
+    def __init__(self, client, path: str):
+        self._client = client
+        self.path = path
+        self.id = path.rsplit("/", 1)[-1]
+
+    def document(self, document_id: str):
+        return FakeDocumentReference(self._client, f"{self.path}/{document_id}")
+
+    def select(self, field_paths):
+        return FakeQuery(self, field_paths)
+
+    def stream(self, field_paths=None, **_kwargs):
+        self._client._wait()
+        prefix = f"{self.path}/"
+        with self._client._lock:
+            paths = sorted(
+                path
+                for path in self._client._documents
+                if path.startswith(prefix) and "/" not in path[len(prefix) :]
+            )
+        for path in paths:
+            snapshot = self._client._snapshot(
+                FakeDocumentReference(self._client, path), field_paths
+            )
+            if snapshot.exists:
+                yield snapshot
+
+
+class FakeQuery:
+    """A collection's documents restricted to some fields, see select()."""
+
+    def __init__(self, collection, field_paths):
+        self._collection = collection
+        self._field_paths = list(field_paths)
+
+    def stream(self, **_kwargs):
+        return self._collection.stream(field_paths=self._field_paths)
+
+
+class FakeFirestoreClient:
+    """An in-memory Firestore client, its documents shared within the process.
+
+    Args:
+        latency_ms (float | None): Delay per call, FAKE_FIRESTORE_LATENCY_MS
+            if None.
+    """
+
+    # path -> (data, create_time, update_time), shared by every client like
+    # the real database is.
+    _documents: dict = {}
+    _lock = threading.Lock()
+    _seeded = False
+
+    def __init__(self, latency_ms: float | None = None):
+        self.latency = (
+            _latency("FAKE_FIRESTORE_LATENCY_MS")
+            if latency_ms is None
+            else latency_ms / 1000
+        )
+        with FakeFirestoreClient._lock:
+            seed = not FakeFirestoreClient._seeded
+            FakeFirestoreClient._seeded = True
+        if seed:
+            seed_users(self, int(os.getenv("FAKE_FIRESTORE_USERS", "0")))
+
+    def _wait(self):
+        time.sleep(self.latency)
+
+    def collection(self, collection_id: str):
+        return FakeCollectionReference(self, collection_id)
+
+    def document(self, document_path: str):
+        return FakeDocumentReference(self, document_path)
+
+    def get_all(self, references, field_paths=None, **_kwargs):
+        self._wait()
+        for reference in references:
+            yield self._snapshot(reference, field_paths)
+
+    def _snapshot(self, reference, field_paths):
+        with self._lock:
+            stored = self._documents.get(reference.path)
+        if stored is None:
+            return FakeDocumentSnapshot(reference, None)
+        data, create_time, update_time = stored
+        return FakeDocumentSnapshot(
+            reference, _pick(data, field_paths), create_time, update_time
+        )
+
+    def _write(self, path: str, fields: dict, merge=False, update=False):
+        from google.cloud import exceptions
+        from google.cloud.firestore import (DELETE_FIELD, SERVER_TIMESTAMP,
+                                            ArrayUnion)
+
+        with self._lock:
+            stored = self._documents.get(path)
+            if stored is None and update:
+                raise exceptions.NotFound(f"No document to update: {path}")
+            now = _now()
+            if stored is None or not (merge or update):
+                data = {}
+            else:
+                data = copy.deepcopy(stored[0])
+            for field_path, value in fields.items():
+                # Only update() reads dotted keys as paths
+                parts = field_path.split(".") if update else [field_path]
+                target = data
+                for part in parts[:-1]:
+                    target = target.setdefault(part, {})
+                if value is DELETE_FIELD:
+                    target.pop(parts[-1], None)
+                elif value is SERVER_TIMESTAMP:
+                    target[parts[-1]] = now
+                elif isinstance(value, ArrayUnion):
+                    values = target.setdefault(parts[-1], [])
+                    values.extend(v for v in value.values if v not in values)
+                elif merge and isinstance(value, dict):
+                    # set(merge=True) merges maps key by key
+                    if not isinstance(target.get(parts[-1]), dict):
+                        target[parts[-1]] = {}
+                    _merge(target[parts[-1]], value)
+                else:
+                    target[parts[-1]] = copy.deepcopy(value)
+            create_time = stored[1] if stored is not None else now
+            self._documents[path] = (data, create_time, now)
+        return _Response(update_time=now)
+
+
+def seed_users(client, count: int) -> None:
+    """Writes `count` user profiles, each with an encrypted GitHub token."""
+    if count <= 0:
+        return
+    if FUNCTIONS_DIR not in sys.path:
+        sys.path.append(FUNCTIONS_DIR)
+    from shared.crypto import EnvelopeCipher
+
+    kms = FakeKmsClient(latency_ms=0)
+    key_path = kms.crypto_key_path(
+        GOOGLE_CLOUD_PROJECT, KMS_LOCATION, KMS_KEY_RING, KMS_KEY_NAME
+    )
+    cipher = EnvelopeCipher()
+    latency, client.latency = client.latency, 0
+    try:
+        for i in range(count):
+            client.collection("users").document(f"user-{i}").set(
+                {
+                    "uid": f"user-{i}",
+                    "email": f"user-{i}@example.com",
+                    "displayName": f"User {i}",
+                    "cookieConsent": "true",
+                    "github_access_token": cipher.encrypt(
+                        kms, key_path, f"gho_local{i:08d}"
+                    ),
+                    "github_connected": True,
+                    "github_id": str(1000 + i),
+                    "github_login": f"user-{i}",
+                    "metadata": {"interests": ["cloud", "python"]},
+                }
+            )
+    finally:
+        client.latency = latency
+
+
+# --- Environment ---
+
+
+def function_env(
+    github_url: str | None = None,
+    agent_url: str | None = None,
+    firestore_latency_ms: float = 0,
+    kms_latency_ms: float = 0,
+    users: int = 0,
+) -> dict[str, str]:
+    """Returns the environment variables pointing the functions at the stand-ins.
+
+    Args:
+        github_url (str | None): URL of a mock GitHub server.
+        agent_url (str | None): URL of a stub agent server.
+        firestore_latency_ms (float): Delay per Firestore call.
+        kms_latency_ms (float): Delay per KMS call.
+        users (int): Number of users seeded in the fake Firestore.
+    """
+    python_path = [BENCHMARKS_DIR, FUNCTIONS_DIR]
+    if os.getenv("PYTHONPATH"):
+        python_path.append(os.environ["PYTHONPATH"])
+    env = {
+        "PYTHONPATH": os.pathsep.join(python_path),
+        "FIRESTORE_CLIENT_FACTORY": "local_backends:FakeFirestoreClient",
+        "KMS_CLIENT_FACTORY": "local_backends:FakeKmsClient",
+        "FAKE_FIRESTORE_LATENCY_MS": str(firestore_latency_ms),
+        "FAKE_FIRESTORE_USERS": str(users),
+        "FAKE_KMS_LATENCY_MS": str(kms_latency_ms),
+        "GOOGLE_CLOUD_PROJECT": GOOGLE_CLOUD_PROJECT,
+        "KMS_LOCATION": KMS_LOCATION,
+        "KMS_KEY_RING": KMS_KEY_RING,
+        "KMS_KEY_NAME": KMS_KEY_NAME,
+        "GITHUB_CLIENT_ID": "local-client-id",
+        "GITHUB_CLIENT_SECRET": "local-client-secret",
+        "API_GATEWAY_BASE_URL": "http://127.0.0.1",
+    }
+    if github_url:
+        env["GITHUB_OAUTH_URL"] = github_url
+        env["GITHUB_API_URL"] = github_url
+    if agent_url:
+        env["CLOUDRUN_AGENT_URL"] = agent_url
+        env["AGENT_ID_TOKEN"] = "local-id-token"
+    return env
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Start the HTTP stand-ins and print the functions' environment."
+    )
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--github-port", type=int, default=8765)
+    parser.add_argument("--agent-port", type=int, default=8766)
+    parser.add_argument("--users", type=int, default=100)
+    args = parser.parse_args(argv)
+
+    from mock_agent import MockAgentServer
+    from mock_github import MockGitHubServer
+
+    with MockGitHubServer(args.github_port, args.latency_ms) as github, MockAgentServer(
+        args.agent_port, args.latency_ms
+    ) as agent:
+        env = function_env(
+            github.url, agent.url, args.latency_ms, args.latency_ms, args.users
+        )
+        for name, value in env.items():
+            print(f"export {name}='{value}'")
+        print("# Stand-ins running, Ctrl+C to stop.", file=sys.stderr)
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
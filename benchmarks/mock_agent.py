@@ -0,0 +1,116 @@
+"""
+Local stand-in for the ADK API server the agent is deployed as.
+
+Serves the session creation called by session-mapper and the /run endpoint
+the frontend calls, after a configurable latency, with a canned answer
+instead of a model's. Meant for benchmarks, never for production.
+
+    python benchmarks/mock_agent.py --port 8766 --latency-ms 200
+"""
+
+import argparse
+import json
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_SESSIONS_PATH = re.compile(r"^/apps/([^/]+)/users/([^/]+)/sessions(?:/([^/]+))?$")
+
+
+class MockAgentHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length)
+        path = self.path.split("?", 1)[0]
+        match = _SESSIONS_PATH.match(path)
+        if match:
+            app_name, user_id, session_id = match.groups()
+            self._reply(200, self._session(app_name, user_id, session_id, body))
+        elif path == "/run":
+            request = json.loads(body or b"{}")
+            self._reply(200, [self._event(request)])
+        else:
+            self._reply(404, {"detail": "Not Found"})
+
+    def _session(self, app_name, user_id, session_id, body):
+        try:
+            state = json.loads(body) if body else {}
+        except ValueError:
+            state = {}
+        return {
+            "id": session_id or uuid.uuid4().hex,
+            "appName": app_name,
+            "userId": user_id,
+            "state": state if isinstance(state, dict) else {},
+            "events": [],
+            "lastUpdateTime": time.time(),
+        }
+
+    def _event(self, request):
+        return {
+            "id": uuid.uuid4().hex,
+            "invocationId": f"e-{uuid.uuid4().hex}",
+            "author": request.get("appName", "coordinator"),
+            "content": {"role": "model", "parts": [{"text": "Stub answer."}]},
+            "timestamp": time.time(),
+        }
+
+    def _reply(self, status: int, payload):
+        time.sleep(self.server.latency_seconds)
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Keep benchmark output readable
+
+
+class MockAgentServer(ThreadingHTTPServer):
+    """A threaded stub agent server, usable as a context manager.
+
+    Args:
+        port (int): Port to listen on, 0 picks a free one.
+        latency_ms (float): Delay added to every response.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, port: int = 0, latency_ms: float = 0):
+        super().__init__(("127.0.0.1", port), MockAgentHandler)
+        self.latency_seconds = latency_ms / 1000
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+        self.server_close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Stub agent server.")
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    args = parser.parse_args()
+    server = MockAgentServer(args.port, args.latency_ms)
+    print(f"Stub agent listening on {server.url}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""
+Local stand-in for the GitHub endpoints the functions call.
+
+Serves the OAuth token exchange, the REST `/user` endpoint and the user data
+read by the agent (repositories, starred repositories, events) over plain
+HTTP with keep-alive, after a configurable latency, optionally failing a
+share of the calls with a 502. The user data carries an ETag and conditional
+requests get a 304, like on GitHub. Meant for benchmarks, never for
+production.
+
+    python benchmarks/mock_github.py --port 8765 --latency-ms 40
+"""
+
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class MockGitHubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Keep-alive, like api.github.com
+    disable_nagle_algorithm = True  # Headers and body are written separately
+
+    def do_GET(self):
+        path = self.path.split("?", 1)[0]
+        token = self.headers.get("Authorization", "").rpartition(" ")[2]
+        if path == "/user":
+            self._reply(200, {"login": f"user-{token[-6:]}", "id": abs(hash(token))})
+        elif path in ("/user/repos", "/user/starred"):
+            self._reply_data([_repo(f"user-{token[-6:]}", i) for i in range(30)])
+        elif path.startswith("/users/") and path.endswith("/events"):
+            login = path.split("/")[2]
+            self._reply_data([_event(login, i) for i in range(30)])
+        else:
+            self._reply(404, {"message": "Not Found"})
+
+    def _reply_data(self, payload: list):
+        """Replies with an ETag, or a 304 when the client already has the data."""
+        body = json.dumps(payload).encode("utf-8")
+        etag = f'"{hashlib.sha1(body).hexdigest()}"'
+        if self.headers.get("If-None-Match") == etag:
+            self._reply(304, None, {"ETag": etag})
+        else:
+            self._reply(200, payload, {"ETag": etag})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        self.rfile.read(length)
+        if self.path.split("?", 1)[0] == "/login/oauth/access_token":
+            self._reply(200, {"access_token": f"gho_{random.getrandbits(64):016x}"})
+        else:
+            self._reply(404, {"message": "Not Found"})
+
+    def _reply(self, status: int, payload, headers: dict | None = None):
+        time.sleep(self.server.latency_seconds)
+        if random.random() < self.server.error_rate:
+            status, payload, headers = 502, {"message": "Server Error"}, None
+        body = b"" if payload is None else json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("X-RateLimit-Limit", "5000")
+        self.send_header("X-RateLimit-Remaining", "4999")
+        self.send_header("X-RateLimit-Reset", str(int(time.time()) + 3600))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Keep benchmark output readable
+
+
+def _repo(owner: str, i: int) -> dict:
+    return {
+        "full_name": f"{owner}/project-{i}",
+        "description": f"Project {i}",
+        "language": "Python",
+        "stargazers_count": i,
+        "private": False,
+        "updated_at": "2025-01-01T00:00:00Z",
+        "html_url": f"https://github.com/{owner}/project-{i}",
+    }
+
+
+def _event(login: str, i: int) -> dict:
+    return {
+        "type": "PushEvent",
+        "repo": {"name": f"{login}/project-{i % 5}"},
+        "created_at": "2025-01-01T00:00:00Z",
+        "payload": {"ref": "refs/heads/main", "size": 1},
+    }
+
+
+class MockGitHubServer(ThreadingHTTPServer):
+    """A threaded mock GitHub server, usable as a context manager.
+
+    Args:
+        port (int): Port to listen on, 0 picks a free one.
+        latency_ms (float): Delay added to every response.
+        error_rate (float): Share of the responses replaced by a 502.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, port: int = 0, latency_ms: float = 0, error_rate: float = 0):
+        super().__init__(("127.0.0.1", port), MockGitHubHandler)
+        self.latency_seconds = latency_ms / 1000
+        self.error_rate = error_rate
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+        self.server_close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Mock GitHub server.")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--error-rate", type=float, default=0)
+    args = parser.parse_args()
+    server = MockGitHubServer(args.port, args.latency_ms, args.error_rate)
+    print(f"Mock GitHub listening on {server.url}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
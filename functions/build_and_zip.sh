@@ -2,6 +2,7 @@
 
 # --- Configuration ---
 temp_dir="/tmp/reomir_functions_pkg" # Changed to be more specific
+shared_dir="shared" # Helpers shared by every function, bundled next to main.py
 bucket_name="reomir-function-bucket" # Define your bucket name here
 gcp_region="europe-west1"
 gcp_runtime="python313" # Or your preferred python version like python313
@@ -15,6 +16,7 @@ usage() {
     echo "Actions:"
     echo "  init                      Zips each subdirectory in the current location and uploads it to GCS."
     echo "  deploy <dirname>          Deploys the specified subdirectory as a Google Cloud Function."
+    echo "                            The 'shared' directory is bundled with every function."
     echo "                            The script will cd into <dirname> before deploying."
     echo "  help                      Shows this help message."
     echo ""
@@ -45,6 +47,11 @@ perform_init() {
             local dir_name
             dir_name=$(basename "$dir_path_no_slash")
 
+            # The shared helpers are not a function on their own
+            if [ "$dir_name" = "$shared_dir" ]; then
+                continue
+            fi
+
             # Construct the zip file name using the directory name
             local zip_file="$temp_dir/reomir-${dir_name}.zip"
 
@@ -62,7 +69,7 @@ perform_init() {
                 # as it flattens the directory structure within the zip.
                 # If you need a flat structure, add -j back: zip -r -j -q "$zip_file" .
                 zip -r -q "$zip_file" . -x ".git/*" -x "*.DS_Store" -x "__pycache__/*"
-            )
+            ) && zip -r -q "$zip_file" "$shared_dir" -x "*/__pycache__/*" # Bundle the shared helpers
 
             # Check if zip was successful
             if [ $? -eq 0 ]; then
@@ -117,6 +124,11 @@ perform_deploy() {
 
     echo "🚀 Deploying function '$function_name' from directory '$dir_to_deploy'..."
 
+    # Vendor the shared helpers into the function source for the upload
+    rm -rf "$dir_to_deploy/$shared_dir"
+    cp -r "$shared_dir" "$dir_to_deploy/$shared_dir"
+    trap 'rm -rf "$dir_to_deploy/$shared_dir"' EXIT
+
     # Navigate into the directory to deploy from
     (
         cd "$dir_to_deploy" || { echo "❌ ERROR: Could not cd into $dir_to_deploy."; exit 1; }
@@ -0,0 +1,254 @@
+"""
+HTTP client for the GitHub OAuth and REST APIs.
+
+One client is shared by every request an instance serves, so calls to GitHub
+reuse keep-alive connections from a bounded pool instead of paying a TCP and
+TLS handshake each time. Every call has explicit connect and read timeouts: a
+slow GitHub fails the request instead of holding the worker until the
+function's own timeout.
+
+Failed calls are retried with exponential backoff and full jitter when it is
+safe to: on connection errors and 5xx responses for idempotent methods, and
+on rate-limited responses (secondary rate limits, 429) for any method, since
+GitHub rejected them without processing them. The client follows the
+X-RateLimit-* headers: once the primary rate limit is exhausted, it waits for
+the reset when it is near, or fails fast when it isn't.
+"""
+
+import hashlib
+import logging
+import os
+import random
+import time
+from dataclasses import dataclass
+from typing import Callable
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from shared.cache import TTLCache
+from shared.tracing import traced
+
+GITHUB_CONNECT_TIMEOUT = float(os.getenv("GITHUB_CONNECT_TIMEOUT", "3.05"))
+GITHUB_READ_TIMEOUT = float(os.getenv("GITHUB_READ_TIMEOUT", "10"))
+GITHUB_MAX_RETRIES = int(os.getenv("GITHUB_MAX_RETRIES", "2"))
+GITHUB_POOL_SIZE = int(os.getenv("GITHUB_POOL_SIZE", "10"))
+# Longest wait accepted before a retry or for a rate limit reset, in seconds.
+GITHUB_MAX_RETRY_WAIT = float(os.getenv("GITHUB_MAX_RETRY_WAIT", "5"))
+# Rate limits are per token, the last one reported is kept for this many tokens.
+GITHUB_RATE_LIMIT_CACHE_SIZE = int(os.getenv("GITHUB_RATE_LIMIT_CACHE_SIZE", "1024"))
+
+_IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "OPTIONS", "PUT", "DELETE"})
+_RETRYABLE_STATUSES = frozenset({500, 502, 503, 504})
+_BACKOFF_BASE_SECONDS = 0.25
+_SECONDARY_RATE_LIMIT_WAIT = 60.0
+
+
+class GitHubRateLimitError(requests.exceptions.RequestException):
+    """Raised instead of calling GitHub while the rate limit is exhausted.
+
+    Attributes:
+        reset_at (float): Epoch time at which the rate limit resets.
+    """
+
+    def __init__(self, reset_at: float):
+        super().__init__(f"GitHub rate limit exhausted until {reset_at:.0f}.")
+        self.reset_at = reset_at
+
+
+@dataclass(frozen=True)
+class RateLimit:
+    """Last rate limit reported by GitHub through the X-RateLimit-* headers."""
+
+    limit: int
+    remaining: int
+    reset_at: float
+
+
+class GitHubClient:
+    """Pooled, retrying session for calls to GitHub.
+
+    Args:
+        connect_timeout (float): Seconds allowed to open a connection.
+        read_timeout (float): Seconds allowed between two bytes of a response.
+        max_retries (int): Retries after the first attempt.
+        pool_size (int): Connections kept alive per host.
+        max_retry_wait (float): Longest wait accepted before a retry, beyond
+            which the last response or error is returned as is.
+        sleep (Callable): Used to wait between attempts, injectable for tests.
+    """
+
+    def __init__(
+        self,
+        connect_timeout: float = GITHUB_CONNECT_TIMEOUT,
+        read_timeout: float = GITHUB_READ_TIMEOUT,
+        max_retries: int = GITHUB_MAX_RETRIES,
+        pool_size: int = GITHUB_POOL_SIZE,
+        max_retry_wait: float = GITHUB_MAX_RETRY_WAIT,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.max_retry_wait = max_retry_wait
+        self._sleep = sleep
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        # Primary rate limits last an hour at most
+        self._rate_limits = TTLCache(maxsize=GITHUB_RATE_LIMIT_CACHE_SIZE, ttl=3600)
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request("POST", url, **kwargs)
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        """Sends a request, retrying it when it is safe to.
+
+        Returns:
+            requests.Response: The last response, whatever its status.
+
+        Raises:
+            GitHubRateLimitError: If the rate limit is exhausted for too long.
+            requests.exceptions.RequestException: If the last attempt failed.
+        """
+        method = method.upper()
+        attributes = {
+            "http.request.method": method,
+            "url.full": url.split("?", 1)[0],  # The query may carry secrets
+        }
+        with traced(method, attributes) as span:
+            response = self._request(method, url, span, **kwargs)
+            span.set_attribute("http.response.status_code", response.status_code)
+            return response
+
+    def _request(self, method: str, url: str, span, **kwargs) -> requests.Response:
+        kwargs.setdefault("timeout", self.timeout)
+        rate_limit_key = _rate_limit_key(kwargs.get("headers"))
+        self._wait_for_rate_limit(rate_limit_key)
+        idempotent = method in _IDEMPOTENT_METHODS
+
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                span.set_attribute("http.request.resend_count", attempt)
+            last_attempt = attempt == self.max_retries
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (
+                requests.exceptions.ConnectionError,
+                requests.exceptions.Timeout,
+            ) as e:
+                # A connect timeout means the request was never sent
+                safe = idempotent or isinstance(e, requests.exceptions.ConnectTimeout)
+                if last_attempt or not safe:
+                    raise
+                delay = self._backoff(attempt)
+                logging.warning(
+                    "GitHub %s %s failed, retrying in %.2fs.", method, url, delay
+                )
+                self._sleep(delay)
+                continue
+
+            self._record_rate_limit(rate_limit_key, response)
+            delay = self._retry_delay(response, attempt, idempotent)
+            if delay is None or last_attempt:
+                return response
+            logging.warning(
+                "GitHub %s %s answered %s, retrying in %.2fs.",
+                method,
+                url,
+                response.status_code,
+                delay,
+            )
+            response.close()
+            self._sleep(delay)
+        return response  # Not reached, the last attempt always returns
+
+    def _backoff(self, attempt: int) -> float:
+        """Full jitter: a random wait below an exponentially growing cap."""
+        cap = min(self.max_retry_wait, _BACKOFF_BASE_SECONDS * 2**attempt)
+        return random.uniform(0, cap)
+
+    def _retry_delay(
+        self, response: requests.Response, attempt: int, idempotent: bool
+    ) -> float | None:
+        """Returns how long to wait before retrying, None to not retry."""
+        if _is_rate_limited(response):
+            retry_after = response.headers.get("Retry-After")
+            if retry_after is not None:
+                try:
+                    delay = float(retry_after)
+                except ValueError:
+                    delay = self._backoff(attempt)
+            elif response.headers.get("X-RateLimit-Remaining") == "0":
+                delay = _reset_time(response) - time.time()
+            else:
+                # Secondary rate limit without a hint, GitHub asks for a minute
+                delay = _SECONDARY_RATE_LIMIT_WAIT
+            delay = max(delay, 0.0)
+            return delay if delay <= self.max_retry_wait else None
+        if idempotent and response.status_code in _RETRYABLE_STATUSES:
+            return self._backoff(attempt)
+        return None
+
+    def rate_limit(self, headers: dict | None = None) -> RateLimit | None:
+        """Returns the last rate limit seen for the credentials in headers."""
+        return self._rate_limits.get(_rate_limit_key(headers))
+
+    def _record_rate_limit(self, key: str, response: requests.Response) -> None:
+        headers = response.headers
+        if "X-RateLimit-Remaining" not in headers:
+            return
+        try:
+            rate_limit = RateLimit(
+                limit=int(headers.get("X-RateLimit-Limit", 0)),
+                remaining=int(headers["X-RateLimit-Remaining"]),
+                reset_at=float(headers.get("X-RateLimit-Reset", 0)),
+            )
+        except ValueError:
+            return
+        self._rate_limits.set(key, rate_limit)
+        if rate_limit.remaining == 0:
+            logging.warning(
+                "GitHub rate limit exhausted until %s.", int(rate_limit.reset_at)
+            )
+
+    def _wait_for_rate_limit(self, key: str) -> None:
+        """Waits for a near reset of an exhausted rate limit, or fails fast."""
+        rate_limit = self._rate_limits.get(key)
+        if rate_limit is None or rate_limit.remaining > 0:
+            return
+        wait = rate_limit.reset_at - time.time()
+        if wait <= 0:
+            return
+        if wait > self.max_retry_wait:
+            raise GitHubRateLimitError(rate_limit.reset_at)
+        self._sleep(wait)
+
+
+def _rate_limit_key(headers: dict | None) -> str:
+    """Identifies the credentials of a request without keeping them around."""
+    authorization = (headers or {}).get("Authorization", "")
+    return hashlib.sha256(authorization.encode("utf-8")).hexdigest()
+
+
+def _is_rate_limited(response: requests.Response) -> bool:
+    """Tells whether GitHub rejected a request because of a rate limit."""
+    if response.status_code == 429:
+        return True
+    if response.status_code != 403:
+        return False
+    return (
+        "Retry-After" in response.headers
+        or response.headers.get("X-RateLimit-Remaining") == "0"
+        or "rate limit" in response.text.lower()
+    )
+
+
+def _reset_time(response: requests.Response) -> float:
+    try:
+        return float(response.headers.get("X-RateLimit-Reset", 0))
+    except ValueError:
+        return 0.0
@@ -1,12 +1,25 @@
-import base64
-import json
+import contextvars
 import logging
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 import functions_framework
 import requests
 from flask import Flask, Response, jsonify, redirect, request
-from google.cloud import firestore, kms
+from github_client import GitHubClient
+from google.cloud import firestore
+
+from shared import auth
+from shared.cache import TTLCache
+from shared.clients import firestore_client, kms_client
+from shared.cors import CorsPolicy
+from shared.crypto import EnvelopeCipher
+from shared.logs import setup_logging
+from shared.tracing import setup_tracing
+from shared.users_repository import (delete_github_cache, get_github_status,
+                                     get_update_time, get_user_snapshot,
+                                     traced_firestore, user_document)
 
 # Initialize Flask app
 app = Flask(__name__)
@@ -21,10 +34,15 @@ KMS_KEY_RING = os.getenv("KMS_KEY_RING")
 KMS_LOCATION = os.getenv("KMS_LOCATION")
 GOOGLE_CLOUD_PROJECT = os.getenv("GOOGLE_CLOUD_PROJECT")
 
+# Tokens are envelope-encrypted, KMS is only called to wrap new data keys.
+TOKEN_CIPHER = EnvelopeCipher()
+
 # --- Constants ---
 ALLOWED_ORIGINS = os.getenv("CORS_ALLOWED_ORIGINS", "*")
-X_APIGATEWAY_USERINFO_HEADER = "X-Apigateway-Api-Userinfo"
-USER_ID_CLAIM = "sub"  # Standard claim for user ID in OIDC tokens
+CORS = CorsPolicy(
+    allow_origin=ALLOWED_ORIGINS,
+    allow_headers="Content-Type, Authorization, X-Apigateway-Api-Userinfo",
+)
 
 GITHUB_CLIENT_ID = os.getenv("GITHUB_CLIENT_ID")
 GITHUB_CLIENT_SECRET = os.getenv("GITHUB_CLIENT_SECRET")
@@ -33,28 +51,95 @@ API_GATEWAY_BASE_URL = os.getenv(
     "API_GATEWAY_BASE_URL"
 )  # e.g., https://your-gateway-id.uc.gateway.dev
 
-GITHUB_AUTH_URL = "https://github.com/login/oauth/authorize"
-GITHUB_TOKEN_URL = "https://github.com/login/oauth/access_token"
-GITHUB_USER_API = "https://api.github.com/user"
-
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+# Overridable to point the function at a local mock GitHub.
+GITHUB_OAUTH_URL = os.getenv("GITHUB_OAUTH_URL", "https://github.com").rstrip("/")
+GITHUB_API_URL = os.getenv("GITHUB_API_URL", "https://api.github.com").rstrip("/")
+GITHUB_AUTH_URL = f"{GITHUB_OAUTH_URL}/login/oauth/authorize"
+GITHUB_TOKEN_URL = f"{GITHUB_OAUTH_URL}/login/oauth/access_token"
+GITHUB_USER_API = f"{GITHUB_API_URL}/user"
+
+# Keep-alive connections, timeouts and retries for every call to GitHub.
+GITHUB_HTTP = GitHubClient()
+
+# The frontend polls the status route: results are cached per user for the
+# TTL, then revalidated against the document's update time (a read without
+# fields), each success serving them for another TTL. They are read again in
+# full GITHUB_STATUS_REVALIDATE_SECONDS after the TTL of the full read, however
+# often they were revalidated.
+# The callback and disconnect routes drop the entry of the user they change.
+GITHUB_STATUS_CACHE_TTL_SECONDS = float(
+    os.getenv("GITHUB_STATUS_CACHE_TTL_SECONDS", "30")
+)
+GITHUB_STATUS_REVALIDATE_SECONDS = float(
+    os.getenv("GITHUB_STATUS_REVALIDATE_SECONDS", "600")
+)
+GITHUB_STATUS_CACHE_SIZE = int(os.getenv("GITHUB_STATUS_CACHE_SIZE", "1024"))
+_github_status_cache = TTLCache(
+    maxsize=GITHUB_STATUS_CACHE_SIZE,
+    ttl=GITHUB_STATUS_CACHE_TTL_SECONDS + GITHUB_STATUS_REVALIDATE_SECONDS,
+)
+
+# Runs the token encryption of OAuth callbacks next to the GitHub profile fetch.
+CALLBACK_WORKERS = int(os.getenv("CALLBACK_WORKERS", "4"))
+_CALLBACK_EXECUTOR = ThreadPoolExecutor(
+    max_workers=CALLBACK_WORKERS, thread_name_prefix="github-callback"
+)
+
+# The frontend polls the status route, keep a tenth of its routine records
+setup_logging(app, sample_rates={"/api/v1/github/status": 0.1})
+setup_tracing(app, "github-integration")
 
 
 # --- Client Initialization ---
 def _initialize_clients_if_needed():
     global db, KMS_CLIENT
     if db is None:
-        db = firestore.Client()
+        db = firestore_client()
         logging.info("Firestore client initialized.")
     if KMS_CLIENT is None:
-        KMS_CLIENT = kms.KeyManagementServiceClient()
+        KMS_CLIENT = kms_client()
         logging.info("KMS client initialized.")
 
 
 # --- Helper Functions ---
+def _get_cached_github_status(user_id: str) -> dict | None:
+    """Returns a user's GitHub status fields, from the cache when still valid."""
+    now = time.monotonic()
+    entry = _github_status_cache.get(user_id)
+    if entry is not None:
+        status, update_time, checked_at, read_at = entry
+        if now - checked_at < GITHUB_STATUS_CACHE_TTL_SECONDS:
+            return status
+        if (
+            now - read_at
+            < GITHUB_STATUS_CACHE_TTL_SECONDS + GITHUB_STATUS_REVALIDATE_SECONDS
+            and update_time is not None
+            and get_update_time(db, user_id) == update_time
+        ):
+            # Keeps the time of the full read, which bounds the revalidations
+            _github_status_cache.set(user_id, (status, update_time, now, read_at))
+            return status
+    status, update_time = get_github_status(db, user_id)
+    _github_status_cache.set(user_id, (status, update_time, now, now))
+    return status
+
+
+def _fetch_github_user(access_token: str) -> dict:
+    """Fetches the profile of the GitHub user owning access_token.
+
+    Raises:
+        requests.exceptions.RequestException: If the request fails.
+    """
+    logging.debug("Fetching user info from %s", GITHUB_USER_API)
+    user_info_response = GITHUB_HTTP.get(
+        GITHUB_USER_API, headers={"Authorization": f"token {access_token}"}
+    )
+    user_info_response.raise_for_status()
+    return user_info_response.json()
+
+
 def _encrypt_data_kms(plaintext: str) -> str | None:
-    """Encrypts plaintext using KMS and returns base64 encoded ciphertext."""
+    """Encrypts plaintext with a KMS-wrapped data key and returns the stored form."""
     if not all([GOOGLE_CLOUD_PROJECT, KMS_LOCATION, KMS_KEY_RING, KMS_KEY_NAME]):
         logging.error(
             "KMS environment variables (GOOGLE_CLOUD_PROJECT, KMS_LOCATION, KMS_KEY_RING, KMS_KEY_NAME) not fully set. Cannot encrypt."
@@ -64,15 +149,12 @@ def _encrypt_data_kms(plaintext: str) -> str | None:
         key_path = KMS_CLIENT.crypto_key_path(
             GOOGLE_CLOUD_PROJECT, KMS_LOCATION, KMS_KEY_RING, KMS_KEY_NAME
         )
-        logging.info(f"Encrypting data with KMS key: {key_path}")
-        response = KMS_CLIENT.encrypt(
-            name=key_path, plaintext=plaintext.encode("utf-8")
-        )
-        ciphertext = base64.b64encode(response.ciphertext).decode("utf-8")
-        logging.info("Data successfully encrypted with KMS.")
+        logging.debug("Encrypting data with KMS key: %s", key_path)
+        ciphertext = TOKEN_CIPHER.encrypt(KMS_CLIENT, key_path, plaintext)
+        logging.debug("Data successfully encrypted.")
         return ciphertext
     except Exception as e:
-        logging.error(f"KMS encryption failed: {e}")
+        logging.error("KMS encryption failed: %s", e)
         return None
 
 
@@ -81,25 +163,19 @@ def _get_auth_user_info(req):
     Retrieves user information from the 'X-Apigateway-Api-Userinfo' header
     set by API Gateway after successful Firebase authentication.
     """
-    userinfo_header = req.headers.get(X_APIGATEWAY_USERINFO_HEADER)
-    if not userinfo_header:
+    try:
+        claims = auth.get_user_claims(req.headers)
+    except auth.MissingUserInfoError:
         logging.warning("X-Apigateway-Api-Userinfo header missing.")
         return None
-    try:
-        # The header is base64 encoded, decode it
-        auth_info_header_padded = userinfo_header + "=" * (-len(userinfo_header) % 4)
-        userinfo_json = base64.b64decode(auth_info_header_padded).decode("utf-8")
-        userinfo = json.loads(userinfo_json)
-        # Extract user_id (subject claim)
-        user_id = userinfo.get(USER_ID_CLAIM)
-        if not user_id:
-            logging.warning(f"'{USER_ID_CLAIM}' not found in userinfo: {userinfo}")
-            return None
-        logging.info(f"Authenticated user_id: {user_id}")
-        return {"user_id": user_id, "full_claims": userinfo}
-    except Exception as e:
-        logging.error(f"Error decoding userinfo header: {e}")
+    except auth.MissingUserIdClaimError:
+        logging.warning("'%s' not found in userinfo.", auth.USER_ID_CLAIM)
+        return None
+    except auth.AuthError as e:
+        logging.error("Error decoding userinfo header: %s", e.__cause__ or e)
         return None
+    logging.debug("Authenticated user_id: %s", claims.user_id)
+    return {"user_id": claims.user_id, "full_claims": claims.claims}
 
 
 def _create_autoclose_html_response(message: str, status: str) -> Response:
@@ -149,13 +225,7 @@ def add_cors_headers(response):
     Adds CORS headers to every response using the @after_request decorator.
     This function is automatically executed by Flask after each request.
     """
-    response.headers["Access-Control-Allow-Origin"] = ALLOWED_ORIGINS
-    response.headers["Access-Control-Allow-Methods"] = "GET, POST, PUT, DELETE, OPTIONS"
-    response.headers["Access-Control-Allow-Headers"] = (
-        "Content-Type, Authorization, X-Apigateway-Api-Userinfo"
-    )
-    response.headers["Access-Control-Max-Age"] = "3600"
-    return response
+    return CORS.apply(response)
 
 
 # --- Route Implementations ---
@@ -163,9 +233,9 @@ def add_cors_headers(response):
 
 @app.route("/api/v1/github/connect", methods=["GET", "OPTIONS"])
 def handle_connect_route():
-    _initialize_clients_if_needed()
     if request.method == "OPTIONS":
         return "", 204  # Preflight request handled by @after_request
+    _initialize_clients_if_needed()
 
     auth_info = _get_auth_user_info(request)
     if not auth_info or not auth_info.get("user_id"):
@@ -193,18 +263,16 @@ def handle_connect_route():
         f"{GITHUB_AUTH_URL}?{'&'.join([f'{k}={v}' for k, v in auth_params.items()])}"
     )
 
-    logging.info(
-        f"Redirecting user {user_id} to GitHub for authorization: {github_auth_target_url}"
-    )
+    logging.info("Redirecting user %s to GitHub for authorization.", user_id)
     # The @after_request decorator will add CORS headers to this redirect response
     return jsonify({"redirectUrl": github_auth_target_url})
 
 
 @app.route("/api/v1/github/callback", methods=["GET", "OPTIONS"])
 def handle_callback_route():
-    _initialize_clients_if_needed()
     if request.method == "OPTIONS":
         return "", 204
+    _initialize_clients_if_needed()
 
     code = request.args.get("code")
     state = request.args.get("state")  # This is the user_id
@@ -216,7 +284,7 @@ def handle_callback_route():
         )
 
     user_id = state
-    logging.info(f"Handling GitHub callback for user_id (from state): {user_id}")
+    logging.info("Handling GitHub callback for user_id (from state): %s", user_id)
 
     if not GITHUB_CLIENT_ID or not GITHUB_CLIENT_SECRET or not API_GATEWAY_BASE_URL:
         logging.error(
@@ -237,8 +305,8 @@ def handle_callback_route():
             "redirect_uri": callback_url,
         }
         headers = {"Accept": "application/json"}
-        logging.info(f"Exchanging code for token at {GITHUB_TOKEN_URL}")
-        token_response = requests.post(
+        logging.debug("Exchanging code for token at %s", GITHUB_TOKEN_URL)
+        token_response = GITHUB_HTTP.post(
             GITHUB_TOKEN_URL, data=token_payload, headers=headers
         )
         token_response.raise_for_status()
@@ -246,35 +314,46 @@ def handle_callback_route():
         access_token = token_data.get("access_token")
 
         if not access_token:
-            logging.error(f"Access token not in GitHub response: {token_data}")
+            # Only the error fields: the payload may hold credentials
+            logging.error(
+                "Access token not in GitHub response: %s (%s)",
+                token_data.get("error"),
+                token_data.get("error_description"),
+            )
             return _create_autoclose_html_response(
                 "Authentication failed: Could not retrieve access token.",
                 status="error",
             )
 
-        # Encrypt the access token
-        encrypted_access_token = _encrypt_data_kms(access_token)
+        # Encrypting the token (KMS) and fetching the profile (GitHub) are
+        # independent: the encryption runs in the background meanwhile.
+        encryption = _CALLBACK_EXECUTOR.submit(
+            contextvars.copy_context().run, _encrypt_data_kms, access_token
+        )
+        try:
+            github_user_data = _fetch_github_user(access_token)
+            fetch_error = None
+        except Exception as e:  # Reported once the encryption is known to be fine
+            github_user_data, fetch_error = None, e
+
+        encrypted_access_token = encryption.result()
         if not encrypted_access_token:
             logging.error("Failed to encrypt GitHub access token.")
             return _create_autoclose_html_response(
                 "Authentication failed: A security error occurred during processing.",
                 status="error",
             )
-        logging.info("GitHub access token successfully encrypted.")
-
-        # Get user info from GitHub
-        user_api_headers = {"Authorization": f"token {access_token}"}
-        logging.info(f"Fetching user info from {GITHUB_USER_API}")
-        user_info_response = requests.get(GITHUB_USER_API, headers=user_api_headers)
-        user_info_response.raise_for_status()
-        github_user_data = user_info_response.json()
+        logging.debug("GitHub access token successfully encrypted.")
+        if fetch_error is not None:
+            raise fetch_error
 
         github_login = github_user_data.get("login")
         github_id = github_user_data.get("id")
 
         if not github_login or not github_id:
             logging.error(
-                f"GitHub username or ID not in API response: {github_user_data}"
+                "GitHub username or ID not in API response (fields: %s)",
+                sorted(github_user_data),
             )
             return _create_autoclose_html_response(
                 "Authentication failed: Could not retrieve user profile from GitHub.",
@@ -282,7 +361,7 @@ def handle_callback_route():
             )
 
         # Store token and GitHub info in Firestore
-        user_ref = db.collection("users").document(user_id)
+        user_ref = user_document(db, user_id)
         user_data_to_store = {
             "github_access_token": encrypted_access_token,  # Store encrypted token
             "github_login": github_login,
@@ -290,13 +369,18 @@ def handle_callback_route():
             "github_connected": True,
             "github_last_updated": firestore.SERVER_TIMESTAMP,
         }
-        logging.info(
-            f"Updating Firestore for user {user_id} with GitHub data (token encrypted)."
+        logging.debug(
+            "Updating Firestore for user %s with GitHub data (token encrypted).",
+            user_id,
         )
-        user_ref.set(user_data_to_store, merge=True)
+        with traced_firestore("set"):
+            user_ref.set(user_data_to_store, merge=True)
+        _github_status_cache.pop(user_id)
 
         logging.info(
-            f"Successfully connected GitHub for user {user_id}, username {github_login}. Token stored with encryption."
+            "Successfully connected GitHub for user %s, username %s. Token stored with encryption.",
+            user_id,
+            github_login,
         )
 
         return _create_autoclose_html_response(
@@ -304,14 +388,14 @@ def handle_callback_route():
         )
 
     except requests.exceptions.RequestException as e:
-        logging.error(f"RequestException during GitHub OAuth: {e}")
+        logging.error("RequestException during GitHub OAuth: %s", e)
         if e.response is not None:
-            logging.error(f"GitHub error response: {e.response.text}")
+            logging.error("GitHub error response status: %s", e.response.status_code)
         return _create_autoclose_html_response(
             "Authentication failed due to a communication error.", status="error"
         )
     except Exception as e:
-        logging.error(f"Unexpected error during GitHub callback: {e}")
+        logging.error("Unexpected error during GitHub callback: %s", e)
         return _create_autoclose_html_response(
             "Authentication failed due to an internal error.", status="error"
         )
@@ -319,9 +403,9 @@ def handle_callback_route():
 
 @app.route("/api/v1/github/status", methods=["GET", "OPTIONS"])
 def handle_status_route():
-    _initialize_clients_if_needed()
     if request.method == "OPTIONS":
         return "", 204
+    _initialize_clients_if_needed()
 
     auth_info = _get_auth_user_info(request)
     if not auth_info or not auth_info.get("user_id"):
@@ -329,28 +413,29 @@ def handle_status_route():
     user_id = auth_info["user_id"]
 
     try:
-        user_ref = db.collection("users").document(user_id)
-        user_doc = user_ref.get()
+        github_status = _get_cached_github_status(user_id)
 
-        if user_doc.exists and user_doc.get("github_connected"):
+        if github_status and github_status.get("github_connected"):
             logging.info(
-                f"GitHub status for user {user_id}: connected as {user_doc.get('github_login')}"
+                "GitHub status for user %s: connected as %s",
+                user_id,
+                github_status.get("github_login"),
             )
             return (
                 jsonify(
                     {
                         "connected": True,
-                        "username": user_doc.get("github_login"),
-                        "github_id": user_doc.get("github_id"),
+                        "username": github_status.get("github_login"),
+                        "github_id": github_status.get("github_id"),
                     }
                 ),
                 200,
             )
         else:
-            logging.info(f"GitHub status for user {user_id}: not connected.")
+            logging.info("GitHub status for user %s: not connected.", user_id)
             return jsonify({"connected": False}), 200
     except Exception as e:
-        logging.error(f"Error fetching GitHub status for user {user_id}: {e}")
+        logging.error("Error fetching GitHub status for user %s: %s", user_id, e)
         return jsonify({"error": "Failed to retrieve status."}), 500
 
 
@@ -358,9 +443,9 @@ def handle_status_route():
     "/api/v1/github/disconnect", methods=["POST", "DELETE", "OPTIONS"]
 )  # Added POST
 def handle_disconnect_route():
-    _initialize_clients_if_needed()
     if request.method == "OPTIONS":
         return "", 204
+    _initialize_clients_if_needed()
 
     auth_info = _get_auth_user_info(request)
     if not auth_info or not auth_info.get("user_id"):
@@ -368,10 +453,10 @@ def handle_disconnect_route():
     user_id = auth_info["user_id"]
 
     try:
-        user_ref = db.collection("users").document(user_id)
-        user_doc = user_ref.get()
+        user_ref = user_document(db, user_id)
+        user_doc = get_user_snapshot(db, user_id, ["github_connected"])
 
-        if user_doc.exists and user_doc.get("github_connected"):
+        if user_doc.exists and (user_doc.to_dict() or {}).get("github_connected"):
             updates = {
                 "github_access_token": firestore.DELETE_FIELD,
                 "github_login": firestore.DELETE_FIELD,
@@ -379,12 +464,16 @@ def handle_disconnect_route():
                 "github_connected": False,
                 "github_last_updated": firestore.SERVER_TIMESTAMP,
             }
-            user_ref.update(updates)
-            logging.info(f"Successfully disconnected GitHub for user {user_id}.")
+            with traced_firestore("update"):
+                user_ref.update(updates)
+            # The private repositories and events the agent cached go too
+            delete_github_cache(db, user_id)
+            _github_status_cache.pop(user_id)
+            logging.info("Successfully disconnected GitHub for user %s.", user_id)
             return jsonify({"message": "GitHub disconnected successfully."}), 200
         else:
             logging.info(
-                f"No active GitHub connection found for user {user_id} to disconnect."
+                "No active GitHub connection found for user %s to disconnect.", user_id
             )
             return (
                 jsonify({"message": "No active GitHub connection to disconnect."}),
@@ -392,7 +481,7 @@ def handle_disconnect_route():
             )
 
     except Exception as e:
-        logging.error(f"Error disconnecting GitHub for user {user_id}: {e}")
+        logging.error("Error disconnecting GitHub for user %s: %s", user_id, e)
         return jsonify({"error": "Failed to disconnect GitHub."}), 500
 
 
@@ -403,6 +492,9 @@ def handler(req):
     Routes incoming requests to the appropriate Flask handler based on the path.
     This function is the entry point for the Google Cloud Function.
     """
+    # Preflights are answered without a Flask request context or any client.
+    if req.method == "OPTIONS":
+        return CORS.preflight_response()
     # Ensure clients are available for the app context,
     # though individual routes also call it for safety.
     _initialize_clients_if_needed()
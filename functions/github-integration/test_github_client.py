@@ -0,0 +1,113 @@
+import time
+
+import pytest
+import requests
+from github_client import GitHubClient, GitHubRateLimitError
+
+API_URL = "https://api.github.com/user"
+TOKEN_URL = "https://github.com/login/oauth/access_token"
+
+
+@pytest.fixture
+def sleeps():
+    return []
+
+
+@pytest.fixture
+def github(sleeps):
+    return GitHubClient(max_retries=2, max_retry_wait=5, sleep=sleeps.append)
+
+
+def test_get_retries_server_errors_with_backoff(github, sleeps, requests_mock):
+    requests_mock.get(
+        API_URL,
+        [{"status_code": 502}, {"status_code": 503}, {"json": {"login": "octocat"}}],
+    )
+
+    response = github.get(API_URL)
+
+    assert response.json() == {"login": "octocat"}
+    assert requests_mock.call_count == 3
+    assert len(sleeps) == 2
+    assert all(0 <= delay <= 5 for delay in sleeps)
+
+
+def test_get_returns_last_error_once_retries_are_exhausted(github, requests_mock):
+    requests_mock.get(API_URL, status_code=500)
+
+    response = github.get(API_URL)
+
+    assert response.status_code == 500
+    assert requests_mock.call_count == 3
+
+
+def test_post_is_not_retried_on_server_errors(github, requests_mock):
+    requests_mock.post(TOKEN_URL, status_code=500)
+
+    response = github.post(TOKEN_URL, data={"code": "abc"})
+
+    assert response.status_code == 500
+    assert requests_mock.call_count == 1
+
+
+def test_post_is_retried_after_secondary_rate_limit(github, sleeps, requests_mock):
+    requests_mock.post(
+        TOKEN_URL,
+        [
+            {"status_code": 403, "headers": {"Retry-After": "2"}},
+            {"json": {"access_token": "token"}},
+        ],
+    )
+
+    response = github.post(TOKEN_URL, data={"code": "abc"})
+
+    assert response.json() == {"access_token": "token"}
+    assert sleeps == [2.0]
+
+
+def test_rate_limit_wait_beyond_max_is_not_retried(github, requests_mock):
+    requests_mock.get(API_URL, status_code=429, headers={"Retry-After": "60"})
+
+    response = github.get(API_URL)
+
+    assert response.status_code == 429
+    assert requests_mock.call_count == 1
+
+
+def test_connection_errors_are_retried_for_get(github, requests_mock):
+    requests_mock.get(
+        API_URL,
+        [{"exc": requests.exceptions.ConnectionError}, {"json": {"login": "octocat"}}],
+    )
+
+    assert github.get(API_URL).json() == {"login": "octocat"}
+
+
+def test_requests_have_timeouts(github, requests_mock):
+    requests_mock.get(API_URL, json={})
+
+    github.get(API_URL)
+
+    assert requests_mock.last_request.timeout == github.timeout
+
+
+def test_exhausted_rate_limit_fails_fast_per_token(github, requests_mock):
+    reset_at = time.time() + 600
+    requests_mock.get(
+        API_URL,
+        json={"login": "octocat"},
+        headers={
+            "X-RateLimit-Limit": "5000",
+            "X-RateLimit-Remaining": "0",
+            "X-RateLimit-Reset": str(int(reset_at)),
+        },
+    )
+    exhausted = {"Authorization": "token exhausted"}
+    github.get(API_URL, headers=exhausted)
+
+    assert github.rate_limit(exhausted).remaining == 0
+    with pytest.raises(GitHubRateLimitError):
+        github.get(API_URL, headers=exhausted)
+    # Another token has its own rate limit
+    github.get(API_URL, headers={"Authorization": "token other"})
+    assert requests_mock.call_count == 2
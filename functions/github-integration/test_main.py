@@ -1,15 +1,43 @@
 import base64
+import datetime
 import json
 import os
+import threading
 from unittest import mock
 
 import flask
 import main
 import pytest
 import requests_mock
+from github_client import GitHubClient
 from google.cloud import firestore as fs
 from main import (_create_autoclose_html_response, _encrypt_data_kms,
                   _get_auth_user_info, app)
+from werkzeug.test import EnvironBuilder
+
+from shared.crypto import EnvelopeCipher
+
+
+@pytest.fixture(autouse=True)
+def fresh_token_cipher(monkeypatch):
+    # Each test starts without a cached data-encryption key
+    cipher = EnvelopeCipher()
+    monkeypatch.setattr(main, "TOKEN_CIPHER", cipher)
+    yield cipher
+
+
+@pytest.fixture(autouse=True)
+def clear_github_status_cache():
+    main._github_status_cache.clear()
+    yield
+
+
+@pytest.fixture(autouse=True)
+def github_http(monkeypatch):
+    # Retries happen without waiting
+    github_client = GitHubClient(sleep=lambda seconds: None)
+    monkeypatch.setattr(main, "GITHUB_HTTP", github_client)
+    yield github_client
 
 
 @pytest.fixture
@@ -139,19 +167,59 @@ def test_encrypt_data_kms_success(monkeypatch, mock_kms_client_constructor):
         main, "KMS_KEY_NAME", "test_key"
     ):
 
-        raw_ciphertext = b"encrypted_data_raw"
-        expected_b64_ciphertext = base64.b64encode(raw_ciphertext).decode("utf-8")
-
         mock_encrypt_response = mock.Mock()
-        mock_encrypt_response.ciphertext = raw_ciphertext
+        mock_encrypt_response.ciphertext = b"wrapped_data_key"
         mock_kms_instance.encrypt.return_value = mock_encrypt_response
 
         # Call _initialize_clients_if_needed to make sure KMS_CLIENT is the patched one if it was None
         # This is tricky because _encrypt_data_kms uses the global main.KMS_CLIENT
         main.KMS_CLIENT = mock_kms_instance  # Explicitly set it before call
         result = _encrypt_data_kms("test_payload")
-        assert result == expected_b64_ciphertext
+        second_result = _encrypt_data_kms("other_payload")
+
+        wrapped_key_b64 = base64.b64encode(b"wrapped_data_key").decode("utf-8")
+        assert result.startswith(f"v1:{wrapped_key_b64}:")
+        assert second_result.startswith(f"v1:{wrapped_key_b64}:")
+        # The data key is wrapped once, payloads are encrypted locally
         mock_kms_instance.encrypt.assert_called_once()
+        assert "test_payload" not in result
+
+
+def test_encrypt_data_kms_round_trip(monkeypatch, mock_kms_client_constructor):
+    mock_kms_instance = mock_kms_client_constructor.return_value
+    monkeypatch.setattr(main, "KMS_CLIENT", mock_kms_instance)
+    wrapped_keys = {}
+
+    def fake_encrypt(name, plaintext):
+        wrapped_keys[b"wrapped-" + plaintext] = plaintext
+        return mock.Mock(ciphertext=b"wrapped-" + plaintext)
+
+    def fake_decrypt(name, ciphertext):
+        return mock.Mock(plaintext=wrapped_keys[ciphertext])
+
+    mock_kms_instance.encrypt.side_effect = fake_encrypt
+    mock_kms_instance.decrypt.side_effect = fake_decrypt
+
+    with mock.patch.multiple(
+        main,
+        GOOGLE_CLOUD_PROJECT="test_project",
+        KMS_LOCATION="global",
+        KMS_KEY_RING="test_key_ring",
+        KMS_KEY_NAME="test_key",
+    ):
+        stored = _encrypt_data_kms("test_payload")
+
+    # Another instance, without the data key in memory, unwraps it through KMS
+    other_instance_cipher = EnvelopeCipher()
+    assert (
+        other_instance_cipher.decrypt(mock_kms_instance, "key/path", stored)
+        == "test_payload"
+    )
+    assert (
+        other_instance_cipher.decrypt(mock_kms_instance, "key/path", stored)
+        == "test_payload"
+    )
+    mock_kms_instance.decrypt.assert_called_once()
 
 
 def test_encrypt_data_kms_missing_env_vars(monkeypatch, mock_kms_client_constructor):
@@ -275,11 +343,11 @@ def test_github_callback_success(
             "https://github.com/login/oauth/access_token",
             json={"access_token": "test_github_token"},
         )
-        raw_ciphertext = b"encrypted_token_raw_bytes_content"
-        expected_b64_ciphertext = base64.b64encode(raw_ciphertext).decode("utf-8")
+        raw_wrapped_key = b"wrapped_data_key_raw_bytes_content"
+        expected_header = "v1:" + base64.b64encode(raw_wrapped_key).decode("utf-8")
 
         mock_encrypt_response = mock.Mock()
-        mock_encrypt_response.ciphertext = raw_ciphertext
+        mock_encrypt_response.ciphertext = raw_wrapped_key
         mock_kms_instance.encrypt.return_value = mock_encrypt_response
 
         mock_requests.get(
@@ -295,9 +363,12 @@ def test_github_callback_success(
         mock_db_instance.collection.assert_any_call("users")
         doc_ref_mock = mock_db_instance.collection("users").document("test_user")
         # Added merge=True
+        stored_data = doc_ref_mock.set.call_args[0][0]
+        assert stored_data["github_access_token"].startswith(expected_header + ":")
+        assert "test_github_token" not in stored_data["github_access_token"]
         doc_ref_mock.set.assert_called_once_with(
             {
-                "github_access_token": expected_b64_ciphertext,
+                "github_access_token": stored_data["github_access_token"],
                 "github_login": "test_github_user",
                 "github_id": "123",
                 "github_connected": True,
@@ -307,6 +378,45 @@ def test_github_callback_success(
         )
 
 
+def test_github_callback_encrypts_while_fetching_user(
+    client,
+    mock_requests,
+    monkeypatch,
+    mock_firestore_client_constructor,
+    mock_kms_client_constructor,
+):
+    mock_db_instance = mock_firestore_client_constructor.return_value
+    mock_kms_instance = mock_kms_client_constructor.return_value
+    monkeypatch.setattr(main, "db", mock_db_instance)
+    monkeypatch.setattr(main, "KMS_CLIENT", mock_kms_instance)
+    user_fetch_started = threading.Event()
+    encryption_started = threading.Event()
+
+    def slow_encrypt(name, plaintext):
+        encryption_started.set()
+        # Only returns once the profile fetch is in flight
+        assert user_fetch_started.wait(timeout=5)
+        return mock.Mock(ciphertext=b"wrapped_key")
+
+    def github_user(request, context):
+        user_fetch_started.set()
+        assert encryption_started.wait(timeout=5)
+        return {"login": "test_github_user", "id": 123}
+
+    mock_kms_instance.encrypt.side_effect = slow_encrypt
+    with mock.patch.multiple(main, **COMMON_CALLBACK_ENV_PATCHES):
+        mock_requests.post(
+            "https://github.com/login/oauth/access_token",
+            json={"access_token": "test_github_token"},
+        )
+        mock_requests.get("https://api.github.com/user", json=github_user)
+        response = client.get("/api/v1/github/callback?code=test_code&state=test_user")
+
+    assert "Success! You have been authenticated." in response.get_data(as_text=True)
+    doc_ref_mock = mock_db_instance.collection("users").document("test_user")
+    doc_ref_mock.set.assert_called_once()
+
+
 def test_github_callback_missing_code(
     client, monkeypatch, mock_firestore_client_constructor, mock_kms_client_constructor
 ):
@@ -487,12 +597,17 @@ def test_github_callback_firestore_error(
     assert "internal error" in response.get_data(as_text=True)
 
 
+UPDATE_TIME = datetime.datetime(2024, 5, 1, 12, 0, tzinfo=datetime.timezone.utc)
+
+
 @pytest.fixture
 def mock_firestore_doc_setup(monkeypatch, mock_firestore_client_constructor):
     mock_db_instance = mock_firestore_client_constructor.return_value
     monkeypatch.setattr(main, "db", mock_db_instance)
 
     mock_doc_snapshot = mock.Mock(spec=fs.DocumentSnapshot)
+    # Set by DocumentSnapshot.__init__, hence missing from the class spec
+    mock_doc_snapshot.update_time = UPDATE_TIME
     mock_doc_ref = mock_db_instance.collection("users").document("test_user")
     mock_doc_ref.get.return_value = mock_doc_snapshot
     return mock_doc_ref, mock_doc_snapshot
@@ -518,7 +633,7 @@ def test_github_status_connected(
         "github_login": "test_login",
         "github_id": "123",
     }
-    mock_doc_snapshot.get = lambda key: doc_data.get(key)
+    mock_doc_snapshot.to_dict.return_value = doc_data
 
     response = client.get("/api/v1/github/status", headers=headers)
     assert response.status_code == 200
@@ -527,6 +642,10 @@ def test_github_status_connected(
         "username": "test_login",
         "github_id": "123",
     }
+    # Only the status fields are read, not the token or the agent's metadata
+    mock_doc_ref.get.assert_called_once_with(
+        field_paths=["github_connected", "github_login", "github_id"]
+    )
 
 
 def test_github_status_not_connected(
@@ -542,7 +661,7 @@ def test_github_status_not_connected(
 
     mock_doc_snapshot.exists = True
     doc_data = {"github_connected": False}
-    mock_doc_snapshot.get = lambda key: doc_data.get(key)
+    mock_doc_snapshot.to_dict.return_value = doc_data
 
     response = client.get("/api/v1/github/status", headers=headers)
     assert response.status_code == 200
@@ -567,6 +686,26 @@ def test_github_status_doc_not_exists(
     assert response.json == {"connected": False}
 
 
+def test_github_status_never_connected(
+    client, monkeypatch, mock_kms_client_constructor, mock_firestore_doc_setup
+):
+    monkeypatch.setattr(main, "KMS_CLIENT", mock_kms_client_constructor.return_value)
+    mock_doc_ref, mock_doc_snapshot = mock_firestore_doc_setup
+    user_info_payload = {"sub": "test_user"}
+    encoded_user_info = base64.b64encode(
+        json.dumps(user_info_payload).encode("utf-8")
+    ).decode("utf-8")
+    headers = {"X-Apigateway-Api-Userinfo": encoded_user_info}
+
+    # A profile without any GitHub field comes back as an empty masked document
+    mock_doc_snapshot.exists = True
+    mock_doc_snapshot.to_dict.return_value = {}
+
+    response = client.get("/api/v1/github/status", headers=headers)
+    assert response.status_code == 200
+    assert response.json == {"connected": False}
+
+
 def test_github_status_missing_header(
     client, monkeypatch, mock_kms_client_constructor, mock_firestore_client_constructor
 ):
@@ -610,11 +749,7 @@ def test_github_disconnect_success(
     headers = {"X-Apigateway-Api-Userinfo": encoded_user_info}
 
     mock_doc_snapshot.exists = True
-    mock_doc_snapshot.get = (
-        lambda key: {"github_connected": True}.get(key)
-        if key == "github_connected"
-        else None
-    )
+    mock_doc_snapshot.to_dict.return_value = {"github_connected": True}
 
     response = client.post("/api/v1/github/disconnect", headers=headers)
     assert response.status_code == 200
@@ -629,6 +764,10 @@ def test_github_disconnect_success(
             "github_last_updated": mock.ANY,
         }
     )
+    # Firestore keeps subcollections, the agent's GitHub cache is deleted too
+    main.db.recursive_delete.assert_called_once_with(
+        mock_doc_ref.collection("github_cache")
+    )
 
 
 def test_github_disconnect_not_connected(
@@ -648,6 +787,7 @@ def test_github_disconnect_not_connected(
     assert response.status_code == 200
     assert response.json == {"message": "No active GitHub connection to disconnect."}
     mock_doc_ref.update.assert_not_called()
+    main.db.recursive_delete.assert_not_called()
 
 
 def test_github_disconnect_missing_header(
@@ -671,9 +811,129 @@ def test_github_disconnect_firestore_error(
     headers = {"X-Apigateway-Api-Userinfo": encoded_user_info}
 
     mock_doc_snapshot.exists = True
-    mock_doc_snapshot.get = lambda key: {"github_connected": True}.get(key)
+    mock_doc_snapshot.to_dict.return_value = {"github_connected": True}
     mock_doc_ref.update.side_effect = Exception("Firestore error")
 
     response = client.post("/api/v1/github/disconnect", headers=headers)
     assert response.status_code == 500
     assert response.json == {"error": "Failed to disconnect GitHub."}
+
+
+def test_preflight_fast_path_skips_client_initialization(monkeypatch):
+    init_clients = mock.Mock()
+    monkeypatch.setattr(main, "_initialize_clients_if_needed", init_clients)
+    monkeypatch.setattr(
+        app,
+        "request_context",
+        mock.Mock(side_effect=AssertionError("Flask context built for a preflight")),
+    )
+    preflight = flask.Request(
+        EnvironBuilder(path="/api/v1/github/status", method="OPTIONS").get_environ()
+    )
+
+    response = main.handler(preflight)
+
+    assert response.status_code == 204
+    assert response.headers["Access-Control-Allow-Origin"] == "*"
+    init_clients.assert_not_called()
+
+
+def _status_headers(user_id="test_user"):
+    user_info = base64.b64encode(json.dumps({"sub": user_id}).encode("utf-8"))
+    return {"X-Apigateway-Api-Userinfo": user_info.decode("utf-8")}
+
+
+def test_github_status_is_cached(
+    client, mock_kms_client_constructor, mock_firestore_doc_setup
+):
+    mock_doc_ref, mock_doc_snapshot = mock_firestore_doc_setup
+    mock_doc_snapshot.exists = True
+    mock_doc_snapshot.to_dict.return_value = {
+        "github_connected": True,
+        "github_login": "test_login",
+        "github_id": "123",
+    }
+
+    first = client.get("/api/v1/github/status", headers=_status_headers())
+    second = client.get("/api/v1/github/status", headers=_status_headers())
+
+    assert first.json == second.json
+    assert first.json["connected"] is True
+    mock_doc_ref.get.assert_called_once()
+
+
+def test_github_status_revalidates_with_update_time(
+    client, monkeypatch, mock_kms_client_constructor, mock_firestore_doc_setup
+):
+    monkeypatch.setattr(main, "GITHUB_STATUS_CACHE_TTL_SECONDS", 0)
+    mock_doc_ref, mock_doc_snapshot = mock_firestore_doc_setup
+    mock_doc_snapshot.exists = True
+    mock_doc_snapshot.to_dict.return_value = {"github_connected": False}
+
+    client.get("/api/v1/github/status", headers=_status_headers())
+    response = client.get("/api/v1/github/status", headers=_status_headers())
+
+    assert response.json == {"connected": False}
+    # The second request only read the update time, which hadn't changed
+    assert mock_doc_ref.get.call_args_list == [
+        mock.call(field_paths=["github_connected", "github_login", "github_id"]),
+        mock.call(field_paths=[]),
+    ]
+
+    mock_doc_snapshot.update_time = UPDATE_TIME + datetime.timedelta(seconds=1)
+    mock_doc_snapshot.to_dict.return_value = {
+        "github_connected": True,
+        "github_login": "new_login",
+        "github_id": "456",
+    }
+    response = client.get("/api/v1/github/status", headers=_status_headers())
+
+    assert response.json["username"] == "new_login"
+
+
+def test_github_status_is_read_in_full_after_the_revalidation_period(
+    client, monkeypatch, mock_kms_client_constructor, mock_firestore_doc_setup
+):
+    clock = {"now": 1000.0}
+    monkeypatch.setattr(main.time, "monotonic", lambda: clock["now"])
+    monkeypatch.setattr(main, "GITHUB_STATUS_CACHE_TTL_SECONDS", 30)
+    monkeypatch.setattr(main, "GITHUB_STATUS_REVALIDATE_SECONDS", 60)
+    mock_doc_ref, mock_doc_snapshot = mock_firestore_doc_setup
+    mock_doc_snapshot.exists = True
+    mock_doc_snapshot.to_dict.return_value = {"github_connected": False}
+    full_read = mock.call(field_paths=["github_connected", "github_login", "github_id"])
+
+    client.get("/api/v1/github/status", headers=_status_headers())
+    # Constant polling, revalidated each time the TTL is over
+    for _ in range(2):
+        clock["now"] += 31
+        client.get("/api/v1/github/status", headers=_status_headers())
+    assert mock_doc_ref.get.call_args_list == [
+        full_read,
+        mock.call(field_paths=[]),
+        mock.call(field_paths=[]),
+    ]
+
+    clock["now"] += 31  # 93s after the full read, past TTL + revalidation
+    client.get("/api/v1/github/status", headers=_status_headers())
+
+    assert mock_doc_ref.get.call_args_list[-1] == full_read
+
+
+def test_github_disconnect_invalidates_cached_status(
+    client, mock_kms_client_constructor, mock_firestore_doc_setup
+):
+    mock_doc_ref, mock_doc_snapshot = mock_firestore_doc_setup
+    mock_doc_snapshot.exists = True
+    mock_doc_snapshot.to_dict.return_value = {
+        "github_connected": True,
+        "github_login": "test_login",
+        "github_id": "123",
+    }
+    client.get("/api/v1/github/status", headers=_status_headers())
+
+    client.post("/api/v1/github/disconnect", headers=_status_headers())
+    mock_doc_snapshot.to_dict.return_value = {"github_connected": False}
+    response = client.get("/api/v1/github/status", headers=_status_headers())
+
+    assert response.json == {"connected": False}
@@ -1,5 +1,3 @@
-import base64
-import json
 import logging
 import os
 
@@ -11,57 +9,61 @@ import google.oauth2.id_token
 import requests
 from flask import Flask, jsonify, make_response, request
 
+from shared import auth
+from shared.cors import CorsPolicy
+from shared.logs import setup_logging
+from shared.tracing import inject_trace_context, setup_tracing, traced
+
 # Note: google.oauth2.id_token is NOT directly used if fetching ID token via impersonated_credentials
 
 # --- Flask App Initialization ---
 app = Flask(__name__)
+setup_logging(app)
+setup_tracing(app, "session-mapper")
 
 # --- Configuration from Environment Variables ---
 ALLOWED_ORIGINS = os.getenv("CORS_ALLOWED_ORIGINS", "*")
+CORS = CorsPolicy(
+    allow_origin=ALLOWED_ORIGINS,
+    allow_headers=(
+        "Content-Type, Authorization, X-App, X-End-User-ID, X-Apigateway-Api-Userinfo"
+    ),
+)
 # CLOUDRUN_AGENT_URL will be fetched inside map_session
+# Fixed ID token sent to the agent instead of a fetched one. Only meant for
+# local stand-ins of the agent, which don't check it.
+AGENT_ID_TOKEN = os.getenv("AGENT_ID_TOKEN")
 
 # --- Header Names and Claims ---
-X_APIGATEWAY_USERINFO_HEADER = "X-Apigateway-Api-Userinfo"
 X_APP_HEADER = "X-App"
 AUTHORIZATION_HEADER = (
     "Authorization"  # For Authorization header received by this function
 )
-USER_ID_CLAIM = "sub"
 
 
 def _get_auth_user_info(req: request):
     """
     Extracts, decodes, and validates user authentication info from X-Apigateway-Api-Userinfo.
     """
-    auth_info_header = req.headers.get(X_APIGATEWAY_USERINFO_HEADER)
-    if not auth_info_header:
+    try:
+        return auth.get_user_claims(req.headers), None
+    except auth.MissingUserInfoError:
         return None, (
             {
                 "error": "Authentication information not found (X-Apigateway-Api-Userinfo missing)."
             },
             401,
         )
-    try:
-        # Pad the base64 string if necessary
-        auth_info_header_padded = auth_info_header + "=" * (-len(auth_info_header) % 4)
-        auth_info_decoded = base64.b64decode(auth_info_header_padded).decode("utf-8")
-        auth_info_json = json.loads(auth_info_decoded)
-        if not auth_info_json.get(USER_ID_CLAIM):
-            msg = f"User ID claim ('{USER_ID_CLAIM}') not found in authentication information."
-            return None, ({"error": msg}, 400)
-        return auth_info_json, None
-    except (TypeError, ValueError, AttributeError, json.JSONDecodeError) as e:
-        logging.error("Error decoding authentication information: %s", e)
-        return None, (
-            {"error": "Invalid authentication information format."},
-            400,
-        )
+    except auth.AuthError as e:
+        if isinstance(e, auth.InvalidUserInfoError):
+            logging.error("Error decoding authentication information: %s", e.__cause__)
+        return None, ({"error": e.message}, e.status_code)
 
 
 @app.route("/", methods=["GET", "POST", "OPTIONS"])
 def map_session():
     """Handles session mapping requests."""
-    logging.info(
+    logging.debug(
         "Flask route / hit with method: %s",
         request.method,
     )
@@ -81,9 +83,7 @@ def map_session():
         # error_response is a tuple (data, status_code)
         return jsonify(error_response[0]), error_response[1]
 
-    user_id_from_claims = auth_info[
-        USER_ID_CLAIM
-    ]  # Original end-user ID from initial token
+    user_id_from_claims = auth_info.user_id  # Original end-user ID from initial token
 
     # Validate that app_id from path matches the one from X-App header
     x_app_value = request.headers.get(X_APP_HEADER)
@@ -97,11 +97,17 @@ def map_session():
     logging.info("Attempting to POST to agent at: %s", target_url_for_agent)
 
     try:
-        auth_req = google.auth.transport.requests.Request()
-        id_token = google.oauth2.id_token.fetch_id_token(auth_req, target_url_for_agent)
+        if AGENT_ID_TOKEN:
+            id_token = AGENT_ID_TOKEN
+        else:
+            auth_req = google.auth.transport.requests.Request()
+            with traced("fetch_id_token"):
+                id_token = google.oauth2.id_token.fetch_id_token(
+                    auth_req, target_url_for_agent
+                )
 
-        # Do NOT log the full id_token in production.
-        logging.info("Successfully fetched ID token for agent.")
+            # Do NOT log the full id_token in production.
+            logging.info("Successfully fetched ID token for agent.")
 
         downstream_headers = {
             AUTHORIZATION_HEADER: f"Bearer {id_token}",
@@ -111,7 +117,7 @@ def map_session():
         # Log the Authorization header received by this function (from API Gateway)
         auth_header_from_gateway = request.headers.get(AUTHORIZATION_HEADER)
         if auth_header_from_gateway:
-            logging.info(
+            logging.debug(
                 "Authorization header received from API Gateway (not used for downstream impersonated call): %s...",
                 (
                     auth_header_from_gateway[:20]
@@ -128,12 +134,18 @@ def map_session():
         # This gets the raw body from the incoming request.
         request_body = request.get_data()
 
-        response = requests.post(
-            target_url_for_agent,
-            data=request_body,
-            timeout=10,
-            headers=downstream_headers,
-        )
+        with traced(
+            "POST", {"http.request.method": "POST", "url.full": target_url_for_agent}
+        ) as span:
+            # Lets the agent's spans join this request's trace
+            inject_trace_context(downstream_headers)
+            response = requests.post(
+                target_url_for_agent,
+                data=request_body,
+                timeout=10,
+                headers=downstream_headers,
+            )
+            span.set_attribute("http.response.status_code", response.status_code)
         response.raise_for_status()
 
         logging.info("Agent responded with status: %s", response.status_code)
@@ -191,14 +203,7 @@ def _build_cors_preflight_response():
 @app.after_request
 def add_cors_headers(response):
     """Adds CORS headers to the response."""
-    response.headers["Access-Control-Allow-Origin"] = ALLOWED_ORIGINS
-    response.headers["Access-Control-Allow-Methods"] = "GET, POST, PUT, DELETE, OPTIONS"
-    response.headers["Access-Control-Allow-Headers"] = (
-        "Content-Type, Authorization, X-App, X-End-User-ID, X-Apigateway-Api-Userinfo"
-    )
-    response.headers["Access-Control-Max-Age"] = "3600"
-    logging.info("CORS headers added to response by @app.after_request.")
-    return response
+    return CORS.apply(response)
 
 
 @functions_framework.http
@@ -207,6 +212,9 @@ def handler(req: request):
     Handles HTTP requests by dispatching them to the Flask app.
     This function is the entry point for Google Cloud Functions.
     """
+    # Preflights are answered without a Flask request context.
+    if req.method == "OPTIONS":
+        return CORS.preflight_response()
     # Create a request context for the Flask app to work correctly.
     with app.request_context(req.environ):
         # Let Flask handle the request routing and processing.
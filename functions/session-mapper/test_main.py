@@ -1,12 +1,16 @@
 import base64
 import json
 import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from unittest import mock
 from unittest.mock import MagicMock, patch
 
 import pytest
 import requests
+from flask import Request
 from google.auth import exceptions as google_auth_exceptions
+from werkzeug.test import EnvironBuilder
 
 # Import the main module and the Flask app object
 import main as main_module
@@ -133,6 +137,30 @@ def test_map_session_success(mock_dependencies):
     assert response.headers["Access-Control-Allow-Origin"] == "*"
 
 
+def test_map_session_uses_fixed_agent_id_token(mock_dependencies, monkeypatch):
+    """
+    GIVEN AGENT_ID_TOKEN is set, as for a local stand-in of the agent
+    WHEN the / endpoint is called
+    THEN no ID token is fetched and the fixed one is sent to the agent
+    """
+    monkeypatch.setenv("CLOUDRUN_AGENT_URL", "http://127.0.0.1:8000")
+    monkeypatch.setattr(main_module, "AGENT_ID_TOKEN", "local-token")
+    mock_agent_response = MagicMock()
+    mock_agent_response.status_code = 200
+    mock_agent_response.content = b"{}"
+    mock_agent_response.headers = {}
+    mock_dependencies["requests_post"].return_value = mock_agent_response
+
+    headers = _get_auth_headers(user_id="user-1")
+    headers["X-App"] = "app-abc"
+    response = client.post("/", headers=headers, json={})
+
+    assert response.status_code == 200
+    mock_dependencies["fetch_id_token"].assert_not_called()
+    sent_headers = mock_dependencies["requests_post"].call_args.kwargs["headers"]
+    assert sent_headers["Authorization"] == "Bearer local-token"
+
+
 def test_missing_agent_url_env(mock_dependencies):
     """
     GIVEN the CLOUDRUN_AGENT_URL environment variable is not set
@@ -276,3 +304,91 @@ def test_options_request(mock_dependencies):
         "X-Apigateway-Api-Userinfo" in response.headers["Access-Control-Allow-Headers"]
     )
     assert "X-App" in response.headers["Access-Control-Allow-Headers"]
+
+
+def test_preflight_fast_path_skips_flask_dispatch(monkeypatch):
+    monkeypatch.setattr(
+        main_module.app,
+        "request_context",
+        MagicMock(side_effect=AssertionError("Flask context built for a preflight")),
+    )
+    preflight = Request(EnvironBuilder(path="/", method="OPTIONS").get_environ())
+
+    response = main_module.handler(preflight)
+
+    assert response.status_code == 204
+    assert response.headers["Access-Control-Allow-Origin"] == "*"
+    assert "X-App" in response.headers["Access-Control-Allow-Headers"]
+
+
+class _OtlpCollector(BaseHTTPRequestHandler):
+    """Records the spans of the OTLP/HTTP export requests it receives."""
+
+    def do_POST(self):
+        from opentelemetry.proto.collector.trace.v1 import trace_service_pb2
+
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        export = trace_service_pb2.ExportTraceServiceRequest()
+        export.ParseFromString(body)
+        for resource_spans in export.resource_spans:
+            for scope_spans in resource_spans.scope_spans:
+                self.server.spans.extend(scope_spans.spans)
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def test_spans_are_exported_and_trace_context_reaches_agent(
+    mock_dependencies, monkeypatch
+):
+    """
+    GIVEN tracing exported over OTLP to a local collector
+    WHEN a session is mapped for a caller sending a traceparent header
+    THEN the spans join the caller's trace, which is forwarded to the agent
+    """
+    sdk_trace = pytest.importorskip("opentelemetry.sdk.trace")
+    export = pytest.importorskip("opentelemetry.sdk.trace.export")
+    otlp = pytest.importorskip("opentelemetry.exporter.otlp.proto.http.trace_exporter")
+    import shared.tracing
+
+    collector = ThreadingHTTPServer(("127.0.0.1", 0), _OtlpCollector)
+    collector.spans = []
+    threading.Thread(target=collector.serve_forever, daemon=True).start()
+    provider = sdk_trace.TracerProvider()
+    provider.add_span_processor(
+        export.BatchSpanProcessor(
+            otlp.OTLPSpanExporter(
+                endpoint=f"http://127.0.0.1:{collector.server_address[1]}/v1/traces"
+            )
+        )
+    )
+    monkeypatch.setattr(shared.tracing, "TRACER", provider.get_tracer("test"))
+    monkeypatch.setenv("CLOUDRUN_AGENT_URL", "https://fake-agent.com")
+    mock_dependencies["fetch_id_token"].return_value = "mock-id-token"
+    mock_agent_response = MagicMock()
+    mock_agent_response.status_code = 200
+    mock_agent_response.content = b"{}"
+    mock_agent_response.headers = {}
+    mock_dependencies["requests_post"].return_value = mock_agent_response
+
+    trace_id = "4bf92f3577b34da6a3ce929d0e0e4736"
+    headers = _get_auth_headers(user_id="user-1")
+    headers["X-App"] = "app-abc"
+    headers["traceparent"] = f"00-{trace_id}-00f067aa0ba902b7-01"
+    response = client.post("/", headers=headers, json={})
+    provider.force_flush()
+    collector.shutdown()
+    collector.server_close()
+
+    assert response.status_code == 200
+    spans = {span.name: span for span in collector.spans}
+    assert set(spans) == {"POST /", "fetch_id_token", "POST"}
+    assert {span.trace_id.hex() for span in spans.values()} == {trace_id}
+    assert spans["fetch_id_token"].parent_span_id == spans["POST /"].span_id
+    sent_headers = mock_dependencies["requests_post"].call_args.kwargs["headers"]
+    sent_trace_id, sent_span_id = sent_headers["traceparent"].split("-")[1:3]
+    assert sent_trace_id == trace_id
+    assert sent_span_id == spans["POST"].span_id.hex()
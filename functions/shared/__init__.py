@@ -0,0 +1,2 @@
+# This package holds helpers shared by the Cloud Functions.
+# It is copied next to each function's main.py when packaging (see build_and_zip.sh).
@@ -0,0 +1,130 @@
+"""
+Decoding of the user identity forwarded by API Gateway.
+
+API Gateway validates the caller's token and forwards its claims to the
+functions as a base64-encoded JSON object in the X-Apigateway-Api-Userinfo
+header. Users tend to send bursts of requests carrying the same header, so the
+decoded claims are memoized in a bounded LRU keyed by the raw header value:
+the base64 and JSON cost is paid once per token instead of once per request.
+"""
+
+import base64
+import functools
+import json
+import os
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Any, Mapping
+
+try:  # orjson is optional, it is only used to speed up the JSON parsing.
+    import orjson
+
+    _json_loads = orjson.loads
+except ImportError:  # pragma: no cover - depends on the environment
+    _json_loads = json.loads
+
+X_APIGATEWAY_USERINFO_HEADER = "X-Apigateway-Api-Userinfo"
+USER_ID_CLAIM = "sub"  # Standard OpenID Connect claim for subject (user ID)
+
+# Maximum number of distinct headers kept decoded per instance.
+AUTH_CLAIMS_CACHE_SIZE = int(os.getenv("AUTH_CLAIMS_CACHE_SIZE", "256"))
+
+
+class AuthError(Exception):
+    """Raised when the user identity cannot be extracted from the request."""
+
+    status_code = 400
+
+    def __init__(self, message: str):
+        super().__init__(message)
+        self.message = message
+
+
+class MissingUserInfoError(AuthError):
+    """The API Gateway user info header is absent."""
+
+    status_code = 401
+
+
+class InvalidUserInfoError(AuthError):
+    """The API Gateway user info header cannot be decoded."""
+
+
+class MissingUserIdClaimError(AuthError):
+    """The decoded claims do not contain the user ID claim."""
+
+
+@dataclass(frozen=True)
+class UserClaims:
+    """Claims of the authenticated user.
+
+    Instances are cached and shared between requests, hence immutable.
+
+    Attributes:
+        user_id (str): The subject claim, used as the user's document ID.
+        email (str | None): The user's email, if provided by the token.
+        name (str | None): The user's display name, if provided by the token.
+        claims (Mapping): Read-only view of every decoded claim.
+    """
+
+    user_id: str
+    email: str | None
+    name: str | None
+    claims: Mapping[str, Any]
+
+
+@functools.lru_cache(maxsize=AUTH_CLAIMS_CACHE_SIZE)
+def decode_user_info(header_value: str) -> UserClaims:
+    """Decodes an X-Apigateway-Api-Userinfo header value.
+
+    Successful decodings are memoized; failures are not cached.
+
+    Args:
+        header_value (str): The raw header value.
+
+    Returns:
+        UserClaims: The decoded claims.
+
+    Raises:
+        InvalidUserInfoError: If the value is not base64-encoded JSON object.
+        MissingUserIdClaimError: If the user ID claim is missing or empty.
+    """
+    try:
+        padded = header_value + "=" * (-len(header_value) % 4)
+        claims = _json_loads(base64.b64decode(padded))
+    except (TypeError, ValueError) as e:
+        raise InvalidUserInfoError("Invalid authentication information format.") from e
+    if not isinstance(claims, dict):
+        raise InvalidUserInfoError("Invalid authentication information format.")
+
+    user_id = claims.get(USER_ID_CLAIM)
+    if not user_id:
+        raise MissingUserIdClaimError(
+            f"User ID claim ('{USER_ID_CLAIM}') not found in authentication information."
+        )
+    return UserClaims(
+        user_id=user_id,
+        email=claims.get("email"),
+        name=claims.get("name"),
+        claims=MappingProxyType(claims),
+    )
+
+
+def get_user_claims(headers: Mapping[str, str]) -> UserClaims:
+    """Extracts the authenticated user's claims from request headers.
+
+    Args:
+        headers (Mapping): The request headers.
+
+    Returns:
+        UserClaims: The decoded claims.
+
+    Raises:
+        MissingUserInfoError: If the user info header is absent.
+        InvalidUserInfoError: If the header cannot be decoded.
+        MissingUserIdClaimError: If the user ID claim is missing.
+    """
+    header_value = headers.get(X_APIGATEWAY_USERINFO_HEADER)
+    if not header_value:
+        raise MissingUserInfoError("Authentication information not found.")
+    return decode_user_info(header_value)
@@ -0,0 +1,47 @@
+"""
+Creation of the Google Cloud clients used by the functions.
+
+In production the functions use the real Firestore and KMS clients. For
+local performance runs, FIRESTORE_CLIENT_FACTORY and KMS_CLIENT_FACTORY can
+name a callable, as "module:attribute", returning a stand-in client instead
+(see benchmarks/local_backends.py). The Firestore emulator needs no factory:
+the real client connects to it when FIRESTORE_EMULATOR_HOST is set.
+
+The client libraries are imported by the functions creating the clients, so
+that importing this module costs nothing on a cold start.
+"""
+
+import importlib
+import logging
+import os
+
+FIRESTORE_CLIENT_FACTORY = os.getenv("FIRESTORE_CLIENT_FACTORY")
+KMS_CLIENT_FACTORY = os.getenv("KMS_CLIENT_FACTORY")
+
+
+def _load_factory(spec: str):
+    """Resolves "module:attribute" to the object it names."""
+    module_name, _, attribute = spec.partition(":")
+    if not module_name or not attribute:
+        raise ValueError(f"Invalid client factory '{spec}', expected module:attribute.")
+    return getattr(importlib.import_module(module_name), attribute)
+
+
+def firestore_client():
+    """Returns a new Firestore client, or the configured stand-in."""
+    if FIRESTORE_CLIENT_FACTORY:
+        logging.warning("Using Firestore stand-in %s.", FIRESTORE_CLIENT_FACTORY)
+        return _load_factory(FIRESTORE_CLIENT_FACTORY)()
+    from google.cloud import firestore
+
+    return firestore.Client()
+
+
+def kms_client():
+    """Returns a new KMS client, or the configured stand-in."""
+    if KMS_CLIENT_FACTORY:
+        logging.warning("Using KMS stand-in %s.", KMS_CLIENT_FACTORY)
+        return _load_factory(KMS_CLIENT_FACTORY)()
+    from google.cloud import kms
+
+    return kms.KeyManagementServiceClient()
@@ -0,0 +1,50 @@
+"""
+CORS headers of the functions and the fast path for preflight requests.
+
+Browsers send an OPTIONS preflight ahead of most cross-origin API calls. The
+answer never depends on the user or on stored data, so the functions' entry
+points answer them straight from headers computed once at import time: no
+Flask request context is built, no route runs and no client is initialized.
+"""
+
+from flask import Response
+
+
+class CorsPolicy:
+    """The CORS headers of a function, rendered once.
+
+    Args:
+        allow_origin (str): Value of Access-Control-Allow-Origin.
+        allow_headers (str): Request headers the browser may send.
+        allow_methods (str): Methods the browser may use.
+        expose_headers (str | None): Response headers readable by the browser.
+        max_age (int): How long browsers may cache a preflight answer, in seconds.
+    """
+
+    def __init__(
+        self,
+        allow_origin: str,
+        allow_headers: str,
+        allow_methods: str = "GET, POST, PUT, DELETE, OPTIONS",
+        expose_headers: str | None = None,
+        max_age: int = 3600,
+    ):
+        headers = {
+            "Access-Control-Allow-Origin": allow_origin,
+            "Access-Control-Allow-Methods": allow_methods,
+            "Access-Control-Allow-Headers": allow_headers,
+        }
+        if expose_headers:
+            headers["Access-Control-Expose-Headers"] = expose_headers
+        headers["Access-Control-Max-Age"] = str(max_age)
+        self.headers = tuple(headers.items())
+
+    def apply(self, response):
+        """Adds the CORS headers to a response, for Flask's after_request."""
+        for name, value in self.headers:
+            response.headers[name] = value
+        return response
+
+    def preflight_response(self) -> Response:
+        """Returns the 204 answer to a preflight request."""
+        return Response(status=204, headers=self.headers)
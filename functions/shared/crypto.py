@@ -0,0 +1,135 @@
+"""
+Envelope encryption of secrets stored in Firestore (e.g. GitHub tokens).
+
+KMS only wraps a random data-encryption key (DEK); secrets are encrypted and
+decrypted locally with AES-GCM under that key. Each instance keeps its DEK in
+memory, rotates it on a schedule, and caches the DEKs it unwrapped, so KMS is
+called once per key instead of once per secret.
+
+Stored values carry a key-version header:
+
+    v1:<base64 KMS-wrapped DEK>:<base64 nonce + AES-GCM ciphertext>
+
+Values without a header were encrypted directly with KMS and are still
+decrypted that way, which keeps the migration transparent.
+"""
+
+import base64
+import os
+import threading
+import time
+
+from shared.cache import TTLCache
+from shared.tracing import traced
+
+ENVELOPE_VERSION = "v1"
+_NONCE_SIZE = 12
+
+# How long a DEK is used for new encryptions before a new one is generated.
+DEK_ROTATION_SECONDS = float(os.getenv("DEK_ROTATION_SECONDS", "86400"))
+# How many unwrapped DEKs are kept to decrypt values written by other instances.
+DEK_CACHE_SIZE = int(os.getenv("DEK_CACHE_SIZE", "32"))
+
+
+class EnvelopeCipher:
+    """Encrypts and decrypts secrets with KMS-wrapped AES-GCM keys.
+
+    The KMS client and key path are passed on each call so that callers keep
+    control over how and when their client is initialized.
+
+    Args:
+        rotation_seconds (float): Lifetime of the DEK used for encryption.
+        cache_size (int): Maximum number of unwrapped DEKs kept in memory.
+    """
+
+    def __init__(
+        self,
+        rotation_seconds: float = DEK_ROTATION_SECONDS,
+        cache_size: int = DEK_CACHE_SIZE,
+    ):
+        self.rotation_seconds = rotation_seconds
+        self._active_key = None  # (wrapped DEK as base64, DEK, creation time)
+        self._unwrapped_keys = TTLCache(maxsize=cache_size, ttl=rotation_seconds * 2)
+        self._lock = threading.Lock()
+
+    # cryptography is imported by the methods needing it, not at import time:
+    # it is only loaded on a cold start by the requests handling secrets.
+
+    def encrypt(self, kms_client, key_path: str, plaintext: str) -> str:
+        """Encrypts plaintext, wrapping a new DEK with KMS only when rotating.
+
+        Returns:
+            str: The versioned envelope, safe to store as a string.
+        """
+        from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+        wrapped_key_b64, key = self._get_active_key(kms_client, key_path)
+        header = f"{ENVELOPE_VERSION}:{wrapped_key_b64}"
+        nonce = os.urandom(_NONCE_SIZE)
+        ciphertext = AESGCM(key).encrypt(
+            nonce, plaintext.encode("utf-8"), header.encode("ascii")
+        )
+        return f"{header}:{base64.b64encode(nonce + ciphertext).decode('ascii')}"
+
+    def decrypt(self, kms_client, key_path: str, value: str) -> str:
+        """Decrypts a value produced by encrypt, or a legacy KMS ciphertext.
+
+        Raises:
+            ValueError: If the value is malformed.
+            cryptography.exceptions.InvalidTag: If the value was tampered with.
+        """
+        if not is_envelope(value):
+            with _kms_span("Decrypt"):
+                response = kms_client.decrypt(
+                    name=key_path, ciphertext=base64.b64decode(value)
+                )
+            return response.plaintext.decode("utf-8")
+
+        from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+        version, wrapped_key_b64, payload_b64 = value.split(":", 2)
+        key = self._unwrapped_keys.get(wrapped_key_b64)
+        if key is None:
+            with _kms_span("Decrypt"):
+                response = kms_client.decrypt(
+                    name=key_path, ciphertext=base64.b64decode(wrapped_key_b64)
+                )
+            key = response.plaintext
+            self._unwrapped_keys.set(wrapped_key_b64, key)
+        payload = base64.b64decode(payload_b64)
+        plaintext = AESGCM(key).decrypt(
+            payload[:_NONCE_SIZE],
+            payload[_NONCE_SIZE:],
+            f"{version}:{wrapped_key_b64}".encode("ascii"),
+        )
+        return plaintext.decode("utf-8")
+
+    def _get_active_key(self, kms_client, key_path: str) -> tuple[str, bytes]:
+        """Returns the current (wrapped DEK, DEK), generating one if due."""
+        from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+        with self._lock:
+            now = time.monotonic()
+            if (
+                self._active_key is None
+                or now - self._active_key[2] >= self.rotation_seconds
+            ):
+                key = AESGCM.generate_key(bit_length=256)
+                with _kms_span("Encrypt"):
+                    response = kms_client.encrypt(name=key_path, plaintext=key)
+                wrapped_key_b64 = base64.b64encode(response.ciphertext).decode("ascii")
+                self._active_key = (wrapped_key_b64, key, now)
+                self._unwrapped_keys.set(wrapped_key_b64, key)
+            return self._active_key[0], self._active_key[1]
+
+
+def _kms_span(method: str):
+    return traced(
+        f"google.cloud.kms.v1.KeyManagementService/{method}",
+        {"rpc.system": "grpc", "rpc.method": method},
+    )
+
+
+def is_envelope(value: str) -> bool:
+    """Tells whether value was produced by EnvelopeCipher.encrypt."""
+    return value.startswith(f"{ENVELOPE_VERSION}:")
@@ -0,0 +1,186 @@
+"""
+Structured logging of the functions, in Cloud Logging's JSON format.
+
+Records are written to stdout as one JSON object per line, which Cloud Logging
+parses into structured entries: the severity is kept, the request ID becomes a
+queryable field and, when the request carries a Cloud Trace context, entries
+are grouped under their trace. Extra fields can be attached to a record with
+`extra={"json_fields": {...}}`.
+
+Messages are formatted lazily: call sites use %-style arguments, which are
+only interpolated for records that are actually emitted. INFO and DEBUG
+records can additionally be sampled per route, the decision being taken once
+per request so that a sampled request keeps all of its records. Warnings and
+errors are never sampled out.
+"""
+
+import contextvars
+import datetime
+import json
+import logging
+import os
+import random
+import sys
+import uuid
+from dataclasses import dataclass
+from typing import Mapping
+
+from flask import g, request
+
+REQUEST_ID_HEADER = "X-Request-Id"
+CLOUD_TRACE_HEADER = "X-Cloud-Trace-Context"
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# Fraction of requests whose INFO and DEBUG records are kept, per route:
+# "LOG_SAMPLE_RATE" is the default, "LOG_SAMPLE_RATES" overrides it for
+# routes given as "<route>=<rate>,...", e.g. "/api/v1/github/status=0.1".
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "1"))
+LOG_SAMPLE_RATES = os.getenv("LOG_SAMPLE_RATES", "")
+
+_SEVERITIES = {
+    logging.DEBUG: "DEBUG",
+    logging.INFO: "INFO",
+    logging.WARNING: "WARNING",
+    logging.ERROR: "ERROR",
+    logging.CRITICAL: "CRITICAL",
+}
+
+
+@dataclass(frozen=True)
+class RequestLogContext:
+    """What the records logged while handling a request are tagged with.
+
+    Attributes:
+        request_id (str): The caller's X-Request-Id, or a generated one.
+        trace (str | None): The Cloud Trace resource name, if known.
+        route (str): The matched URL rule, or the path when none matched.
+        sampled (bool): Whether INFO and DEBUG records are emitted.
+    """
+
+    request_id: str
+    trace: str | None
+    route: str
+    sampled: bool
+
+
+_request_context: contextvars.ContextVar[RequestLogContext | None] = (
+    contextvars.ContextVar("request_log_context", default=None)
+)
+
+
+def current_request_id() -> str | None:
+    """Returns the ID of the request being handled, if any."""
+    context = _request_context.get()
+    return context.request_id if context else None
+
+
+class CloudLoggingFormatter(logging.Formatter):
+    """Formats records as Cloud Logging structured JSON entries."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        message = record.getMessage()
+        if record.exc_info:
+            message = f"{message}\n{self.formatException(record.exc_info)}"
+        entry = {
+            "severity": _SEVERITIES.get(record.levelno, record.levelname),
+            "message": message,
+            "time": datetime.datetime.fromtimestamp(
+                record.created, datetime.timezone.utc
+            ).isoformat(),
+            "logger": record.name,
+            "logging.googleapis.com/sourceLocation": {
+                "file": record.pathname,
+                "line": record.lineno,
+                "function": record.funcName,
+            },
+        }
+        context = _request_context.get()
+        if context is not None:
+            entry["requestId"] = context.request_id
+            entry["route"] = context.route
+            if context.trace:
+                entry["logging.googleapis.com/trace"] = context.trace
+        json_fields = getattr(record, "json_fields", None)
+        if json_fields:
+            entry.update(json_fields)
+        return json.dumps(entry, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """Drops the INFO and DEBUG records of requests not sampled."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        context = _request_context.get()
+        return context is None or context.sampled
+
+
+def parse_sample_rates(value: str) -> dict[str, float]:
+    """Parses "<route>=<rate>,..." into a mapping, ignoring malformed items."""
+    rates = {}
+    for item in value.split(","):
+        route, _, rate = item.strip().rpartition("=")
+        try:
+            rates[route.strip()] = min(max(float(rate), 0.0), 1.0)
+        except ValueError:
+            continue
+    rates.pop("", None)
+    return rates
+
+
+def _trace_resource(header_value: str | None) -> str | None:
+    """Turns an X-Cloud-Trace-Context value into a trace resource name."""
+    project = os.getenv("GOOGLE_CLOUD_PROJECT")
+    if not header_value or not project:
+        return None
+    trace_id = header_value.split("/", 1)[0].strip()
+    return f"projects/{project}/traces/{trace_id}" if trace_id else None
+
+
+def setup_logging(app, sample_rates: Mapping[str, float] | None = None) -> None:
+    """Routes the root logger to stdout as JSON and tags records per request.
+
+    Args:
+        app (flask.Flask): The function's app, hooked to track requests.
+        sample_rates (Mapping | None): Default sampling rate per route, which
+            the LOG_SAMPLE_RATES environment variable takes precedence over.
+    """
+    root = logging.getLogger()
+    if not any(isinstance(h.formatter, CloudLoggingFormatter) for h in root.handlers):
+        handler = logging.StreamHandler(sys.stdout)
+        handler.setFormatter(CloudLoggingFormatter())
+        handler.addFilter(SamplingFilter())
+        root.addHandler(handler)
+    root.setLevel(LOG_LEVEL)
+
+    rates = {**(sample_rates or {}), **parse_sample_rates(LOG_SAMPLE_RATES)}
+
+    @app.before_request
+    def _bind_request_log_context():
+        route = request.url_rule.rule if request.url_rule else request.path
+        rate = rates.get(route, LOG_SAMPLE_RATE)
+        context = RequestLogContext(
+            request_id=request.headers.get(REQUEST_ID_HEADER) or uuid.uuid4().hex,
+            trace=_trace_resource(request.headers.get(CLOUD_TRACE_HEADER)),
+            route=route,
+            sampled=rate >= 1 or random.random() < rate,
+        )
+        g.request_log_context_token = _request_context.set(context)
+
+    @app.after_request
+    def _add_request_id_header(response):
+        request_id = current_request_id()
+        if request_id:
+            response.headers[REQUEST_ID_HEADER] = request_id
+        return response
+
+    @app.teardown_request
+    def _unbind_request_log_context(_exc):
+        token = g.pop("request_log_context_token", None)
+        if token is None:
+            return
+        try:
+            _request_context.reset(token)
+        except ValueError:  # Torn down from another context, e.g. a stream
+            _request_context.set(None)
@@ -0,0 +1,137 @@
+"""
+OpenTelemetry tracing of the functions.
+
+Every request handled by a function gets a server span, continuing the
+trace of the caller when the request carries a W3C `traceparent` header.
+Calls to other services (Firestore, KMS, GitHub, the agent) are wrapped in
+client spans with `traced`, and `inject_trace_context` adds the current
+trace context to the headers of a downstream request.
+
+Spans are exported over OTLP/HTTP when OTEL_EXPORTER_OTLP_ENDPOINT (or
+OTEL_EXPORTER_OTLP_TRACES_ENDPOINT) is set, e.g. to a local collector.
+Otherwise no SDK is loaded and spans are no-ops, which costs close to
+nothing per request.
+"""
+
+import contextlib
+import logging
+import os
+import threading
+
+from opentelemetry import context, propagate, trace
+from opentelemetry.trace import SpanKind, Status, StatusCode
+
+TRACER = trace.get_tracer("reomir.functions")
+
+_configure_lock = threading.Lock()
+
+
+def _exporter_configured() -> bool:
+    return bool(
+        os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT")
+        or os.getenv("OTEL_EXPORTER_OTLP_TRACES_ENDPOINT")
+    )
+
+
+def configure_tracing(service_name: str, span_exporter=None):
+    """Sends spans to span_exporter, an OTLP/HTTP exporter by default.
+
+    The SDK's TracerProvider is installed if no provider was yet, otherwise
+    the exporter is added to the existing one.
+
+    Returns:
+        opentelemetry.sdk.trace.TracerProvider: The provider exporting spans.
+    """
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor
+
+    if span_exporter is None:
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import \
+            OTLPSpanExporter
+
+        span_exporter = OTLPSpanExporter()
+
+    with _configure_lock:
+        provider = trace.get_tracer_provider()
+        if not isinstance(provider, TracerProvider):
+            provider = TracerProvider(
+                resource=Resource.create({"service.name": service_name})
+            )
+            trace.set_tracer_provider(provider)
+        provider.add_span_processor(BatchSpanProcessor(span_exporter))
+    return provider
+
+
+def setup_tracing(app, service_name: str) -> None:
+    """Traces the requests handled by app, exporting spans if configured.
+
+    Args:
+        app (flask.Flask): The function's app.
+        service_name (str): Name of the function in the traces.
+    """
+    from flask import g, request
+
+    if _exporter_configured():
+        try:
+            configure_tracing(service_name)
+        except ImportError:
+            logging.warning(
+                "OTLP endpoint set but the OpenTelemetry SDK is not installed."
+            )
+
+    @app.before_request
+    def _start_server_span():
+        route = request.url_rule.rule if request.url_rule else request.path
+        parent = propagate.extract(request.headers)
+        span = TRACER.start_span(
+            f"{request.method} {route}",
+            context=parent,
+            kind=SpanKind.SERVER,
+            attributes={
+                "http.request.method": request.method,
+                "http.route": route,
+                "url.path": request.path,
+            },
+        )
+        g.server_span = span
+        g.trace_context_token = context.attach(trace.set_span_in_context(span, parent))
+
+    @app.after_request
+    def _record_response_status(response):
+        span = g.get("server_span")
+        if span is not None:
+            span.set_attribute("http.response.status_code", response.status_code)
+            if response.status_code >= 500:
+                span.set_status(Status(StatusCode.ERROR))
+        return response
+
+    @app.teardown_request
+    def _end_server_span(exc):
+        span = g.pop("server_span", None)
+        if span is None:
+            return
+        if exc is not None:
+            span.record_exception(exc)
+            span.set_status(Status(StatusCode.ERROR, type(exc).__name__))
+        span.end()
+        context.detach(g.pop("trace_context_token"))
+
+
+@contextlib.contextmanager
+def traced(name: str, attributes: dict | None = None):
+    """Wraps a call to another service in a client span.
+
+    Exceptions raised by the call are recorded on the span, which is marked
+    as failed, and re-raised.
+    """
+    with TRACER.start_as_current_span(
+        name, kind=SpanKind.CLIENT, attributes=attributes
+    ) as span:
+        yield span
+
+
+def inject_trace_context(headers: dict) -> dict:
+    """Adds the current trace context to the headers of an outgoing request."""
+    propagate.inject(headers)
+    return headers
@@ -0,0 +1,129 @@
+"""
+Access to the Firestore 'users' collection.
+
+User documents also hold the encrypted GitHub token and whatever metadata the
+agent saved for the user, so read paths ask Firestore only for the fields they
+need through field masks. The payload and deserialization cost of a read then
+stays constant however much the agent writes to a user.
+"""
+
+import re
+from typing import Any, Iterable
+
+from shared.tracing import traced
+
+USERS_COLLECTION = "users"
+# Subcollection of a user's document where the agent caches its GitHub data.
+GITHUB_CACHE_COLLECTION = "github_cache"
+
+# Fields of a profile returned by the batch read unless others are asked for.
+PROFILE_FIELDS = (
+    "uid",
+    "email",
+    "displayName",
+    "cookieConsent",
+    "emailMarketing",
+    "organizationName",
+    "github_access_token",
+    "github_connected",
+    "github_id",
+    "github_login",
+    "github_last_updated",
+)
+# Fields needed to report the GitHub connection status.
+GITHUB_STATUS_FIELDS = ("github_connected", "github_login", "github_id")
+# An empty mask: the read only tells whether the document exists.
+NO_FIELDS = ()
+
+_TOP_LEVEL_FIELD_RE = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+
+def traced_firestore(operation: str, collection: str = USERS_COLLECTION):
+    """Wraps a Firestore call on the users collection, or a subcollection, in a span."""
+    return traced(
+        f"{operation} {collection}",
+        {
+            "db.system": "firestore",
+            "db.operation.name": operation,
+            "db.collection.name": collection,
+        },
+    )
+
+
+def user_document(db, user_id: str):
+    """Returns the reference of a user's document."""
+    return db.collection(USERS_COLLECTION).document(user_id)
+
+
+def get_user_snapshot(db, user_id: str, field_paths: Iterable[str] | None = None):
+    """Reads a user's document, restricted to field_paths when given.
+
+    Args:
+        db (firestore.Client): The Firestore client.
+        user_id (str): The user's document ID.
+        field_paths (Iterable[str] | None): Fields to read, None reads them all.
+
+    Returns:
+        firestore.DocumentSnapshot: The snapshot, check its 'exists' attribute.
+    """
+    if field_paths is not None:
+        field_paths = list(field_paths)
+    with traced_firestore("get"):
+        return user_document(db, user_id).get(field_paths=field_paths)
+
+
+def get_github_status(db, user_id: str) -> tuple[dict | None, Any]:
+    """Reads only the GitHub connection fields of a user.
+
+    Returns:
+        tuple: The fields present on the document, None if it doesn't exist,
+            and the document's update time, which versions them.
+    """
+    snapshot = get_user_snapshot(db, user_id, GITHUB_STATUS_FIELDS)
+    if not snapshot.exists:
+        return None, None
+    return snapshot.to_dict() or {}, snapshot.update_time
+
+
+def get_update_time(db, user_id: str):
+    """Reads only the update time of a user's document, None if it doesn't exist.
+
+    The read transfers no field, it is the cheap way to tell whether a copy of
+    the document made at a known update time is still current.
+    """
+    snapshot = get_user_snapshot(db, user_id, NO_FIELDS)
+    return snapshot.update_time if snapshot.exists else None
+
+
+def delete_github_cache(db, user_id: str) -> None:
+    """Deletes the GitHub data the agent cached under a user's document.
+
+    Firestore keeps a document's subcollections when the document is updated
+    or deleted, so disconnecting GitHub or deleting the user has to delete
+    them explicitly.
+    """
+    with traced_firestore("delete", GITHUB_CACHE_COLLECTION):
+        db.recursive_delete(
+            user_document(db, user_id).collection(GITHUB_CACHE_COLLECTION)
+        )
+
+
+def parse_field_mask(value: str | None) -> tuple[str, ...] | None:
+    """Parses a comma-separated list of top-level field names.
+
+    Args:
+        value (str | None): The raw list, e.g. from a 'fields' query parameter.
+
+    Returns:
+        tuple | None: The field names, or None if value is empty.
+
+    Raises:
+        ValueError: If a name is not a plain top-level field name.
+    """
+    if not value:
+        return None
+    fields = tuple(field.strip() for field in value.split(",") if field.strip())
+    for field in fields:
+        if not _TOP_LEVEL_FIELD_RE.match(field):
+            raise ValueError(f"Invalid field name: '{field}'.")
+    return fields or None
@@ -0,0 +1,424 @@
+"""
+Bulk export and import of the Firestore 'users' collection.
+
+Meant for backups and tenant migrations, run as a job next to the users
+function rather than through its HTTP API:
+
+    PYTHONPATH=.. python bulk.py export users.ndjson.gz --checkpoint export.json
+    PYTHONPATH=.. python bulk.py import users.ndjson.gz --checkpoint import.json
+
+Exports page through the collection in document ID order and stream one
+record per document to gzip-compressed NDJSON, or to Parquet when the file
+name ends with '.parquet' (requires pyarrow). Imports go through a Firestore
+BulkWriter, which batches writes, sends them in parallel and ramps up to the
+configured throttle. Both directions save a checkpoint after every page or
+flush: running the same command again with the same checkpoint file resumes
+where the previous run stopped. Writes are plain sets, so replaying the
+records of an interrupted page is harmless.
+"""
+
+import argparse
+import base64
+import datetime
+import gzip
+import json
+import logging
+import os
+import sys
+from dataclasses import dataclass, field
+from typing import Iterable, Iterator
+
+from google.cloud import firestore
+from google.cloud.firestore_v1.bulk_writer import BulkWriterOptions, SendMode
+
+from shared.users_repository import USERS_COLLECTION
+
+try:  # pyarrow is optional, it is only needed for Parquet files.
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # pragma: no cover - depends on the environment
+    pyarrow = None
+
+EXPORT_PAGE_SIZE = int(os.getenv("BULK_EXPORT_PAGE_SIZE", "500"))
+# BulkWriter starts at the initial rate and ramps up (500/50/5 rule) to the max.
+IMPORT_INITIAL_OPS_PER_SECOND = int(os.getenv("BULK_IMPORT_INITIAL_OPS", "500"))
+IMPORT_MAX_OPS_PER_SECOND = int(os.getenv("BULK_IMPORT_MAX_OPS", "10000"))
+# Number of records enqueued between two flushes, i.e. between two checkpoints.
+IMPORT_FLUSH_EVERY = int(os.getenv("BULK_IMPORT_FLUSH_EVERY", "2000"))
+IMPORT_MAX_ATTEMPTS = int(os.getenv("BULK_IMPORT_MAX_ATTEMPTS", "10"))
+
+# Key tagging the Firestore values that JSON cannot represent.
+TYPE_KEY = "__type__"
+
+
+# --- Value encoding ---
+
+
+def encode_value(value):
+    """Converts a Firestore value to a JSON-serializable one, losslessly."""
+    if isinstance(value, dict):
+        return {key: encode_value(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [encode_value(item) for item in value]
+    if isinstance(value, datetime.datetime):
+        return {TYPE_KEY: "timestamp", "value": value.isoformat()}
+    if isinstance(value, bytes):
+        return {TYPE_KEY: "bytes", "value": base64.b64encode(value).decode("ascii")}
+    if isinstance(value, firestore.GeoPoint):
+        return {
+            TYPE_KEY: "geopoint",
+            "latitude": value.latitude,
+            "longitude": value.longitude,
+        }
+    if isinstance(value, firestore.DocumentReference):
+        return {TYPE_KEY: "reference", "path": value.path}
+    return value
+
+
+def decode_value(db, value):
+    """Reverts encode_value, references are rebuilt against db."""
+    if isinstance(value, list):
+        return [decode_value(db, item) for item in value]
+    if not isinstance(value, dict):
+        return value
+    value_type = value.get(TYPE_KEY)
+    if value_type == "timestamp":
+        return datetime.datetime.fromisoformat(value["value"])
+    if value_type == "bytes":
+        return base64.b64decode(value["value"])
+    if value_type == "geopoint":
+        return firestore.GeoPoint(value["latitude"], value["longitude"])
+    if value_type == "reference":
+        return db.document(value["path"])
+    return {key: decode_value(db, item) for key, item in value.items()}
+
+
+# --- Checkpoints ---
+
+
+def _load_checkpoint(path: str | None) -> dict:
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _save_checkpoint(path: str | None, state: dict) -> None:
+    """Replaces the checkpoint atomically, a crash leaves the previous one."""
+    if not path:
+        return
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    os.replace(tmp_path, path)
+
+
+# --- Files ---
+
+
+def _is_parquet(path: str) -> bool:
+    return path.endswith(".parquet")
+
+
+def _require_pyarrow() -> None:
+    if pyarrow is None:
+        raise RuntimeError("Parquet files require pyarrow (pip install pyarrow).")
+
+
+class _NdjsonWriter:
+    """Appends pages as independent gzip members.
+
+    A gzip stream may be made of several members, so each page is compressed
+    on its own and the checkpoint records the offset after it: resuming
+    truncates whatever a crash left half-written past that offset.
+    """
+
+    def __init__(self, path: str, offset: int | None):
+        self._file = open(path, "r+b" if offset is not None else "wb")
+        if offset is not None:
+            self._file.truncate(offset)
+            self._file.seek(offset)
+
+    def write(self, records: list[dict]) -> int:
+        lines = "".join(
+            json.dumps(record, separators=(",", ":")) + "\n" for record in records
+        )
+        self._file.write(gzip.compress(lines.encode("utf-8")))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        return self._file.tell()
+
+    def close(self) -> None:
+        self._file.close()
+
+
+class _ParquetWriter:
+    """Writes each page as a row group of (id, data as JSON) rows."""
+
+    def __init__(self, path: str):
+        _require_pyarrow()
+        self._schema = pyarrow.schema(
+            [("id", pyarrow.string()), ("data", pyarrow.string())]
+        )
+        self._writer = pyarrow.parquet.ParquetWriter(
+            path, self._schema, compression="zstd"
+        )
+
+    def write(self, records: list[dict]) -> None:
+        """Parquet files cannot be appended to, so there is no offset to return."""
+        table = pyarrow.Table.from_pydict(
+            {
+                "id": [record["id"] for record in records],
+                "data": [json.dumps(record["data"]) for record in records],
+            },
+            schema=self._schema,
+        )
+        self._writer.write_table(table)
+
+    def close(self) -> None:
+        self._writer.close()
+
+
+def read_records(path: str) -> Iterator[dict]:
+    """Yields the {'id', 'data'} records of an export, in file order."""
+    if _is_parquet(path):
+        _require_pyarrow()
+        for batch in pyarrow.parquet.ParquetFile(path).iter_batches():
+            for row in batch.to_pylist():
+                yield {"id": row["id"], "data": json.loads(row["data"])}
+        return
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+# --- Export ---
+
+
+def iter_user_pages(
+    db, page_size: int = EXPORT_PAGE_SIZE, start_after_id: str | None = None
+) -> Iterator[list]:
+    """Pages through the users collection in document ID order.
+
+    Each page is a query resuming after the last document of the previous one,
+    so no query cursor is held open for the whole export.
+    """
+    collection = db.collection(USERS_COLLECTION)
+    while True:
+        query = collection.order_by("__name__").limit(page_size)
+        if start_after_id is not None:
+            query = query.start_after({"__name__": start_after_id})
+        page = list(query.stream())
+        if not page:
+            return
+        yield page
+        if len(page) < page_size:
+            return
+        start_after_id = page[-1].id
+
+
+def export_users(
+    db,
+    output_path: str,
+    page_size: int = EXPORT_PAGE_SIZE,
+    checkpoint_path: str | None = None,
+) -> int:
+    """Streams the users collection to output_path.
+
+    Args:
+        db (firestore.Client): The Firestore client.
+        output_path (str): A '.parquet' file, otherwise gzip-compressed NDJSON.
+        page_size (int): Documents read per query.
+        checkpoint_path (str | None): Where progress is saved, and resumed from.
+
+    Returns:
+        int: The total number of documents exported, including resumed ones.
+    """
+    checkpoint = _load_checkpoint(checkpoint_path)
+    last_id = checkpoint.get("last_id")
+    exported = checkpoint.get("exported", 0)
+
+    if _is_parquet(output_path):
+        if last_id is not None:
+            raise RuntimeError(
+                "Parquet exports cannot be resumed, restart without the checkpoint."
+            )
+        writer = _ParquetWriter(output_path)
+    else:
+        writer = _NdjsonWriter(output_path, checkpoint.get("offset"))
+
+    try:
+        for page in iter_user_pages(db, page_size, last_id):
+            records = [
+                {"id": snapshot.id, "data": encode_value(snapshot.to_dict() or {})}
+                for snapshot in page
+            ]
+            offset = writer.write(records)
+            last_id = page[-1].id
+            exported += len(page)
+            _save_checkpoint(
+                checkpoint_path,
+                {"last_id": last_id, "exported": exported, "offset": offset},
+            )
+            logging.info("Exported %d users (last ID: %s).", exported, last_id)
+    finally:
+        writer.close()
+    return exported
+
+
+# --- Import ---
+
+
+@dataclass
+class ImportReport:
+    """Outcome of an import.
+
+    Attributes:
+        imported (int): Records written, including those of resumed runs.
+        failed_ids (list[str]): Documents whose write failed after every retry.
+    """
+
+    imported: int = 0
+    failed_ids: list[str] = field(default_factory=list)
+
+
+def import_users(
+    db,
+    records: Iterable[dict],
+    checkpoint_path: str | None = None,
+    initial_ops_per_second: int = IMPORT_INITIAL_OPS_PER_SECOND,
+    max_ops_per_second: int = IMPORT_MAX_OPS_PER_SECOND,
+    flush_every: int = IMPORT_FLUSH_EVERY,
+    max_attempts: int = IMPORT_MAX_ATTEMPTS,
+) -> ImportReport:
+    """Writes exported records to the users collection with a BulkWriter.
+
+    Records are overwritten, not merged, so the collection ends up matching
+    the export for every imported ID.
+
+    Args:
+        db (firestore.Client): The Firestore client.
+        records (Iterable[dict]): The records, as yielded by read_records.
+        checkpoint_path (str | None): Where progress is saved, and resumed from.
+        initial_ops_per_second (int): Write rate BulkWriter starts at.
+        max_ops_per_second (int): Write rate BulkWriter never exceeds.
+        flush_every (int): Records enqueued between two checkpoints.
+        max_attempts (int): Attempts per write before it is reported as failed.
+
+    Returns:
+        ImportReport: The number of imported records and the failed IDs.
+    """
+    checkpoint = _load_checkpoint(checkpoint_path)
+    report = ImportReport(
+        imported=checkpoint.get("imported", 0),
+        failed_ids=list(checkpoint.get("failed_ids", [])),
+    )
+    skip = report.imported + len(report.failed_ids)
+
+    writer = db.bulk_writer(
+        options=BulkWriterOptions(
+            initial_ops_per_second=initial_ops_per_second,
+            max_ops_per_second=max_ops_per_second,
+            mode=SendMode.parallel,
+        )
+    )
+    pending_failures = []
+
+    def on_write_error(failure, _bulk_writer) -> bool:
+        if failure.attempts < max_attempts:
+            return True
+        logging.error(
+            "Giving up on user %s after %d attempts: %s",
+            failure.operation.reference.id,
+            failure.attempts,
+            failure.message,
+        )
+        pending_failures.append(failure.operation.reference.id)
+        return False
+
+    writer.on_write_error(on_write_error)
+    collection = db.collection(USERS_COLLECTION)
+
+    def flush(enqueued: int) -> None:
+        writer.flush()
+        report.failed_ids.extend(pending_failures)
+        report.imported += enqueued - len(pending_failures)
+        pending_failures.clear()
+        _save_checkpoint(
+            checkpoint_path,
+            {"imported": report.imported, "failed_ids": report.failed_ids},
+        )
+        logging.info(
+            "Imported %d users (%d failed).", report.imported, len(report.failed_ids)
+        )
+
+    enqueued = 0
+    try:
+        for index, record in enumerate(records):
+            if index < skip:
+                continue
+            writer.set(
+                collection.document(record["id"]), decode_value(db, record["data"])
+            )
+            enqueued += 1
+            if enqueued >= flush_every:
+                flush(enqueued)
+                enqueued = 0
+        flush(enqueued)
+    finally:
+        writer.close()
+    return report
+
+
+# --- Command line ---
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = subparsers.add_parser("export", help="Export the users.")
+    export_parser.add_argument("output", help="'.parquet' or '.ndjson.gz' file.")
+    export_parser.add_argument("--page-size", type=int, default=EXPORT_PAGE_SIZE)
+    export_parser.add_argument("--checkpoint", help="Resumable progress file.")
+
+    import_parser = subparsers.add_parser("import", help="Import exported users.")
+    import_parser.add_argument("input", help="File written by the export command.")
+    import_parser.add_argument("--checkpoint", help="Resumable progress file.")
+    import_parser.add_argument(
+        "--initial-ops", type=int, default=IMPORT_INITIAL_OPS_PER_SECOND
+    )
+    import_parser.add_argument("--max-ops", type=int, default=IMPORT_MAX_OPS_PER_SECOND)
+    import_parser.add_argument("--flush-every", type=int, default=IMPORT_FLUSH_EVERY)
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    db = firestore.Client()
+
+    if args.command == "export":
+        exported = export_users(db, args.output, args.page_size, args.checkpoint)
+        logging.info("Export complete: %d users.", exported)
+        return 0
+
+    report = import_users(
+        db,
+        read_records(args.input),
+        checkpoint_path=args.checkpoint,
+        initial_ops_per_second=args.initial_ops,
+        max_ops_per_second=args.max_ops,
+        flush_every=args.flush_every,
+    )
+    logging.info(
+        "Import complete: %d users, %d failed.",
+        report.imported,
+        len(report.failed_ids),
+    )
+    if report.failed_ids:
+        logging.error("Failed user IDs: %s", ", ".join(report.failed_ids))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# Make functions/shared importable when running the tests from the source tree.
+# Deployed bundles get a copy of it next to main.py (see build_and_zip.sh).
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
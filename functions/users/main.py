@@ -6,23 +6,38 @@ identity from an API Gateway-provided header. It supports GET, POST, PUT,
 and DELETE methods. CORS is handled for all requests.
 """
 
-import base64
-import json
+import hashlib
 import logging
 import os
+from concurrent.futures import ThreadPoolExecutor
 
 import functions_framework
-from flask import Flask, jsonify, make_response, request
-from google.cloud import exceptions as google_exceptions
-from google.cloud import firestore, kms
+from flask import (Flask, Response, jsonify, make_response, request,
+                   stream_with_context)
+
+from shared.auth import AuthError, InvalidUserInfoError, get_user_claims
+from shared.cache import TTLCache
+from shared.clients import firestore_client, kms_client
+from shared.cors import CorsPolicy
+from shared.crypto import EnvelopeCipher
+from shared.logs import setup_logging
+from shared.tracing import setup_tracing
+from shared.users_repository import (NO_FIELDS, PROFILE_FIELDS,
+                                     delete_github_cache, get_user_snapshot,
+                                     parse_field_mask, traced_firestore,
+                                     user_document)
 
 # --- Flask App Initialization ---
 app = Flask(__name__)
+setup_logging(app)
+setup_tracing(app, "users")
 
-db = firestore.Client()
+# Clients are created on first use (see _get_db and _get_kms_client): their
+# gRPC stacks are only imported by the requests that need them, so preflights
+# and routes that never decrypt a token don't pay for them on a cold start.
+db = None
 
-# Initialize KMS client
-KMS_CLIENT = kms.KeyManagementServiceClient()
+KMS_CLIENT = None
 KMS_KEY_NAME = os.getenv("KMS_KEY_NAME")
 KMS_KEY_RING = os.getenv("KMS_KEY_RING")
 KMS_LOCATION = os.getenv("KMS_LOCATION")
@@ -30,17 +45,58 @@ GCP_PROJECT = os.getenv("GOOGLE_CLOUD_PROJECT")
 
 # KMS_KEY_NAME, KMS_KEY_RING, KMS_LOCATION, GCP_PROJECT will be fetched inside _decrypt_data_kms
 
-ALLOWED_ORIGINS = os.getenv("CORS_ALLOWED_ORIGINS", "*")
-X_APIGATEWAY_USERINFO_HEADER = "X-Apigateway-Api-Userinfo"
-USER_ID_CLAIM = "sub"  # Standard OpenID Connect claim for subject (user ID)
+# Tokens are envelope-encrypted, KMS is only called to unwrap their data keys.
+TOKEN_CIPHER = EnvelopeCipher()
 
-# CORS_HEADERS dictionary removed
+ALLOWED_ORIGINS = os.getenv("CORS_ALLOWED_ORIGINS", "*")
+X_UPDATE_TIME_HEADER = "X-Update-Time"  # Firestore update time of a write
+PROFILE_CACHE_CONTROL = "private, no-cache"
+
+# Decrypted GitHub tokens, kept in memory only to spare a KMS call per profile read.
+# Entries are keyed by user ID and only served while the stored ciphertext matches.
+TOKEN_CACHE_TTL_SECONDS = float(os.getenv("TOKEN_CACHE_TTL_SECONDS", "60"))
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "128"))
+_decrypted_token_cache = TTLCache(maxsize=TOKEN_CACHE_SIZE, ttl=TOKEN_CACHE_TTL_SECONDS)
+
+# Batch reads, reserved to the back-office subjects listed in BATCH_READER_USER_IDS.
+BATCH_READER_USER_IDS = frozenset(
+    user_id.strip()
+    for user_id in os.getenv("BATCH_READER_USER_IDS", "").split(",")
+    if user_id.strip()
+)
+BATCH_MAX_USERS = int(os.getenv("BATCH_MAX_USERS", "10000"))
+BATCH_GET_ALL_CHUNK_SIZE = int(os.getenv("BATCH_GET_ALL_CHUNK_SIZE", "300"))
+BATCH_DECRYPT_WORKERS = int(os.getenv("BATCH_DECRYPT_WORKERS", "8"))
+
+CORS = CorsPolicy(
+    allow_origin=ALLOWED_ORIGINS,
+    allow_headers="Content-Type, Authorization, Prefer, If-None-Match",
+    expose_headers=f"ETag, {X_UPDATE_TIME_HEADER}, Preference-Applied",
+)
 
 # --- Helper Functions ---
 
 
+def _get_db():
+    """Returns the Firestore client, creating it on first use."""
+    global db
+    if db is None:
+        db = firestore_client()
+        logging.info("Firestore client initialized.")
+    return db
+
+
+def _get_kms_client():
+    """Returns the KMS client, creating it on first use."""
+    global KMS_CLIENT
+    if KMS_CLIENT is None:
+        KMS_CLIENT = kms_client()
+        logging.info("KMS client initialized.")
+    return KMS_CLIENT
+
+
 def _decrypt_data_kms(ciphertext_b64: str) -> str | None:
-    """Decrypts base64 encoded ciphertext using KMS and returns plaintext string."""
+    """Decrypts a token encrypted with a KMS-wrapped data key (or directly with KMS)."""
     kms_key_name_val = os.getenv("KMS_KEY_NAME")
     kms_key_ring_val = os.getenv("KMS_KEY_RING")
     kms_location_val = os.getenv("KMS_LOCATION")
@@ -52,20 +108,30 @@ def _decrypt_data_kms(ciphertext_b64: str) -> str | None:
         )
         return None
     try:
-        key_path = KMS_CLIENT.crypto_key_path(
+        kms_client = _get_kms_client()
+        key_path = kms_client.crypto_key_path(
             gcp_project_val, kms_location_val, kms_key_ring_val, kms_key_name_val
         )
-        decoded_ciphertext = base64.b64decode(ciphertext_b64)
-        logging.info(f"Decrypting data with KMS key: {key_path}")
-        response = KMS_CLIENT.decrypt(name=key_path, ciphertext=decoded_ciphertext)
-        plaintext = response.plaintext.decode("utf-8")
-        logging.info("Data successfully decrypted with KMS.")
+        logging.debug("Decrypting data with KMS key: %s", key_path)
+        plaintext = TOKEN_CIPHER.decrypt(kms_client, key_path, ciphertext_b64)
+        logging.debug("Data successfully decrypted.")
         return plaintext
     except Exception as e:
-        logging.error(f"KMS decryption failed: {e}")
+        logging.error("KMS decryption failed: %s", e)
         return None
 
 
+def _decrypt_github_token(user_id: str, ciphertext_b64: str) -> str | None:
+    """Decrypts a user's GitHub token, reusing a recent decryption of the same ciphertext."""
+    cached = _decrypted_token_cache.get(user_id)
+    if cached is not None and cached[0] == ciphertext_b64:
+        return cached[1]
+    plaintext = _decrypt_data_kms(ciphertext_b64)
+    if plaintext is not None:
+        _decrypted_token_cache.set(user_id, (ciphertext_b64, plaintext))
+    return plaintext
+
+
 def _get_auth_user_info(req: request):
     """Extracts, decodes, and validates user authentication info from request headers.
 
@@ -73,25 +139,48 @@ def _get_auth_user_info(req: request):
         req (flask.Request): The Flask request object.
 
     Returns:
-        tuple: (dict, None) on success with user info, or (None, tuple) on error.
+        tuple: (UserClaims, None) on success with user info, or (None, tuple) on error.
                The error tuple is (error_dict, status_code).
     """
-    auth_info_header = req.headers.get(X_APIGATEWAY_USERINFO_HEADER)
-    if not auth_info_header:
-        return None, ({"error": "Authentication information not found."}, 401)
-
     try:
-        auth_info_header_padded = auth_info_header + "=" * (-len(auth_info_header) % 4)
-        auth_info_decoded = base64.b64decode(auth_info_header_padded).decode("utf-8")
-        auth_info_json = json.loads(auth_info_decoded)
+        return get_user_claims(req.headers), None
+    except AuthError as e:
+        if isinstance(e, InvalidUserInfoError):
+            logging.error("Error decoding authentication information: %s", e.__cause__)
+        return None, ({"error": e.message}, e.status_code)
+
+
+def _get_return_preference(req: request) -> str | None:
+    """Reads the 'return' preference of a Prefer header (RFC 7240).
+
+    Returns:
+        str | None: "minimal", "representation", or None when not requested.
+    """
+    for preference in req.headers.get("Prefer", "").split(","):
+        name, _, value = preference.strip().partition("=")
+        if name.strip().lower() == "return":
+            value = value.strip().strip('"').lower()
+            if value in ("minimal", "representation"):
+                return value
+    return None
+
 
-        if not auth_info_json.get(USER_ID_CLAIM):
-            msg = f"User ID claim ('{USER_ID_CLAIM}') not found in authentication information."
-            return None, ({"error": msg}, 400)
-        return auth_info_json, None
-    except (TypeError, ValueError, AttributeError, json.JSONDecodeError) as e:
-        logging.error("Error decoding authentication information: %s", e)
-        return None, ({"error": "Invalid authentication information format."}, 400)
+def _profile_etag(update_time, field_paths) -> str:
+    """Builds a strong ETag for a profile from its update time and field mask."""
+    version = f"{update_time.isoformat()}|{','.join(field_paths or ('*',))}"
+    return hashlib.blake2s(version.encode("utf-8"), digest_size=12).hexdigest()
+
+
+def _with_profile_caching(response, etag: str | None):
+    """Sets the ETag and Cache-Control headers of a profile response.
+
+    Profiles hold the decrypted GitHub token: only the browser may keep them,
+    and it has to revalidate its copy on each use.
+    """
+    if etag:
+        response.set_etag(etag)
+    response.headers["Cache-Control"] = PROFILE_CACHE_CONTROL
+    return response
 
 
 def _get_request_data(req: request):
@@ -121,12 +210,7 @@ def _get_request_data(req: request):
 @app.after_request
 def add_cors_headers(response):
     """Adds CORS headers to the response."""
-    response.headers["Access-Control-Allow-Origin"] = ALLOWED_ORIGINS
-    response.headers["Access-Control-Allow-Methods"] = "GET, POST, PUT, DELETE, OPTIONS"
-    response.headers["Access-Control-Allow-Headers"] = "Content-Type, Authorization"
-    response.headers["Access-Control-Max-Age"] = "3600"
-    logging.info(f"CORS headers added to response for origin: {ALLOWED_ORIGINS}")
-    return response
+    return CORS.apply(response)
 
 
 # --- Flask Routes ---
@@ -142,32 +226,51 @@ def get_user_data():
         error_dict, status_code = error_response_tuple
         return jsonify(error_dict), status_code
 
-    user_id = auth_info[USER_ID_CLAIM]
+    user_id = auth_info.user_id
+    try:
+        # The whole profile unless the client picks fields: POST and PUT accept
+        # any field, so no fixed list covers what the client may have written.
+        field_paths = parse_field_mask(request.args.get("fields"))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
     try:
-        user_doc_ref = db.collection("users").document(user_id)
-        user_doc = user_doc_ref.get()
+        user_doc = get_user_snapshot(_get_db(), user_id, field_paths)
 
         if user_doc.exists:
+            etag = _profile_etag(user_doc.update_time, field_paths)
+            if request.if_none_match.contains_weak(etag):
+                # Unchanged since the client's copy: skip decryption and serialization
+                return _with_profile_caching(make_response("", 304), etag)
+
             user_doc_data = user_doc.to_dict()
             encrypted_token = user_doc_data.get("github_access_token")
             if encrypted_token and isinstance(encrypted_token, str):
-                logging.info(
-                    f"Found github_access_token for user {user_id}, attempting decryption."
+                logging.debug(
+                    "Found github_access_token for user %s, attempting decryption.",
+                    user_id,
                 )
-                decrypted_token = _decrypt_data_kms(encrypted_token)
+                decrypted_token = _decrypt_github_token(user_id, encrypted_token)
                 if decrypted_token is not None:
                     user_doc_data["github_access_token"] = decrypted_token
-                    logging.info(
-                        f"Successfully decrypted github_access_token for user {user_id}."
+                    logging.debug(
+                        "Successfully decrypted github_access_token for user %s.",
+                        user_id,
                     )
                 else:
                     logging.error(
-                        f"Failed to decrypt github_access_token for user {user_id}."
+                        "Failed to decrypt github_access_token for user %s.", user_id
                     )
                     user_doc_data["github_access_token"] = None
                     user_doc_data["github_access_token_error"] = "decryption_failed"
-            return jsonify(user_doc_data), 200
+                    etag = None  # Don't let clients keep a failed decryption
+            else:
+                # GitHub was disconnected, drop any token decrypted earlier
+                _decrypted_token_cache.pop(user_id)
+            response = make_response(jsonify(user_doc_data), 200)
+            return _with_profile_caching(response, etag)
         else:
+            _decrypted_token_cache.pop(user_id)
             return make_response("", 204)  # No content
     except Exception as e:
         logging.error("Firestore GET error for user %s: %s", user_id, e)
@@ -183,7 +286,7 @@ def create_update_user_data():
     if error_response_tuple:
         error_dict, status_code = error_response_tuple
         return jsonify(error_dict), status_code
-    user_id = auth_info[USER_ID_CLAIM]
+    user_id = auth_info.user_id
 
     request_data, error_response_tuple = _get_request_data(request)
     if error_response_tuple:
@@ -201,17 +304,18 @@ def create_update_user_data():
         )
 
     try:
-        user_doc_ref = db.collection("users").document(user_id)
+        user_doc_ref = user_document(_get_db(), user_id)
         data_to_store = {
             "uid": user_id,
-            "email": auth_info.get("email"),
-            "displayName": auth_info.get("name"),
+            "email": auth_info.email,
+            "displayName": auth_info.name,
             **request_data,
         }
         data_to_store_cleaned = {
             k: v for k, v in data_to_store.items() if v is not None
         }
-        user_doc_ref.set(data_to_store_cleaned, merge=True)
+        with traced_firestore("set"):
+            user_doc_ref.set(data_to_store_cleaned, merge=True)
         logging.info("User document for %s created/updated via POST.", user_id)
         return jsonify(data_to_store_cleaned), 200
     except Exception as e:
@@ -228,7 +332,7 @@ def update_user_data_put():
     if error_response_tuple:
         error_dict, status_code = error_response_tuple
         return jsonify(error_dict), status_code
-    user_id = auth_info[USER_ID_CLAIM]
+    user_id = auth_info.user_id
 
     request_data, error_response_tuple = _get_request_data(request)
     if error_response_tuple:
@@ -241,18 +345,40 @@ def update_user_data_put():
             400,
         )
 
+    # Loaded with the Firestore client anyway, deferred to keep it off cold starts
+    from google.cloud import exceptions as google_exceptions
+
+    return_preference = _get_return_preference(request)
     try:
-        user_doc_ref = db.collection("users").document(user_id)
-        user_doc_ref.update(request_data)
-        updated_doc = user_doc_ref.get()
-        if not updated_doc.exists:
-            logging.error(
-                "Firestore PUT error: Document %s not found after presumed update.",
-                user_id,
-            )
-            return jsonify({"error": "Failed to retrieve document after update."}), 500
+        user_doc_ref = user_document(_get_db(), user_id)
+        with traced_firestore("update"):
+            write_result = user_doc_ref.update(request_data)
         logging.info("User document for %s updated via PUT.", user_id)
-        return jsonify(updated_doc.to_dict()), 200
+
+        if return_preference == "minimal":
+            response = make_response("", 204)
+        elif return_preference == "representation":
+            # Costs a second round trip, only for clients asking for the whole document
+            with traced_firestore("get"):
+                updated_doc = user_doc_ref.get()
+            if not updated_doc.exists:
+                logging.error(
+                    "Firestore PUT error: Document %s not found after presumed update.",
+                    user_id,
+                )
+                return (
+                    jsonify({"error": "Failed to retrieve document after update."}),
+                    500,
+                )
+            response = make_response(jsonify(updated_doc.to_dict()), 200)
+        else:
+            # The fields written are the changes, no need to read the document back
+            response = make_response(jsonify(request_data), 200)
+
+        if return_preference:
+            response.headers["Preference-Applied"] = f"return={return_preference}"
+        response.headers[X_UPDATE_TIME_HEADER] = write_result.update_time.isoformat()
+        return response
     except google_exceptions.NotFound:
         logging.warning("Firestore PUT: Document %s not found for update.", user_id)
         return jsonify({"error": f"User document {user_id} not found to update."}), 404
@@ -270,13 +396,17 @@ def delete_user_data():
     if error_response_tuple:
         error_dict, status_code = error_response_tuple
         return jsonify(error_dict), status_code
-    user_id = auth_info[USER_ID_CLAIM]
+    user_id = auth_info.user_id
 
     try:
-        user_doc_ref = db.collection("users").document(user_id)
-        doc_snapshot = user_doc_ref.get()
+        firestore_db = _get_db()
+        user_doc_ref = user_document(firestore_db, user_id)
+        doc_snapshot = get_user_snapshot(firestore_db, user_id, NO_FIELDS)
         if doc_snapshot.exists:
-            user_doc_ref.delete()
+            with traced_firestore("delete"):
+                user_doc_ref.delete()
+            delete_github_cache(firestore_db, user_id)
+            _decrypted_token_cache.pop(user_id)
             logging.info("Firestore document for user %s deleted.", user_id)
             return (
                 jsonify({"message": f"User data for {user_id} deleted successfully."}),
@@ -290,6 +420,117 @@ def delete_user_data():
         return jsonify({"error": "An error occurred while deleting user data."}), 500
 
 
+@app.route("/api/v1/users/batch", methods=["POST", "OPTIONS"])
+def batch_get_user_data():
+    """Streams the profiles of several users as NDJSON, for back-office tooling.
+
+    The JSON body holds "user_ids" (list of str) and optionally "fields" (list
+    of str, the profile fields by default) and "include_tokens" (bool, true by
+    default). Each output line is {"id", "found", "data"}.
+    """
+    if request.method == "OPTIONS":
+        return make_response("", 204)
+
+    auth_info, error_response_tuple = _get_auth_user_info(request)
+    if error_response_tuple:
+        error_dict, status_code = error_response_tuple
+        return jsonify(error_dict), status_code
+    if auth_info.user_id not in BATCH_READER_USER_IDS:
+        logging.warning("Batch read denied for user %s.", auth_info.user_id)
+        return jsonify({"error": "Not allowed to read other users' data."}), 403
+
+    request_data, error_response_tuple = _get_request_data(request)
+    if error_response_tuple:
+        error_dict, status_code = error_response_tuple
+        return jsonify(error_dict), status_code
+
+    user_ids = request_data.get("user_ids") if isinstance(request_data, dict) else None
+    if (
+        not isinstance(user_ids, list)
+        or not user_ids
+        or not all(isinstance(user_id, str) and user_id for user_id in user_ids)
+    ):
+        return (
+            jsonify({"error": "'user_ids' must be a non-empty list of user IDs."}),
+            400,
+        )
+    user_ids = list(dict.fromkeys(user_ids))  # Drop duplicates, keep the order
+    if len(user_ids) > BATCH_MAX_USERS:
+        return (
+            jsonify({"error": f"At most {BATCH_MAX_USERS} users can be read at once."}),
+            400,
+        )
+
+    include_tokens = request_data.get("include_tokens", True) is not False
+    fields = request_data.get("fields")
+    try:
+        field_paths = (
+            parse_field_mask(",".join(fields)) if isinstance(fields, list) else None
+        ) or PROFILE_FIELDS
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
+    if not include_tokens:
+        field_paths = tuple(f for f in field_paths if f != "github_access_token")
+
+    logging.info(
+        "Batch read of %d users requested by %s.", len(user_ids), auth_info.user_id
+    )
+    records = _stream_user_records(user_ids, field_paths, include_tokens)
+    return Response(stream_with_context(records), mimetype="application/x-ndjson")
+
+
+def _stream_user_records(user_ids, field_paths, include_tokens: bool):
+    """Yields one NDJSON line per user, reading them in chunks with get_all."""
+    firestore_db = _get_db()
+    with ThreadPoolExecutor(max_workers=BATCH_DECRYPT_WORKERS) as executor:
+        for start in range(0, len(user_ids), BATCH_GET_ALL_CHUNK_SIZE):
+            chunk = user_ids[start : start + BATCH_GET_ALL_CHUNK_SIZE]
+            try:
+                with traced_firestore("get_all"):
+                    snapshots = list(
+                        firestore_db.get_all(
+                            [user_document(firestore_db, user_id) for user_id in chunk],
+                            field_paths=list(field_paths),
+                        )
+                    )
+            except Exception as e:
+                logging.error("Firestore batch read error: %s", e)
+                yield app.json.dumps({"error": "Failed to read user data."}) + "\n"
+                return
+
+            records = {user_id: {"id": user_id, "found": False} for user_id in chunk}
+            for snapshot in snapshots:
+                if snapshot.exists:
+                    records[snapshot.id] = {
+                        "id": snapshot.id,
+                        "found": True,
+                        "data": snapshot.to_dict(),
+                    }
+            if include_tokens:
+                _decrypt_record_tokens(executor, records.values())
+            for record in records.values():
+                yield app.json.dumps(record) + "\n"
+
+
+def _decrypt_record_tokens(executor, records):
+    """Decrypts the GitHub tokens of batch records in parallel, in place."""
+    with_token = [
+        record
+        for record in records
+        if record["found"]
+        and isinstance(record["data"].get("github_access_token"), str)
+        and record["data"]["github_access_token"]
+    ]
+    tokens = executor.map(
+        _decrypt_data_kms,
+        [record["data"]["github_access_token"] for record in with_token],
+    )
+    for record, token in zip(with_token, tokens):
+        record["data"]["github_access_token"] = token
+        if token is None:
+            record["data"]["github_access_token_error"] = "decryption_failed"
+
+
 # --- Main Cloud Function Handler (delegates to Flask app) ---
 @functions_framework.http
 def handler(req: request):
@@ -297,5 +538,7 @@ def handler(req: request):
     Handles HTTP requests by dispatching them to the Flask app.
     This function is the entry point for Google Cloud Functions.
     """
+    if req.method == "OPTIONS":
+        return CORS.preflight_response()
     with app.request_context(req.environ):
         return app.full_dispatch_request()
@@ -0,0 +1,214 @@
+import datetime
+import gzip
+import json
+from unittest.mock import MagicMock, call
+
+import bulk
+import pytest
+from google.cloud import firestore
+
+
+def _snapshot(doc_id, data):
+    snapshot = MagicMock()
+    snapshot.id = doc_id
+    snapshot.to_dict.return_value = data
+    return snapshot
+
+
+class FakeUsersQuery:
+    """Serves the pages of an ID-ordered query over a fixed set of documents."""
+
+    def __init__(self, documents):
+        self.documents = sorted(documents.items())
+        self.cursors = []
+        self._limit = None
+        self._after = None
+
+    def order_by(self, field_path):
+        assert field_path == "__name__"
+        return self
+
+    def limit(self, count):
+        self._limit = count
+        self._after = None
+        return self
+
+    def start_after(self, cursor):
+        self._after = cursor["__name__"]
+        return self
+
+    def stream(self):
+        self.cursors.append(self._after)
+        remaining = [
+            _snapshot(doc_id, data)
+            for doc_id, data in self.documents
+            if self._after is None or doc_id > self._after
+        ]
+        return iter(remaining[: self._limit])
+
+
+def _mock_export_db(documents):
+    db = MagicMock()
+    query = FakeUsersQuery(documents)
+    db.collection.return_value = query
+    return db, query
+
+
+def _mock_import_db():
+    db = MagicMock()
+    db.collection.return_value.document.side_effect = lambda doc_id: f"ref:{doc_id}"
+    return db
+
+
+def _read_gzip_lines(path):
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        return [json.loads(line) for line in f]
+
+
+def test_encode_decode_round_trip():
+    db = MagicMock()
+    db.document.return_value = "rebuilt-reference"
+    reference = MagicMock(spec=firestore.DocumentReference)
+    reference.path = "users/other"
+    timestamp = datetime.datetime(2024, 5, 1, 12, 30, tzinfo=datetime.timezone.utc)
+    data = {
+        "email": "test@example.com",
+        "github_last_updated": timestamp,
+        "raw": b"\x00\x01",
+        "location": firestore.GeoPoint(48.85, 2.35),
+        "metadata": {"tags": [timestamp, 1, None]},
+        "friend": reference,
+    }
+
+    encoded = bulk.encode_value(data)
+    decoded = bulk.decode_value(db, json.loads(json.dumps(encoded)))
+
+    assert encoded["github_last_updated"] == {
+        "__type__": "timestamp",
+        "value": "2024-05-01T12:30:00+00:00",
+    }
+    assert decoded["github_last_updated"] == timestamp
+    assert decoded["raw"] == b"\x00\x01"
+    assert decoded["location"] == firestore.GeoPoint(48.85, 2.35)
+    assert decoded["metadata"] == {"tags": [timestamp, 1, None]}
+    assert decoded["friend"] == "rebuilt-reference"
+    db.document.assert_called_once_with("users/other")
+
+
+def test_export_paginates_to_gzip_ndjson(tmp_path):
+    documents = {f"user{i}": {"email": f"user{i}@example.com"} for i in range(5)}
+    db, query = _mock_export_db(documents)
+    output = tmp_path / "users.ndjson.gz"
+    checkpoint = tmp_path / "export.json"
+
+    exported = bulk.export_users(db, str(output), 2, str(checkpoint))
+
+    assert exported == 5
+    assert query.cursors == [None, "user1", "user3"]
+    assert _read_gzip_lines(output) == [
+        {"id": doc_id, "data": data} for doc_id, data in sorted(documents.items())
+    ]
+    state = json.loads(checkpoint.read_text())
+    assert state["last_id"] == "user4"
+    assert state["exported"] == 5
+
+
+def test_export_resumes_from_checkpoint(tmp_path):
+    documents = {f"user{i}": {"email": f"user{i}@example.com"} for i in range(4)}
+    db, _ = _mock_export_db({k: documents[k] for k in ("user0", "user1")})
+    output = tmp_path / "users.ndjson.gz"
+    checkpoint = tmp_path / "export.json"
+    bulk.export_users(db, str(output), 2, str(checkpoint))
+    # A crash in the middle of the next page leaves garbage after the checkpoint.
+    with open(output, "ab") as f:
+        f.write(b"\x1f\x8b truncated")
+
+    db, query = _mock_export_db(documents)
+    exported = bulk.export_users(db, str(output), 2, str(checkpoint))
+
+    assert exported == 4
+    assert query.cursors[0] == "user1"
+    assert [record["id"] for record in _read_gzip_lines(output)] == sorted(documents)
+
+
+def test_import_uses_bulk_writer_with_checkpoints(tmp_path):
+    db = _mock_import_db()
+    writer = db.bulk_writer.return_value
+    checkpoint = tmp_path / "import.json"
+    records = [{"id": f"user{i}", "data": {"n": i}} for i in range(5)]
+
+    report = bulk.import_users(
+        db, records, checkpoint_path=str(checkpoint), flush_every=2
+    )
+
+    assert report.imported == 5
+    assert report.failed_ids == []
+    options = db.bulk_writer.call_args.kwargs["options"]
+    assert options.mode == bulk.SendMode.parallel
+    assert writer.set.call_args_list == [
+        call(f"ref:user{i}", {"n": i}) for i in range(5)
+    ]
+    assert writer.flush.call_count == 3
+    writer.close.assert_called_once()
+    assert json.loads(checkpoint.read_text()) == {"imported": 5, "failed_ids": []}
+
+
+def test_import_skips_checkpointed_records(tmp_path):
+    db = _mock_import_db()
+    writer = db.bulk_writer.return_value
+    checkpoint = tmp_path / "import.json"
+    checkpoint.write_text(json.dumps({"imported": 3, "failed_ids": []}))
+    records = [{"id": f"user{i}", "data": {"n": i}} for i in range(5)]
+
+    report = bulk.import_users(db, records, checkpoint_path=str(checkpoint))
+
+    assert report.imported == 5
+    assert writer.set.call_args_list == [
+        call("ref:user3", {"n": 3}),
+        call("ref:user4", {"n": 4}),
+    ]
+
+
+def test_import_reports_writes_failing_after_max_attempts():
+    db = _mock_import_db()
+    writer = db.bulk_writer.return_value
+    failure = MagicMock(attempts=3, message="PERMISSION_DENIED")
+    failure.operation.reference.id = "user1"
+
+    def flush():
+        on_write_error = writer.on_write_error.call_args.args[0]
+        assert on_write_error(MagicMock(attempts=1), writer) is True
+        assert on_write_error(failure, writer) is False
+
+    writer.flush.side_effect = flush
+    records = [{"id": f"user{i}", "data": {}} for i in range(2)]
+
+    report = bulk.import_users(db, records, max_attempts=3)
+
+    assert report.imported == 1
+    assert report.failed_ids == ["user1"]
+
+
+def test_read_records_from_export(tmp_path):
+    documents = {"a": {"n": 1}, "b": {"n": 2}}
+    db, _ = _mock_export_db(documents)
+    output = tmp_path / "users.ndjson.gz"
+    bulk.export_users(db, str(output))
+
+    assert list(bulk.read_records(str(output))) == [
+        {"id": "a", "data": {"n": 1}},
+        {"id": "b", "data": {"n": 2}},
+    ]
+
+
+def test_parquet_round_trip(tmp_path):
+    pytest.importorskip("pyarrow")
+    documents = {"a": {"n": 1}, "b": {"nested": {"n": 2}}}
+    db, _ = _mock_export_db(documents)
+    output = tmp_path / "users.parquet"
+
+    assert bulk.export_users(db, str(output), 1) == 2
+    assert list(bulk.read_records(str(output))) == [
+        {"id": "a", "data": {"n": 1}},
+        {"id": "b", "data": {"nested": {"n": 2}}},
+    ]
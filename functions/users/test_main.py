@@ -1,11 +1,16 @@
 import base64
+import datetime
+import io
 import json
+import logging
 import os  # Ensure os is imported for patch.dict
 from unittest import mock
 from unittest.mock import MagicMock, patch  # Added patch and MagicMock
 
 import pytest
+from flask import Request
 from google.cloud import exceptions as google_exceptions
+from werkzeug.test import EnvironBuilder
 
 # Patch google.cloud.firestore.Client BEFORE main is imported.
 firestore_client_patcher = mock.patch("google.cloud.firestore.Client")
@@ -16,10 +21,17 @@ kms_client_patcher = mock.patch("google.cloud.kms.KeyManagementServiceClient")
 MockKmsClientGlobal = kms_client_patcher.start()
 
 import main as main_module  # Import the module itself
-# main.py's "db = firestore.Client()" and "KMS_CLIENT = kms.KeyManagementServiceClient()"
-# should use the globally patched mocks.
+# main.py creates its clients lazily, through the globally patched constructors.
 from main import app  # Import the Flask app object
 
+from shared import clients as clients_module
+from shared import logs as logs_module
+from shared.auth import decode_user_info
+from shared.cache import TTLCache
+from shared.crypto import EnvelopeCipher
+from shared.logs import (CloudLoggingFormatter, RequestLogContext,
+                         SamplingFilter, parse_sample_rates)
+
 # Define a client for the Flask app for use in tests
 client = app.test_client()
 
@@ -27,7 +39,7 @@ client = app.test_client()
 @pytest.fixture(autouse=True)
 def auto_reset_mocks(request):
     # Reset Firestore mock
-    mock_db_instance = main_module.db
+    mock_db_instance = main_module._get_db()
     if not isinstance(mock_db_instance, mock.Mock):
         pytest.fail(
             f"Patching error: main_module.db is type {type(mock_db_instance)}, not unittest.mock.Mock."
@@ -42,12 +54,12 @@ def auto_reset_mocks(request):
     mock_db_instance.collection.return_value = mock_collection_ref
 
     # Reset KMS mock
-    mock_kms_instance = main_module.KMS_CLIENT
+    mock_kms_instance = main_module._get_kms_client()
     if not isinstance(mock_kms_instance, mock.Mock):
         pytest.fail(
             f"Patching error: main_module.KMS_CLIENT is type {type(mock_kms_instance)}, not unittest.mock.Mock."
         )
-    mock_kms_instance.reset_mock()
+    mock_kms_instance.reset_mock(return_value=True, side_effect=True)
     # Setup default behaviors for KMS mock if needed
     mock_kms_instance.crypto_key_path.return_value = (
         "mock/kms/key/path"  # Ensure it returns a string
@@ -56,6 +68,10 @@ def auto_reset_mocks(request):
     mock_decrypt_response.plaintext = b"decrypted_default_token"
     mock_kms_instance.decrypt.return_value = mock_decrypt_response
 
+    # Decrypted tokens and data keys must not leak from one test to another
+    main_module._decrypted_token_cache.clear()
+    main_module.TOKEN_CIPHER = EnvelopeCipher()
+
     # Patch logging in main_module
     patcher_logging_info = patch.object(main_module.logging, "info")
     patcher_logging_warning = patch.object(main_module.logging, "warning")
@@ -114,6 +130,135 @@ def test_get_user_exists(auto_reset_mocks):
     )  # or specific if configured
     mock_db.collection.assert_called_once_with("users")
     mock_db.collection.return_value.document.assert_called_once_with("test-user-123")
+    # Without ?fields= the whole profile is read, whatever fields were written
+    mock_db.collection.return_value.document.return_value.get.assert_called_once_with(
+        field_paths=None
+    )
+
+
+def test_post_then_get_user_returns_organization_name(auto_reset_mocks):
+    mock_db = auto_reset_mocks["db"]
+    doc_ref = mock_db.collection.return_value.document.return_value
+    stored = {}
+    doc_ref.set.side_effect = lambda data, merge: stored.update(data)
+    doc_ref.get.return_value.exists = True
+    doc_ref.get.return_value.update_time = datetime.datetime(
+        2025, 6, 1, tzinfo=datetime.timezone.utc
+    )
+    doc_ref.get.return_value.to_dict.side_effect = lambda: dict(stored)
+    headers = _get_auth_headers(user_id="test-user-org")
+
+    post_response = client.post(
+        "/",
+        json={"cookieConsent": "true", "organizationName": "Innovatech Solutions"},
+        headers=headers,
+    )
+    get_response = client.get("/", headers=headers)
+
+    assert post_response.status_code == 200
+    assert get_response.status_code == 200
+    assert get_response.json["organizationName"] == "Innovatech Solutions"
+    assert get_response.json["cookieConsent"] == "true"
+
+
+def _mock_profile_snapshot(mock_db, data, update_time):
+    mock_doc_snapshot = (
+        mock_db.collection.return_value.document.return_value.get.return_value
+    )
+    mock_doc_snapshot.exists = True
+    mock_doc_snapshot.update_time = update_time
+    mock_doc_snapshot.to_dict.return_value = data
+    return mock_doc_snapshot
+
+
+@patch.object(main_module, "_decrypt_data_kms")
+def test_get_user_not_modified(mock_decrypt_kms_function, auto_reset_mocks):
+    mock_db = auto_reset_mocks["db"]
+    update_time = datetime.datetime(2025, 6, 1, tzinfo=datetime.timezone.utc)
+    mock_doc_snapshot = _mock_profile_snapshot(
+        mock_db, {"uid": "test-user-etag", "github_access_token": "ct"}, update_time
+    )
+    mock_decrypt_kms_function.return_value = "decrypted_access_token"
+    headers = _get_auth_headers(user_id="test-user-etag")
+
+    first_response = client.get("/", headers=headers)
+    etag = first_response.headers["ETag"]
+    assert first_response.status_code == 200
+    assert not etag.startswith("W/")
+    assert first_response.headers["Cache-Control"] == "private, no-cache"
+
+    mock_decrypt_kms_function.reset_mock()
+    mock_doc_snapshot.to_dict.reset_mock()
+    main_module._decrypted_token_cache.clear()
+    response = client.get("/", headers={**headers, "If-None-Match": etag})
+
+    assert response.status_code == 304
+    assert response.data == b""
+    assert response.headers["ETag"] == etag
+    mock_decrypt_kms_function.assert_not_called()
+    mock_doc_snapshot.to_dict.assert_not_called()
+
+
+def test_get_user_modified_since_etag(auto_reset_mocks):
+    mock_db = auto_reset_mocks["db"]
+    headers = _get_auth_headers(user_id="test-user-etag")
+    mock_doc_snapshot = _mock_profile_snapshot(
+        mock_db,
+        {"uid": "test-user-etag"},
+        datetime.datetime(2025, 6, 1, tzinfo=datetime.timezone.utc),
+    )
+    etag = client.get("/", headers=headers).headers["ETag"]
+
+    mock_doc_snapshot.update_time = datetime.datetime(
+        2025, 6, 2, tzinfo=datetime.timezone.utc
+    )
+    response = client.get("/", headers={**headers, "If-None-Match": etag})
+
+    assert response.status_code == 200
+    assert response.json == {"uid": "test-user-etag"}
+    assert response.headers["ETag"] != etag
+
+
+@patch.object(main_module, "_decrypt_data_kms")
+def test_get_user_decryption_failure_has_no_etag(
+    mock_decrypt_kms_function, auto_reset_mocks
+):
+    mock_db = auto_reset_mocks["db"]
+    mock_decrypt_kms_function.return_value = None
+    _mock_profile_snapshot(
+        mock_db,
+        {"uid": "test-user-etag", "github_access_token": "ct"},
+        datetime.datetime(2025, 6, 1, tzinfo=datetime.timezone.utc),
+    )
+
+    response = client.get("/", headers=_get_auth_headers(user_id="test-user-etag"))
+
+    assert response.status_code == 200
+    assert "ETag" not in response.headers
+
+
+def test_get_user_with_field_mask(auto_reset_mocks):
+    mock_db = auto_reset_mocks["db"]
+    doc_ref = mock_db.collection.return_value.document.return_value
+    doc_ref.get.return_value.exists = True
+    doc_ref.get.return_value.to_dict.return_value = {"metadata": {"theme": "dark"}}
+
+    headers = _get_auth_headers(user_id="test-user-fields")
+    response = client.get("/?fields=metadata", headers=headers)
+
+    assert response.status_code == 200
+    assert response.json == {"metadata": {"theme": "dark"}}
+    doc_ref.get.assert_called_once_with(field_paths=["metadata"])
+
+
+def test_get_user_with_invalid_field_mask(auto_reset_mocks):
+    mock_db = auto_reset_mocks["db"]
+    headers = _get_auth_headers(user_id="test-user-fields")
+    response = client.get("/?fields=metadata.theme", headers=headers)
+
+    assert response.status_code == 400
+    assert response.json["error"] == "Invalid field name: 'metadata.theme'."
+    mock_db.collection.assert_not_called()
 
 
 # --- Tests for KMS Decryption ---
@@ -196,6 +341,70 @@ def test_get_user_with_encrypted_token_failure(
     mock_decrypt_kms_function.assert_called_once_with("another_encrypted_token_base64")
 
 
+KMS_ENV = {
+    "KMS_KEY_NAME": "test-key",
+    "KMS_KEY_RING": "test-key-ring",
+    "KMS_LOCATION": "test-location",
+    "GOOGLE_CLOUD_PROJECT": "test-gcp-project",
+}
+
+
+def _encrypt_with_fake_kms(mock_kms, plaintext):
+    """Envelope-encrypts plaintext the way github-integration does, with a fake KMS."""
+    wrapped_keys = {}
+
+    def fake_encrypt(name, plaintext):
+        wrapped_keys[b"wrapped_data_key"] = plaintext
+        return mock.Mock(ciphertext=b"wrapped_data_key")
+
+    mock_kms.encrypt.side_effect = fake_encrypt
+    mock_kms.decrypt.side_effect = lambda name, ciphertext: mock.Mock(
+        plaintext=wrapped_keys[ciphertext]
+    )
+    return EnvelopeCipher().encrypt(mock_kms, "mock/kms/key/path", plaintext)
+
+
+@patch.dict(os.environ, KMS_ENV)
+def test_decrypt_data_kms_envelope(auto_reset_mocks):
+    mock_kms = auto_reset_mocks["kms"]
+    stored = _encrypt_with_fake_kms(mock_kms, "github_token")
+
+    assert main_module._decrypt_data_kms(stored) == "github_token"
+    assert main_module._decrypt_data_kms(stored) == "github_token"
+    # The data key is unwrapped once, tokens are decrypted locally
+    mock_kms.decrypt.assert_called_once_with(
+        name="mock/kms/key/path", ciphertext=b"wrapped_data_key"
+    )
+
+
+@patch.dict(os.environ, KMS_ENV)
+def test_decrypt_data_kms_legacy_ciphertext(auto_reset_mocks):
+    mock_kms = auto_reset_mocks["kms"]
+    legacy_ciphertext = base64.b64encode(b"kms_ciphertext").decode("utf-8")
+
+    assert main_module._decrypt_data_kms(legacy_ciphertext) == "decrypted_default_token"
+    mock_kms.decrypt.assert_called_once_with(
+        name="mock/kms/key/path", ciphertext=b"kms_ciphertext"
+    )
+
+
+@patch.dict(os.environ, KMS_ENV)
+def test_decrypt_data_kms_tampered_envelope(auto_reset_mocks):
+    mock_kms = auto_reset_mocks["kms"]
+    stored = _encrypt_with_fake_kms(mock_kms, "github_token")
+    assert main_module._decrypt_data_kms(stored) == "github_token"
+    header, payload = stored.rsplit(":", 1)
+    tampered = base64.b64decode(payload)
+    tampered = tampered[:-1] + bytes([tampered[-1] ^ 1])
+
+    assert (
+        main_module._decrypt_data_kms(
+            f"{header}:{base64.b64encode(tampered).decode('utf-8')}"
+        )
+        is None
+    )
+
+
 def test_get_user_no_github_token(auto_reset_mocks):
     mock_db = auto_reset_mocks["db"]
     mock_kms = auto_reset_mocks["kms"]
@@ -241,6 +450,89 @@ def test_get_user_github_token_not_string(auto_reset_mocks):
     mock_kms.decrypt.assert_not_called()
 
 
+@patch.object(main_module, "_decrypt_data_kms")
+def test_get_user_token_decryption_is_cached(
+    mock_decrypt_kms_function, auto_reset_mocks
+):
+    mock_db = auto_reset_mocks["db"]
+    mock_decrypt_kms_function.return_value = "decrypted_access_token"
+    mock_doc_snapshot = (
+        mock_db.collection.return_value.document.return_value.get.return_value
+    )
+    mock_doc_snapshot.exists = True
+    mock_doc_snapshot.to_dict.side_effect = lambda: {
+        "uid": "test-user-cache",
+        "github_access_token": "cached_encrypted_token_base64",
+    }
+
+    headers = _get_auth_headers(user_id="test-user-cache")
+    first_response = client.get("/", headers=headers)
+    second_response = client.get("/", headers=headers)
+
+    assert first_response.json["github_access_token"] == "decrypted_access_token"
+    assert second_response.json["github_access_token"] == "decrypted_access_token"
+    mock_decrypt_kms_function.assert_called_once_with("cached_encrypted_token_base64")
+
+
+@patch.object(main_module, "_decrypt_data_kms")
+def test_get_user_token_cache_follows_ciphertext(
+    mock_decrypt_kms_function, auto_reset_mocks
+):
+    mock_db = auto_reset_mocks["db"]
+    mock_decrypt_kms_function.side_effect = ["old_token", "new_token"]
+    mock_doc_snapshot = (
+        mock_db.collection.return_value.document.return_value.get.return_value
+    )
+    mock_doc_snapshot.exists = True
+    headers = _get_auth_headers(user_id="test-user-reconnect")
+
+    mock_doc_snapshot.to_dict.return_value = {"github_access_token": "old_ciphertext"}
+    assert client.get("/", headers=headers).json["github_access_token"] == "old_token"
+
+    # Reconnecting GitHub stores a new ciphertext
+    mock_doc_snapshot.to_dict.return_value = {"github_access_token": "new_ciphertext"}
+    assert client.get("/", headers=headers).json["github_access_token"] == "new_token"
+    assert mock_decrypt_kms_function.call_count == 2
+
+
+@patch.object(main_module, "_decrypt_data_kms")
+def test_get_user_disconnected_clears_cached_token(
+    mock_decrypt_kms_function, auto_reset_mocks
+):
+    mock_db = auto_reset_mocks["db"]
+    mock_decrypt_kms_function.return_value = "decrypted_access_token"
+    mock_doc_snapshot = (
+        mock_db.collection.return_value.document.return_value.get.return_value
+    )
+    mock_doc_snapshot.exists = True
+    headers = _get_auth_headers(user_id="test-user-disconnect")
+
+    mock_doc_snapshot.to_dict.return_value = {"github_access_token": "ciphertext"}
+    client.get("/", headers=headers)
+    assert len(main_module._decrypted_token_cache) == 1
+
+    mock_doc_snapshot.to_dict.return_value = {"github_connected": False}
+    response = client.get("/", headers=headers)
+
+    assert "github_access_token" not in response.json
+    assert len(main_module._decrypted_token_cache) == 0
+
+
+def test_ttl_cache_expires_and_evicts_entries():
+    now = [0.0]
+    cache = TTLCache(maxsize=2, ttl=10, timer=lambda: now[0])
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")  # "a" becomes the most recently used entry
+    cache.set("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    now[0] = 10.0
+    assert cache.get("a") is None
+    assert cache.get("c") is None
+
+
 # --- POST Tests ---
 def test_post_user_valid_data(auto_reset_mocks):
     mock_db = auto_reset_mocks["db"]
@@ -313,6 +605,9 @@ def test_post_user_no_json_body(auto_reset_mocks):
 
 
 # --- PUT Tests ---
+UPDATE_TIME = datetime.datetime(2025, 6, 1, 12, 0, tzinfo=datetime.timezone.utc)
+
+
 def test_put_user_valid_data(auto_reset_mocks):
     mock_db = auto_reset_mocks["db"]
     user_id = "test-user-put"
@@ -327,7 +622,7 @@ def test_put_user_valid_data(auto_reset_mocks):
     )
 
     doc_ref = mock_db.collection.return_value.document.return_value
-    doc_ref.update.return_value = None  # update itself returns None
+    doc_ref.update.return_value = mock.Mock(update_time=UPDATE_TIME)
     doc_ref.get.return_value = (
         mock_updated_doc_snapshot  # get after update returns the new snapshot
     )
@@ -336,7 +631,47 @@ def test_put_user_valid_data(auto_reset_mocks):
 
     assert response.status_code == 200
     assert response.json == request_data
+    assert response.headers["X-Update-Time"] == UPDATE_TIME.isoformat()
     doc_ref.update.assert_called_once_with(request_data)
+    # The changed fields are returned without reading the document back
+    doc_ref.get.assert_not_called()
+
+
+def test_put_user_prefer_representation(auto_reset_mocks):
+    mock_db = auto_reset_mocks["db"]
+    headers = _get_auth_headers(user_id="test-user-put")
+    headers["Prefer"] = "return=representation"
+    request_data = {"displayName": "Updated Name"}
+    full_document = {"uid": "test-user-put", "displayName": "Updated Name"}
+
+    doc_ref = mock_db.collection.return_value.document.return_value
+    doc_ref.update.return_value = mock.Mock(update_time=UPDATE_TIME)
+    doc_ref.get.return_value.exists = True
+    doc_ref.get.return_value.to_dict.return_value = full_document
+
+    response = client.put("/", json=request_data, headers=headers)
+
+    assert response.status_code == 200
+    assert response.json == full_document
+    assert response.headers["Preference-Applied"] == "return=representation"
+    doc_ref.get.assert_called_once()
+
+
+def test_put_user_prefer_minimal(auto_reset_mocks):
+    mock_db = auto_reset_mocks["db"]
+    headers = _get_auth_headers(user_id="test-user-put")
+    headers["Prefer"] = "return=minimal"
+
+    doc_ref = mock_db.collection.return_value.document.return_value
+    doc_ref.update.return_value = mock.Mock(update_time=UPDATE_TIME)
+
+    response = client.put("/", json={"emailMarketing": True}, headers=headers)
+
+    assert response.status_code == 204
+    assert response.data == b""
+    assert response.headers["Preference-Applied"] == "return=minimal"
+    assert response.headers["X-Update-Time"] == UPDATE_TIME.isoformat()
+    doc_ref.get.assert_not_called()
 
 
 def test_put_user_not_found(auto_reset_mocks):
@@ -381,6 +716,10 @@ def test_delete_user_exists(auto_reset_mocks):
     assert response.status_code == 200
     assert response.json["message"] == f"User data for {user_id} deleted successfully."
     mock_db.collection.return_value.document.return_value.delete.assert_called_once()
+    # Firestore keeps subcollections, the agent's GitHub cache is deleted too
+    doc_ref = mock_db.collection.return_value.document.return_value
+    doc_ref.collection.assert_called_once_with("github_cache")
+    mock_db.recursive_delete.assert_called_once_with(doc_ref.collection.return_value)
 
 
 def test_delete_user_not_exists(auto_reset_mocks):
@@ -397,6 +736,7 @@ def test_delete_user_not_exists(auto_reset_mocks):
     assert response.status_code == 204
     assert response.data == b""  # make_response('', 204)
     mock_db.collection.return_value.document.return_value.delete.assert_not_called()
+    mock_db.recursive_delete.assert_not_called()
 
 
 # --- Generic Error and Auth Tests ---
@@ -488,3 +828,248 @@ def test_auth_header_missing_user_id_claim(auto_reset_mocks):
         == "User ID claim ('sub') not found in authentication information."
     )
     mock_db.collection.assert_not_called()
+
+
+def test_auth_header_decoded_once_per_token(auto_reset_mocks):
+    mock_db = auto_reset_mocks["db"]
+    mock_db.collection.return_value.document.return_value.get.return_value.exists = (
+        False
+    )
+    headers = _get_auth_headers(user_id="test-user-cached")
+    decode_user_info.cache_clear()
+
+    client.get("/", headers=headers)
+    client.get("/", headers=headers)
+
+    cache_info = decode_user_info.cache_info()
+    assert cache_info.misses == 1
+    assert cache_info.hits == 1
+    mock_db.collection.return_value.document.assert_called_with("test-user-cached")
+
+
+def test_cached_auth_claims_are_read_only():
+    headers = _get_auth_headers(user_id="test-user-read-only")
+    claims = decode_user_info(headers["X-Apigateway-Api-Userinfo"])
+
+    assert claims.user_id == "test-user-read-only"
+    assert claims.email == "test@example.com"
+    with pytest.raises(TypeError):
+        claims.claims["sub"] = "someone-else"
+
+
+# --- Batch Tests ---
+def _mock_batch_snapshot(user_id, data=None):
+    snapshot = mock.Mock()
+    snapshot.id = user_id
+    snapshot.exists = data is not None
+    snapshot.to_dict.return_value = data
+    return snapshot
+
+
+def _read_ndjson(response):
+    return [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+
+def test_batch_get_denied_for_regular_user(auto_reset_mocks):
+    mock_db = auto_reset_mocks["db"]
+    headers = _get_auth_headers(user_id="regular-user")
+
+    response = client.post(
+        "/api/v1/users/batch", json={"user_ids": ["user-a"]}, headers=headers
+    )
+
+    assert response.status_code == 403
+    mock_db.get_all.assert_not_called()
+
+
+@patch.object(main_module, "BATCH_READER_USER_IDS", frozenset({"back-office"}))
+@patch.object(main_module, "_decrypt_data_kms")
+def test_batch_get_streams_profiles(mock_decrypt_kms_function, auto_reset_mocks):
+    mock_db = auto_reset_mocks["db"]
+    mock_db.get_all.return_value = [
+        _mock_batch_snapshot("user-a", {"uid": "user-a", "github_access_token": "ct"}),
+        _mock_batch_snapshot("user-b"),
+    ]
+    mock_decrypt_kms_function.return_value = "decrypted_access_token"
+    headers = _get_auth_headers(user_id="back-office")
+
+    response = client.post(
+        "/api/v1/users/batch",
+        json={"user_ids": ["user-a", "user-b", "user-a"]},
+        headers=headers,
+    )
+
+    assert response.status_code == 200
+    assert response.mimetype == "application/x-ndjson"
+    assert _read_ndjson(response) == [
+        {
+            "id": "user-a",
+            "found": True,
+            "data": {"uid": "user-a", "github_access_token": "decrypted_access_token"},
+        },
+        {"id": "user-b", "found": False},
+    ]
+    # Both users are read with a single get_all call
+    mock_db.get_all.assert_called_once()
+    assert len(mock_db.get_all.call_args[0][0]) == 2
+    mock_decrypt_kms_function.assert_called_once_with("ct")
+
+
+@patch.object(main_module, "BATCH_READER_USER_IDS", frozenset({"back-office"}))
+@patch.object(main_module, "BATCH_GET_ALL_CHUNK_SIZE", 2)
+@patch.object(main_module, "_decrypt_data_kms")
+def test_batch_get_without_tokens(mock_decrypt_kms_function, auto_reset_mocks):
+    mock_db = auto_reset_mocks["db"]
+    mock_db.get_all.side_effect = [
+        [_mock_batch_snapshot("user-0", {"uid": "user-0"})],
+        [_mock_batch_snapshot("user-2", {"uid": "user-2"})],
+    ]
+    headers = _get_auth_headers(user_id="back-office")
+
+    response = client.post(
+        "/api/v1/users/batch",
+        json={"user_ids": ["user-0", "user-1", "user-2"], "include_tokens": False},
+        headers=headers,
+    )
+
+    assert response.status_code == 200
+    assert [(r["id"], r["found"]) for r in _read_ndjson(response)] == [
+        ("user-0", True),
+        ("user-1", False),
+        ("user-2", True),
+    ]
+    assert mock_db.get_all.call_count == 2
+    for call in mock_db.get_all.call_args_list:
+        assert "github_access_token" not in call[1]["field_paths"]
+    mock_decrypt_kms_function.assert_not_called()
+
+
+@patch.object(main_module, "BATCH_READER_USER_IDS", frozenset({"back-office"}))
+def test_batch_get_invalid_user_ids(auto_reset_mocks):
+    headers = _get_auth_headers(user_id="back-office")
+
+    response = client.post(
+        "/api/v1/users/batch", json={"user_ids": []}, headers=headers
+    )
+
+    assert response.status_code == 400
+    assert response.json["error"] == "'user_ids' must be a non-empty list of user IDs."
+
+
+def test_clients_are_created_on_first_use(monkeypatch):
+    monkeypatch.setattr(main_module, "db", None)
+    monkeypatch.setattr(main_module, "KMS_CLIENT", None)
+
+    response = client.options("/")
+
+    assert response.status_code == 204
+    assert main_module.db is None
+    assert main_module.KMS_CLIENT is None
+
+    response = client.delete("/", headers=_get_auth_headers(user_id="lazy-user"))
+
+    assert response.status_code in (200, 204)
+    assert main_module.db is not None
+    assert main_module.KMS_CLIENT is None  # DELETE never decrypts a token
+
+
+def test_client_factories_can_name_a_stand_in(monkeypatch):
+    monkeypatch.setattr(main_module, "db", None)
+    monkeypatch.setattr(
+        clients_module, "FIRESTORE_CLIENT_FACTORY", "collections:OrderedDict"
+    )
+
+    assert type(main_module._get_db()).__name__ == "OrderedDict"
+
+    monkeypatch.setattr(clients_module, "KMS_CLIENT_FACTORY", "collections")
+    with pytest.raises(ValueError):
+        clients_module.kms_client()
+
+
+def test_preflight_fast_path_skips_flask_dispatch(monkeypatch):
+    monkeypatch.setattr(main_module, "db", None)
+    monkeypatch.setattr(main_module, "KMS_CLIENT", None)
+    monkeypatch.setattr(
+        main_module.app,
+        "request_context",
+        MagicMock(side_effect=AssertionError("Flask context built for a preflight")),
+    )
+    preflight = Request(
+        EnvironBuilder(
+            path="/", method="OPTIONS", headers={"Origin": "http://localhost:3000"}
+        ).get_environ()
+    )
+
+    response = main_module.handler(preflight)
+
+    assert response.status_code == 204
+    assert response.headers["Access-Control-Allow-Origin"] == "*"
+    assert "If-None-Match" in response.headers["Access-Control-Allow-Headers"]
+    assert "ETag" in response.headers["Access-Control-Expose-Headers"]
+    assert main_module.db is None
+    assert main_module.KMS_CLIENT is None
+
+
+def _capture_structured_logs():
+    stream = io.StringIO()
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(CloudLoggingFormatter())
+    handler.addFilter(SamplingFilter())
+    return stream, handler
+
+
+def test_structured_logs_carry_request_id_and_trace(monkeypatch):
+    monkeypatch.setenv("GOOGLE_CLOUD_PROJECT", "test-project")
+    stream, handler = _capture_structured_logs()
+    headers = {
+        "X-Request-Id": "req-123",
+        "X-Cloud-Trace-Context": "abcdef0123456789/1;o=1",
+    }
+
+    with app.test_request_context("/", headers=headers):
+        app.preprocess_request()
+        try:
+            logger = logging.getLogger("test.structured")
+            logger.addHandler(handler)
+            logger.warning("Profile %s missing", "u1", extra={"json_fields": {"a": 1}})
+        finally:
+            logger.removeHandler(handler)
+            app.do_teardown_request()
+
+    entry = json.loads(stream.getvalue())
+    assert entry["severity"] == "WARNING"
+    assert entry["message"] == "Profile u1 missing"
+    assert entry["requestId"] == "req-123"
+    assert entry["logging.googleapis.com/trace"] == (
+        "projects/test-project/traces/abcdef0123456789"
+    )
+    assert entry["a"] == 1
+
+
+def test_request_id_is_echoed_in_response():
+    response = client.options("/", headers={"X-Request-Id": "req-456"})
+    assert response.headers["X-Request-Id"] == "req-456"
+
+
+def test_unsampled_requests_drop_info_logs_only():
+    stream, handler = _capture_structured_logs()
+    logger = logging.getLogger("test.sampling")
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    context = RequestLogContext(
+        request_id="req-789", trace=None, route="/", sampled=False
+    )
+    token = logs_module._request_context.set(context)
+    try:
+        logger.info("routine %s", "detail")
+        logger.error("failure")
+    finally:
+        logs_module._request_context.reset(token)
+        logger.removeHandler(handler)
+
+    lines = stream.getvalue().splitlines()
+    assert [json.loads(line)["message"] for line in lines] == ["failure"]
+
+
+def test_parse_sample_rates():
+    assert parse_sample_rates("/a=0.1, /b=2,/c=oops,=0.5") == {"/a": 0.1, "/b": 1.0}
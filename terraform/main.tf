@@ -172,6 +172,24 @@ module "service_account_users_fn" {
   ]
 }
 
+# Service account for the backend agent, which reads the users' GitHub data.
+module "service_account_agent" {
+  source = "./modules/service_account"
+
+  sa_id = "reomir-agent"
+
+  gcp_project = google_project.reomir.project_id
+
+  roles = [
+    "roles/datastore.user",
+    "roles/aiplatform.user"
+  ]
+
+  depends_on = [
+    module.api
+  ]
+}
+
 # Service account for API Gateway to invoke backend services.
 module "service_account_apigw" {
   source = "./modules/service_account"
@@ -291,7 +309,7 @@ module "kms_config" {
   key_ring_name   = "reomir-keyring"
   crypto_key_name = "reomir-key"
   sa_encrypter    = [module.service_account_gh_fn.email]
-  sa_decrypter    = [module.service_account_users_fn.email]
+  sa_decrypter    = [module.service_account_users_fn.email, module.service_account_agent.email]
 
   depends_on = [
     module.api,
@@ -327,14 +345,33 @@ module "cloudrun_agent" {
       name  = "GOOGLE_CLOUD_LOCATION",
       value = local.region
     },
-
+    {
+      name  = "KMS_KEY_NAME",
+      value = module.kms_config.crypto_key_name
+    },
+    {
+      name  = "KMS_KEY_RING",
+      value = module.kms_config.key_ring_name
+    },
+    {
+      name  = "KMS_LOCATION",
+      value = local.region
+    },
+    {
+      # Sessions shared by every instance, see agent/sessions.py
+      name  = "SESSION_DB_URL",
+      value = "firestore://agent_sessions"
+    },
   ]
 
   memory = "1Gi"
 
+  service_account_email = module.service_account_agent.email
+
   depends_on = [
     module.api,
     module.repository,
+    module.service_account_agent,
   ]
 }
 
@@ -5,3 +5,16 @@ resource "google_firestore_database" "database" {
   type        = "FIRESTORE_NATIVE"
 
 }
+
+# Deletes the agent's sessions once their expire_at is past, see
+# agent/sessions.py. The field is only compared, it needs no index.
+resource "google_firestore_field" "agent_sessions_ttl" {
+  project    = var.gcp_project
+  database   = google_firestore_database.database.name
+  collection = "sessions"
+  field      = "expire_at"
+
+  ttl_config {}
+
+  index_config {}
+}